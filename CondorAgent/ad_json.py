@@ -0,0 +1,204 @@
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import re
+import logging
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import classad_expr
+
+
+################################################################################
+# GLOBALS
+################################################################################
+__doc__ = """ad_json.py
+
+Converts the text of a jobs response (see ScheddQuery.stream) to JSON as it
+is generated. With format=json the response is one object:
+
+    {"jobs": [{"ClusterId": 1, "ProcId": 0, "Owner": "alice", ...}, ...],
+     "syncToken": "5f0c...", "delta": true, "removed": ["12.0"],
+     "completedSince": 1361298177,
+     "history": [{...}, ...]}
+
+where the syncToken, delta and removed fields are only there for delta
+requests (see queue_delta), and completedSince and history only when
+history was asked for. With format=ndjson each job, history ad and field
+is a line of its own:
+
+    {"job": {"ClusterId": 1, ...}}
+    {"syncToken": "5f0c..."}
+    {"completedSince": 1361298177}
+    {"history": {"ClusterId": 1, ...}}
+
+Attribute values that are integers, reals, booleans or strings become JSON
+numbers, booleans and strings, and undefined becomes null. Anything else is
+an expression, which is given as a string the way condor_q -json gives
+them: "/Expr(RequestMemory * 2)/".
+"""
+
+FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+# the "-- Name: value" lines of a jobs response, and how their values are
+# converted. Others (such as the "-- Schedd:" banner of older condor_q
+# versions) are left out.
+FIELDS = {
+    'SyncToken': ('syncToken', lambda value: value),
+    'Delta': ('delta', lambda value: value.lower() == 'true'),
+    'Removed': ('removed', lambda value: value.split()),
+    'CompletedSince': ('completedSince', int),
+}
+
+INTEGER = re.compile(r'^-?\d+$')
+REAL = re.compile(r'^-?(\d+\.\d*|\.\d+|\d+)([eE][+-]?\d+)?$')
+STRING = re.compile(r'^"(?:[^"\\]|\\.)*"$')
+
+
+################################################################################
+# METHODS
+################################################################################
+def convertValue(text):
+    '''Returns the JSON value for the text of an attribute value.'''
+    text = text.strip()
+    if INTEGER.match(text):
+        return int(text)
+    if REAL.match(text):
+        return float(text)
+    if STRING.match(text):
+        return decodeString(classad_expr.parseString(text))
+    lowered = text.lower()
+    if lowered == 'true':
+        return True
+    if lowered == 'false':
+        return False
+    if lowered == 'undefined':
+        return None
+    return decodeString('/Expr(%s)/' % text)
+
+
+def decodeString(value):
+    '''Returns the unicode for a string value. Values that aren't UTF-8
+    are taken to be Latin-1, which can't fail.'''
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value.decode('latin-1')
+
+
+def encodeAd(pairs):
+    '''Returns the JSON object for an ad given as (name, value text) pairs,
+    with the attributes in the same order.'''
+    return '{' + ', '.join(['%s: %s' % (json.dumps(name), json.dumps(convertValue(value)))
+                            for name, value in pairs]) + '}'
+
+
+def parseLines(pieces):
+    '''Generates ("ad", pairs) for each ad and ("field", (name, value)) for
+    each "-- Name: value" line in the text generated in pieces.'''
+    pending = ''
+    pairs = []
+    for piece in pieces:
+        lines = (pending + piece).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            line = line.rstrip('\r')
+            if not line.strip():
+                if pairs:
+                    yield ('ad', pairs)
+                    pairs = []
+            elif line.startswith('-- '):
+                if pairs:
+                    yield ('ad', pairs)
+                    pairs = []
+                name, sep, value = line[3:].partition(':')
+                field = FIELDS.get(name.strip())
+                if field is None:
+                    logging.debug('Leaving out of the JSON response: %s' % line)
+                else:
+                    yield ('field', (field[0], field[1](value.strip())))
+            else:
+                split = line.split(' = ', 1)
+                if len(split) == 2:
+                    pairs.append((split[0].strip(), split[1]))
+    if pending.strip():
+        split = pending.split(' = ', 1)
+        if len(split) == 2:
+            pairs.append((split[0].strip(), split[1]))
+    if pairs:
+        yield ('ad', pairs)
+
+
+def streamJSON(pieces, format='json'):
+    '''Generates the jobs response text generated by pieces in the given
+    format (json or ndjson), as described above.'''
+    if format == 'ndjson':
+        section = 'job'
+        for kind, value in parseLines(pieces):
+            if kind == 'ad':
+                yield '{"%s": %s}\n' % (section, encodeAd(value))
+            else:
+                name, field_value = value
+                yield '{%s: %s}\n' % (json.dumps(name), json.dumps(field_value))
+                if name == 'completedSince':
+                    section = 'history'
+        return
+    if format != 'json':
+        raise Exception('Unknown format: %s' % format)
+    yield '{"jobs": ['
+    # whether the array being written has any ads in it yet, or None if
+    # there is no array open
+    array = False
+    for kind, value in parseLines(pieces):
+        if kind == 'ad':
+            if array is None:
+                # an ad after the delta fields with no completedSince before
+                # it (which ScheddQuery.stream never gives); it can only go
+                # in a new array
+                yield ', "history": ['
+                array = False
+            if array:
+                yield ',\n'
+            else:
+                yield '\n'
+            yield encodeAd(value)
+            array = True
+        else:
+            name, field_value = value
+            if array is not None:
+                yield '\n]'
+            yield ', %s: %s' % (json.dumps(name), json.dumps(field_value))
+            array = None
+            if name == 'completedSince':
+                yield ', "history": ['
+                array = False
+    if array is not None:
+        yield '\n]'
+    yield '}\n'
@@ -0,0 +1,72 @@
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import ad_json
+
+
+RESPONSE = '''-- Schedd: schedd.example.com : <10.0.0.1:9618>
+ClusterId = 1
+ProcId = 0
+Owner = "alice"
+Args = "say \\"hi\\""
+RemoteWallClockTime = 3600.0
+LeaveJobInQueue = false
+Rank = undefined
+Requirements = ( TARGET.Arch == "X86_64" )
+
+ClusterId = 1
+ProcId = 1
+
+-- SyncToken: abc
+-- Delta: true
+-- Removed: 2.0 2.1
+-- CompletedSince: 1361298177
+ClusterId = 3
+ProcId = 0
+CompletionDate = 1361298177
+
+'''
+
+
+def stream(format, piece_size=5):
+    # split the response in awkward places to check lines are put back together
+    pieces = [RESPONSE[i:i + piece_size] for i in range(0, len(RESPONSE), piece_size)]
+    return ''.join(ad_json.streamJSON(pieces, format))
+
+
+def test_json():
+    result = json.loads(stream('json'))
+    assert 2 == len(result['jobs'])
+    assert {'ClusterId': 1, 'ProcId': 0, 'Owner': 'alice', 'Args': 'say "hi"', 'RemoteWallClockTime': 3600.0,
+            'LeaveJobInQueue': False, 'Rank': None,
+            'Requirements': '/Expr(( TARGET.Arch == "X86_64" ))/'} == result['jobs'][0]
+    assert 'abc' == result['syncToken']
+    assert True is result['delta']
+    assert ['2.0', '2.1'] == result['removed']
+    assert 1361298177 == result['completedSince']
+    assert [{'ClusterId': 3, 'ProcId': 0, 'CompletionDate': 1361298177}] == result['history']
+    assert result == json.loads(stream('json', 1000))
+
+    # no jobs and no history
+    assert {'jobs': []} == json.loads(''.join(ad_json.streamJSON([])))
+    assert {'jobs': [], 'completedSince': 5, 'history': []} == \
+        json.loads(''.join(ad_json.streamJSON(['-- CompletedSince: 5\n'])))
+
+
+def test_ndjson():
+    lines = [json.loads(line) for line in stream('ndjson').splitlines()]
+    assert ['job', 'job', 'syncToken', 'delta', 'removed', 'completedSince', 'history'] == \
+        [line.keys()[0] for line in lines]
+    assert 1 == lines[1]['job']['ProcId']
+    assert 3 == lines[-1]['history']['ClusterId']
+
+
+def test_convert_value():
+    assert -5 == ad_json.convertValue('-5')
+    assert 1.5e3 == ad_json.convertValue('1.5e3')
+    assert True is ad_json.convertValue('TRUE')
+    assert u'caf\xe9' == ad_json.convertValue('"caf\xc3\xa9"')
+    assert u'caf\xe9' == ad_json.convertValue('"caf\xe9"')
+    assert '/Expr(RequestMemory * 2)/' == ad_json.convertValue('RequestMemory * 2')
+    assert '/Expr({ 1, 2 })/' == ad_json.convertValue('{ 1, 2 }')
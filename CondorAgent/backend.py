@@ -0,0 +1,479 @@
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import os
+import re
+import shlex
+import logging
+import threading
+import util
+import classad_expr
+try:
+    import htcondor
+    import classad
+except ImportError:
+    htcondor = None
+
+
+################################################################################
+# GLOBALS
+################################################################################
+__doc__ = """backend.py
+
+How the agent talks to HTCondor. ScheddQuery, the submit proxy, the local
+submission cleaner and getCondorConfigVal go through the backend returned by
+getBackend, which is chosen with CONDOR_AGENT_BACKEND:
+
+    cli       runs the HTCondor command line tools (the default)
+    bindings  uses the HTCondor Python bindings in the agent's process, for
+              what they can do, and the command line tools for the rest
+    fake      answers from memory, for tests and benchmarks
+
+Job and schedd ads are returned as the text condor_q -long and
+condor_status -long give, whichever backend is used.
+"""
+
+BACKENDS = ('cli', 'bindings', 'fake')
+
+# the HTCondor version the fake backend reports unless CONDOR_VERSION is set
+FAKE_VERSION = '8.8.1'
+
+# the backend in use, see getBackend
+_backend = None
+_backendLock = threading.Lock()
+# set in the thread choosing the backend, which reads CONDOR_AGENT_BACKEND
+# with the command line tools
+_choosing = threading.local()
+
+
+################################################################################
+# CLASSES
+################################################################################
+class CommandBackend:
+    '''Runs the HTCondor command line tools.'''
+
+    name = 'cli'
+
+    def queryQueue(self, schedd_name, jobs, attrs=None, constraint=None, all_users=False):
+        '''Generates the condor_q -long text of the schedd's jobs in pieces.
+        jobs is a condor_q jobs argument, attrs a list of attribute names to
+        return (all of them if it is None) and constraint a ClassAd
+        expression.'''
+        q_cmd = ['condor_q']
+        if all_users:
+            q_cmd.append('-allusers')
+        q_cmd.extend(['-name', schedd_name, '-long'] + jobs.split())
+        if attrs is not None:
+            q_cmd.extend(['-attributes', ','.join(attrs)])
+        if constraint is not None:
+            q_cmd.extend(['-constraint', constraint])
+        logging.info("condor_q command: %s" % util.commandText(q_cmd))
+        # We really should be checking the return code but that's not available.
+        return util.streamCommand(q_cmd, error_message="Executing condor_q command:\n%s")
+
+    def queryHistoryFile(self, history_file, jobs, constraint=None):
+        '''Returns the condor_history -long text of the jobs in a history
+        file.'''
+        history_cmd = ['condor_history', '-l', '-f', history_file] + jobs.split()
+        if constraint is not None:
+            history_cmd.extend(['-constraint', constraint])
+        history_data, err_data = util.runCommand(history_cmd)
+        if err_data != '':
+            raise Exception("Executing condor_history command:\n%s" %err_data)
+        return history_data
+
+    def scheddAd(self, schedd_name):
+        '''Returns the text of the schedd's ad from the collector.'''
+        cmd = ['condor_status', '-schedd', '-long', schedd_name]
+        data, err = util.runCommand(cmd)
+        if err:
+            raise Exception("Executing condor_status command:\n%s" % err)
+        if not data.strip():
+            raise Exception("No ad found for schedd %s" % schedd_name)
+        return data
+
+    def scheddNames(self, host):
+        '''Returns the names of the schedds the collector knows of on the
+        host, one per line.'''
+        cmd = ['condor_status', '-schedd', '-format', '%s\\n', 'Name', '-constraint', 'Machine == "%s"' % host]
+        data, err = util.runCommand(cmd)
+        if err:
+            raise Exception("Executing condor_status command:\n%s" % err)
+        if not data.strip():
+            raise Exception("No schedds found on %s" % host)
+        return data
+
+    def versionText(self):
+        '''Returns what condor_version prints, starting with
+        "$CondorVersion: x.y.z ".'''
+        (rc, out, err) = util.runCommand2(['condor_version'])
+        if rc != 0:
+            raise Exception("Executing condor_version command:\n%s" % err)
+        return out
+
+    def submit(self, submit_file, queue_name=None, additional_arguments=[], cwd=None):
+        '''Submits the jobs in a submit file. Returns (return code, output,
+        errors) with condor_submit's "submitted to cluster N" in the
+        output. Each of additional_arguments is split into words as the
+        shell would, as they were when condor_submit was run with a shell,
+        so "-a foo=bar" is still two arguments.'''
+        submit_cmd = ['condor_submit']
+        if queue_name:
+            submit_cmd.append('-name')
+            submit_cmd.append('%s' % queue_name)
+        for argument in additional_arguments:
+            submit_cmd.extend(shlex.split(argument, posix=os.name != 'nt'))
+        submit_cmd.append('%s' % submit_file)
+        logging.debug("CondorAgent.backend.submit(): condor_submit command: %s" % util.commandText(submit_cmd))
+        return util.runCommand2(submit_cmd, cwd=cwd)
+
+    def countQueuedJobs(self, queue_name, cluster_id):
+        '''Returns the number of jobs of a cluster still in the queue, not
+        counting removed and completed ones, or None if the queue could not
+        be read.'''
+        jobCount = None
+        # condor_q -name q1@`hostname` -f "%d\n" ClusterID 11292
+        # We don't care if jobs are in the queue in the C or X state. So filter
+        # those out with a constraint.
+        cmd = ['condor_q']
+        if queue_name:
+            cmd.extend(['-name', queue_name])
+        cmd.extend(['-f', '%d\\n', 'ClusterID', '-c', 'JobStatus != 3 && JobStatus != 4', cluster_id])
+        logging.info('[cleaner] ...running: %s' % util.commandText(cmd))
+        (return_code, stdout_value, stderr_value) = util.runCommand2(cmd)
+        # Case #8380: Job directories are being deleted when jobs remain in the queue
+        # Pre Condor 7.2.2 it's not enough to just check the return code. Condor < 7.2.2 would often set
+        # the return code to 0 and write error notes to stderr. So we have to check that stderr is
+        # empty as well.
+        if len(stderr_value) > 0:
+            logging.error('[cleaner] ...got error running command: %s' % stderr_value)
+        else:
+            if return_code == 0:
+                # Count the lines in the output that have the cluster ID in them
+                # That's the number of jobs in the queue still.
+                repat = re.compile(r"^\s*%s\s*" % cluster_id, re.M)
+                matches = re.findall(repat, stdout_value)
+                jobCount = len(matches)
+        return jobCount
+
+    def configValue(self, attr, daemon='', name=''):
+        '''Returns the value of one configuration setting, None if it is not
+        defined, or util.ERROR if it could not be looked up.'''
+        config_val_cmd = ['condor_config_val'] + daemonArguments(daemon, name) + [attr]
+        try:
+            (rc, o, e) = util.runCommand2(config_val_cmd)
+        except Exception, e:
+            logging.error('Unable to get value for configuration setting %s: %s' % (attr, str(e)))
+            return util.ERROR
+
+        if o.find('Not defined') > -1 or e.find('Not defined') > -1:
+            value = None
+        elif len(o) == 0:
+            value = None
+        else:
+            value = o.splitlines()[0]
+        return value
+
+    def dumpConfig(self, daemon='', name=''):
+        '''Returns (settings, files): a dictionary of every configuration
+        setting (by upper case name), and the configuration files they came
+        from. settings is None if they could not be read.'''
+        dump_cmd = ['condor_config_val'] + daemonArguments(daemon, name) + ['-dump', '-expand']
+        try:
+            (rc, o, e) = util.runCommand2(dump_cmd)
+        except Exception, e:
+            logging.warning('Unable to dump configuration, settings will be looked up one at a time: %s' % str(e))
+            return (None, [])
+        values, files = util.parseConfigDump(o)
+        if rc != 0 or not values:
+            logging.warning('Unable to dump configuration, settings will be looked up one at a time: %s' % e.strip())
+            return (None, [])
+        logging.debug('Read %d configuration settings from "%s"' % (len(values), util.commandText(dump_cmd)))
+        return (values, files)
+
+
+class BindingsBackend(CommandBackend):
+    '''Queries the schedds and the collector, and reads the local
+    configuration, with the HTCondor Python bindings. Reading history files,
+    submitting and reading another daemon's configuration are left to the
+    command line tools, since the bindings don't do them the same way.'''
+
+    name = 'bindings'
+
+    def __init__(self):
+        if htcondor is None:
+            raise Exception("The HTCondor Python bindings (htcondor) can't be imported")
+
+    def queryQueue(self, schedd_name, jobs, attrs=None, constraint=None, all_users=False):
+        # the bindings always return every user's jobs
+        requirements = []
+        if jobs.strip():
+            try:
+                requirements.append(classad_expr.jobsExpression(jobs).text)
+            except classad_expr.UnsupportedExpression, e:
+                logging.info("Using condor_q for the jobs argument: %s" % e)
+                return CommandBackend.queryQueue(self, schedd_name, jobs, attrs, constraint, all_users)
+        if constraint is not None:
+            requirements.append(constraint)
+        requirements = ' && '.join(['(%s)' % r for r in requirements]) or 'true'
+        logging.info("Querying schedd %s: %s" % (schedd_name, requirements))
+        return self._streamAds(self._schedd(schedd_name), requirements, attrs or [])
+
+    def scheddAd(self, schedd_name):
+        ads = htcondor.Collector().query(htcondor.AdTypes.Schedd, 'Name == %s' % classad.quote(schedd_name))
+        if not ads:
+            raise Exception("No ad found for schedd %s" % schedd_name)
+        return ads[0].printOld() + '\n'
+
+    def scheddNames(self, host):
+        ads = htcondor.Collector().query(htcondor.AdTypes.Schedd, 'Machine == %s' % classad.quote(host), ['Name'])
+        if not ads:
+            raise Exception("No schedds found on %s" % host)
+        return ''.join(['%s\n' % ad['Name'] for ad in ads])
+
+    def versionText(self):
+        return htcondor.version()
+
+    def countQueuedJobs(self, queue_name, cluster_id):
+        try:
+            if queue_name:
+                schedd = self._schedd(queue_name)
+            else:
+                schedd = htcondor.Schedd()
+            ads = schedd.query('ClusterId == %d && JobStatus != 3 && JobStatus != 4' % int(cluster_id), ['ClusterId'])
+        except Exception, e:
+            logging.error('[cleaner] ...got error querying the queue: %s' % str(e))
+            return None
+        return len(ads)
+
+    def configValue(self, attr, daemon='', name=''):
+        if daemon != '':
+            return CommandBackend.configValue(self, attr, daemon, name)
+        return htcondor.param.get(attr)
+
+    def dumpConfig(self, daemon='', name=''):
+        if daemon != '':
+            return CommandBackend.dumpConfig(self, daemon, name)
+        values = {}
+        for key, value in htcondor.param.items():
+            values[key.upper()] = value
+        # the files are listed by util.getCondorConfigFiles
+        return (values, [])
+
+    def _schedd(self, schedd_name):
+        return htcondor.Schedd(htcondor.Collector().locate(htcondor.DaemonTypes.Schedd, schedd_name))
+
+    def _streamAds(self, schedd, requirements, projection):
+        # xquery (HTCondor 8.1.5 and later) returns the ads as they arrive
+        query = getattr(schedd, 'xquery', None)
+        if query is not None:
+            ads = query(requirements, projection)
+        else:
+            ads = schedd.query(requirements, projection)
+        for ad in ads:
+            yield ad.printOld() + '\n'
+
+
+class FakeBackend:
+    '''Answers from memory, for tests and benchmarks. Ads are kept as text
+    ("Name = value" lines). Jobs arguments and constraints are evaluated
+    with classad_expr, so only the expressions it supports can be used.'''
+
+    name = 'fake'
+
+    def __init__(self, queues=None, schedd_ads=None, config=None, histories=None):
+        # schedd name -> list of job ad texts; the queue of the local schedd
+        # (for submissions without a queue name) is ''
+        self.queues = queues or {}
+        # schedd name -> schedd ad text
+        self.scheddAds = schedd_ads or {}
+        # upper case setting name -> value
+        self.config = config or {}
+        # history file path -> list of ad texts
+        self.histories = histories or {}
+        # (method name, arguments) of each call, oldest first
+        self.calls = []
+        self.nextCluster = 1
+        self._lock = threading.Lock()
+
+    def queryQueue(self, schedd_name, jobs, attrs=None, constraint=None, all_users=False):
+        self._record('queryQueue', schedd_name, jobs, attrs, constraint)
+        if not self.queues.has_key(schedd_name):
+            raise Exception("Executing condor_q command:\nCan't find address for schedd %s" % schedd_name)
+        ads = self._select(self.queues[schedd_name], jobs, constraint)
+        return self._streamAds(ads, attrs)
+
+    def queryHistoryFile(self, history_file, jobs, constraint=None):
+        self._record('queryHistoryFile', history_file, jobs, constraint)
+        ads = self._select(self.histories.get(history_file, []), jobs, constraint)
+        return ''.join(self._streamAds(ads, None))
+
+    def scheddAd(self, schedd_name):
+        self._record('scheddAd', schedd_name)
+        if not self.scheddAds.has_key(schedd_name):
+            raise Exception("No ad found for schedd %s" % schedd_name)
+        return self.scheddAds[schedd_name]
+
+    def scheddNames(self, host):
+        self._record('scheddNames', host)
+        names = [name for name in self.scheddAds.keys() + self.queues.keys() if name]
+        names = dict.fromkeys(names).keys()
+        if not names:
+            raise Exception("No schedds found on %s" % host)
+        return ''.join(['%s\n' % name for name in sorted(names)])
+
+    def versionText(self):
+        self._record('versionText')
+        return '$CondorVersion: %s Jan 01 2019 $\n' % self.config.get('CONDOR_VERSION', FAKE_VERSION)
+
+    def submit(self, submit_file, queue_name=None, additional_arguments=[], cwd=None):
+        '''Queues one idle job for each submission.'''
+        self._record('submit', submit_file, queue_name, additional_arguments)
+        self._lock.acquire()
+        try:
+            cluster_id = self.nextCluster
+            self.nextCluster += 1
+            self.queues.setdefault(queue_name or '', []).append(
+                'ClusterId = %d\nProcId = 0\nJobStatus = 1\n' % cluster_id)
+        finally:
+            self._lock.release()
+        return (0, "Submitting job(s).\n1 job(s) submitted to cluster %d.\n" % cluster_id, '')
+
+    def countQueuedJobs(self, queue_name, cluster_id):
+        self._record('countQueuedJobs', queue_name, cluster_id)
+        expr = classad_expr.parse('ClusterId == %d && JobStatus != 3 && JobStatus != 4' % int(cluster_id))
+        return len([text for text in self.queues.get(queue_name or '', []) if expr.matches(parseAd(text))])
+
+    def configValue(self, attr, daemon='', name=''):
+        self._record('configValue', attr, daemon, name)
+        return self.config.get(attr.upper())
+
+    def dumpConfig(self, daemon='', name=''):
+        self._record('dumpConfig', daemon, name)
+        return (dict(self.config), [])
+
+    def _record(self, method, *args):
+        self._lock.acquire()
+        try:
+            self.calls.append((method, args))
+        finally:
+            self._lock.release()
+
+    def _select(self, ads, jobs, constraint):
+        exprs = []
+        if jobs.strip():
+            exprs.append(classad_expr.jobsExpression(jobs))
+        if constraint is not None:
+            exprs.append(classad_expr.parse(constraint))
+        return [text for text in ads if not [e for e in exprs if not e.matches(parseAd(text))]]
+
+    def _streamAds(self, ads, attrs):
+        attr_set = util.attributeSet(attrs)
+        for text in ads:
+            if attr_set is not None:
+                text = util.projectAdText(text, attr_set)
+            yield text.rstrip('\n') + '\n\n'
+
+
+################################################################################
+# METHODS
+################################################################################
+def getBackend():
+    '''Returns the backend named by CONDOR_AGENT_BACKEND, creating it the
+    first time.'''
+    global _backend
+    backend = _backend
+    if backend is not None:
+        return backend
+    bootstrap = getattr(_choosing, 'backend', None)
+    if bootstrap is not None:
+        # reading the setting itself comes back here
+        return bootstrap
+    _backendLock.acquire()
+    try:
+        if _backend is None:
+            # other threads wait on the lock until the backend is chosen
+            _choosing.backend = CommandBackend()
+            try:
+                name = util.getCondorConfigVal("CONDOR_AGENT_BACKEND", default='cli')
+            finally:
+                _choosing.backend = None
+            backend = createBackend(name)
+            logging.info("Using the %s backend" % backend.name)
+            _backend = backend
+        return _backend
+    finally:
+        _backendLock.release()
+
+
+def setBackend(backend):
+    '''Replaces the backend in use, returning the old one. None makes
+    getBackend read CONDOR_AGENT_BACKEND again.'''
+    global _backend
+    _backendLock.acquire()
+    try:
+        old = _backend
+        _backend = backend
+        return old
+    finally:
+        _backendLock.release()
+
+
+def createBackend(name):
+    '''Returns a new backend of the named kind (see BACKENDS). Falls back to
+    the command line tools if it is unknown or can't be used here.'''
+    name = name.strip().lower()
+    if name == 'bindings':
+        try:
+            return BindingsBackend()
+        except Exception, e:
+            logging.warning("Using the command line tools instead of the bindings backend: %s" % str(e))
+    elif name == 'fake':
+        return FakeBackend()
+    elif name != 'cli':
+        logging.warning("Unknown CONDOR_AGENT_BACKEND %s, using the command line tools" % name)
+    return CommandBackend()
+
+
+def daemonArguments(daemon, name):
+    '''Returns the condor_config_val arguments that select a daemon's
+    configuration (the local configuration if daemon is empty).'''
+    if daemon == '':
+        return []
+    if name != '':
+        return ['-%s' % daemon, '-name', name]
+    return ['-%s' % daemon]
+
+
+def parseAd(text):
+    '''Returns a dictionary of attribute name -> value text for the text of
+    an ad.'''
+    ad = {}
+    for line in text.splitlines():
+        split = line.split(' = ', 1)
+        if len(split) == 2:
+            ad[split[0].strip()] = split[1].strip()
+    return ad
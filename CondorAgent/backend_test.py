@@ -0,0 +1,144 @@
+import os
+import time
+import threading
+import backend
+import schedd
+import util
+import post_submit_cleanup
+
+
+JOBS = [
+    'ClusterId = 1\nProcId = 0\nOwner = "alice"\nJobStatus = 2\n',
+    'ClusterId = 1\nProcId = 1\nOwner = "alice"\nJobStatus = 4\n',
+    'ClusterId = 2\nProcId = 0\nOwner = "bob"\nJobStatus = 1\n',
+]
+
+
+def withBackend(fake, function):
+    old = backend.setBackend(fake)
+    try:
+        return function()
+    finally:
+        backend.setBackend(old)
+
+
+def test_submit_arguments():
+    commands = []
+    def run(cmd, cwd=None, timeout=None):
+        commands.append(cmd)
+        return (0, '1 job(s) submitted to cluster 7.\n', '')
+    old = util.runCommand2
+    util.runCommand2 = run
+    try:
+        backend.CommandBackend().submit('job.sub', 'q1', ['-a foo=bar', '-a "x = 1"', '-verbose'])
+    finally:
+        util.runCommand2 = old
+    # the arguments are split as the shell split them
+    assert [['condor_submit', '-name', 'q1', '-a', 'foo=bar', '-a', 'x = 1', '-verbose', 'job.sub']] == commands
+
+
+def test_fake_queue():
+    fake = backend.FakeBackend(queues={'s1': JOBS})
+    assert ''.join([text + '\n' for text in JOBS]) == ''.join(fake.queryQueue('s1', ''))
+    assert 'ClusterId = 2\nProcId = 0\n\n' == ''.join(fake.queryQueue('s1', 'bob', ['ClusterId', 'ProcId']))
+    assert 2 == ''.join(fake.queryQueue('s1', '1', None, 'JobStatus != 1')).count('ClusterId = 1\n')
+    assert '' == ''.join(fake.queryQueue('s1', '1.1', None, 'JobStatus == 2'))
+    try:
+        fake.queryQueue('s2', '')
+        assert False
+    except Exception, e:
+        assert str(e).find('s2') > -1
+    assert ('queryQueue', ('s1', 'bob', ['ClusterId', 'ProcId'], None)) == fake.calls[1]
+
+
+def test_schedd_query():
+    fake = backend.FakeBackend(queues={'s1': JOBS}, schedd_ads={'s1': 'Name = "s1"\n'})
+    def query():
+        return schedd.ScheddQuery('s1', ['Owner'], 'JobStatus == 2').getCurrent('')
+    assert 'ClusterId = 1\nProcId = 0\nOwner = "alice"\n\n' == withBackend(fake, query)
+    assert 'Name = "s1"\n' == withBackend(fake, lambda: schedd.fetchScheddAd('s1'))
+    assert ['s1'] == withBackend(fake, lambda: schedd.fetchLocalScheddNames('host1').split())
+
+
+def test_submit_and_count():
+    fake = backend.FakeBackend()
+    (retcode, out, err) = fake.submit('/tmp/job.sub')
+    assert 0 == retcode
+    assert out.find('submitted to cluster 1.') > -1
+    cleaner = post_submit_cleanup.LocalSubmitCleaner()
+    count = lambda: cleaner._condorJobsInQueue({'queue': None, 'clusterid': '1'})
+    assert 1 == withBackend(fake, count)
+    fake.queues[''][0] = fake.queues[''][0].replace('JobStatus = 1', 'JobStatus = 4')
+    assert 0 == withBackend(fake, count)
+
+
+def test_config():
+    fake = backend.FakeBackend(config={'CYCLE_AGENT_PORT': '8008', 'HISTORY': '/var/lib/condor/spool/history'})
+    old = util.configCache
+    util.configCache = util.ConfigCache(ttl=60)
+    # don't go looking for the real configuration files
+    util.configCache._configFiles = {}
+    try:
+        assert '8008' == withBackend(fake, lambda: util.getCondorConfigVal('CONDOR_AGENT_PORT'))
+        assert '/var/lib/condor/spool/history' == withBackend(fake, lambda: util.getCondorConfigVal('HISTORY'))
+        assert 'cli' == withBackend(fake, lambda: util.getCondorConfigVal('CONDOR_AGENT_BACKEND', default='cli'))
+        # the whole configuration is read once
+        assert [('dumpConfig', ('', ''))] == fake.calls
+    finally:
+        util.configCache = old
+
+
+def test_backend_chosen_once():
+    dumps = []
+    class Bootstrap(backend.FakeBackend):
+        name = 'bootstrap'
+        def dumpConfig(self, daemon='', name=''):
+            dumps.append(daemon)
+            time.sleep(0.1)
+            return ({'CONDOR_AGENT_BACKEND': 'fake'}, [])
+    old = (util.configCache, backend.setBackend(None), backend.CommandBackend)
+    util.configCache = util.ConfigCache(ttl=60)
+    util.configCache._configFiles = {}
+    backend.CommandBackend = Bootstrap
+    chosen = []
+    try:
+        threads = [threading.Thread(target=lambda: chosen.append(backend.getBackend().name)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # nobody is given the backend used to read the setting
+        assert ['fake'] * 8 == chosen
+        assert [''] == dumps
+    finally:
+        util.configCache = old[0]
+        backend.setBackend(old[1])
+        backend.CommandBackend = old[2]
+
+
+def test_condor_version():
+    fake = backend.FakeBackend()
+    old = (util.configCache, dict(os.environ))
+    util.configCache = util.ConfigCache(ttl=60)
+    util.configCache._configFiles = {}
+    for name in ('CONDOR_VERSION', 'CONDOR_MAJOR_VERSION'):
+        if os.environ.has_key(name):
+            del os.environ[name]
+    try:
+        # condor_version is asked when the configuration doesn't have it
+        withBackend(fake, util.getCondorVersion)
+        assert '8.8.1' == os.environ['CONDOR_VERSION']
+        assert '8.8' == os.environ['CONDOR_MAJOR_VERSION']
+        assert ('versionText', ()) in fake.calls
+    finally:
+        util.configCache = old[0]
+        os.environ.clear()
+        os.environ.update(old[1])
+
+
+def test_create_backend():
+    assert 'cli' == backend.createBackend('CLI').name
+    assert 'fake' == backend.createBackend('fake').name
+    assert 'cli' == backend.createBackend('nonsense').name
+    if backend.htcondor is None:
+        assert 'cli' == backend.createBackend('bindings').name
@@ -0,0 +1,497 @@
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import re
+
+
+################################################################################
+# GLOBALS
+################################################################################
+__doc__ = """classad_expr.py
+
+Evaluates the common subset of ClassAd expressions against history ads, so
+constraints on history don't need a condor_history process for each history
+file. The subset is:
+
+    literals        123  1.5  "string"  true  false  undefined  error
+    attributes      Owner  MY.Owner
+    operators       ||  &&  !  ==  !=  =?=  =!=  is  isnt  <  <=  >  >=
+                    +  -  *  /  %  ( )
+
+with the ClassAd rules for undefined and error values: a reference to a
+missing attribute is undefined, comparisons with undefined are undefined,
+"false && undefined" is false, "true || undefined" is true, and string
+comparisons other than =?= and =!= ignore case. An ad matches when the
+expression is true (or a non-zero number).
+
+Anything else, such as function calls, lists or the ?: operator, raises
+UnsupportedExpression when the expression is parsed, and the caller should
+leave the expression to HTCondor.
+"""
+
+class _Value:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+UNDEFINED = _Value('undefined')
+ERROR = _Value('error')
+
+TOKEN = re.compile(r'''\s*(?:
+    (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)|
+    (?P<string>"(?:[^"\\]|\\.)*")|
+    (?P<name>[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)?)|
+    (?P<op>=\?=|=!=|==|!=|<=|>=|&&|\|\||[<>!+\-*/%()])
+    )''', re.X)
+
+# the attribute values that are parsed most often, which are matched before
+# trying the full parser
+INTEGER_VALUE = re.compile(r'^-?\d+$')
+SIMPLE_STRING_VALUE = re.compile(r'^"([^"\\]*)"$')
+
+# value text -> parsed value, for the values that aren't simple literals
+_value_cache = {}
+MAX_VALUE_CACHE = 10000
+
+
+################################################################################
+# CLASSES
+################################################################################
+class UnsupportedExpression(Exception):
+    '''The expression isn't valid, or uses parts of the ClassAd language
+    this module doesn't evaluate.'''
+    pass
+
+
+class Expression:
+    '''A parsed expression. ads are dictionaries of attribute name to the
+    text of its value, such as IncrementalAd.ad.'''
+
+    def __init__(self, text, evaluate):
+        self.text = text
+        self._evaluate = evaluate
+
+    def evaluate(self, ad):
+        '''Returns the value of the expression for the ad: a bool, int,
+        float or str, UNDEFINED or ERROR.'''
+        return self._evaluate(_Scope(ad))
+
+    def matches(self, ad):
+        '''Returns True if the expression is true for the ad.'''
+        return isTrue(self.evaluate(ad))
+
+    def __repr__(self):
+        return 'Expression(%r)' % self.text
+
+
+class _Scope:
+    '''Looks up attribute references in an ad, parsing each value the first
+    time it is needed.'''
+
+    def __init__(self, ad):
+        self.ad = ad
+        self.lowered = None
+        self.values = {}
+        # attributes being evaluated, to catch references that loop
+        self.evaluating = {}
+
+    def lookup(self, name):
+        key = name.lower()
+        if self.values.has_key(key):
+            return self.values[key]
+        text = self.ad.get(name)
+        if text is None:
+            if self.lowered is None:
+                self.lowered = dict([(k.lower(), v) for k, v in self.ad.iteritems()])
+            text = self.lowered.get(key)
+        if text is None:
+            value = UNDEFINED
+        elif self.evaluating.has_key(key):
+            value = ERROR
+        else:
+            self.evaluating[key] = True
+            try:
+                value = parseValue(text)(self)
+            finally:
+                del self.evaluating[key]
+        self.values[key] = value
+        return value
+
+
+class _Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self, op=None):
+        token = self.peek()
+        if token[0] is None:
+            raise UnsupportedExpression('Unexpected end of expression: %s' % self.text)
+        if op is not None and token != ('op', op):
+            raise UnsupportedExpression('Expected "%s" but found "%s": %s' % (op, token[1], self.text))
+        self.pos += 1
+        return token
+
+    def parse(self):
+        result = self.parseOr()
+        if self.peek()[0] is not None:
+            raise UnsupportedExpression('Unexpected "%s": %s' % (self.peek()[1], self.text))
+        return result
+
+    def parseOr(self):
+        left = self.parseAnd()
+        while self.peek() == ('op', '||'):
+            self.take()
+            left = _or(left, self.parseAnd())
+        return left
+
+    def parseAnd(self):
+        left = self.parseEquality()
+        while self.peek() == ('op', '&&'):
+            self.take()
+            left = _and(left, self.parseEquality())
+        return left
+
+    def parseEquality(self):
+        left = self.parseRelational()
+        while True:
+            kind, value = self.peek()
+            if kind == 'op' and value in ('==', '!=', '=?=', '=!='):
+                pass
+            elif kind == 'name' and value.lower() in ('is', 'isnt'):
+                value = {'is': '=?=', 'isnt': '=!='}[value.lower()]
+            else:
+                return left
+            self.take()
+            right = self.parseRelational()
+            if value == '=?=':
+                left = _identical(left, right, True)
+            elif value == '=!=':
+                left = _identical(left, right, False)
+            else:
+                left = _compare(value, left, right)
+
+    def parseRelational(self):
+        left = self.parseAdditive()
+        while self.peek()[0] == 'op' and self.peek()[1] in ('<', '<=', '>', '>='):
+            op = self.take()[1]
+            left = _compare(op, left, self.parseAdditive())
+        return left
+
+    def parseAdditive(self):
+        left = self.parseMultiplicative()
+        while self.peek()[0] == 'op' and self.peek()[1] in ('+', '-'):
+            op = self.take()[1]
+            left = _arithmetic(op, left, self.parseMultiplicative())
+        return left
+
+    def parseMultiplicative(self):
+        left = self.parseUnary()
+        while self.peek()[0] == 'op' and self.peek()[1] in ('*', '/', '%'):
+            op = self.take()[1]
+            left = _arithmetic(op, left, self.parseUnary())
+        return left
+
+    def parseUnary(self):
+        kind, value = self.peek()
+        if kind == 'op' and value in ('!', '-', '+'):
+            self.take()
+            return _unary(value, self.parseUnary())
+        return self.parsePrimary()
+
+    def parsePrimary(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return _constant(parseNumber(value))
+        if kind == 'string':
+            return _constant(parseString(value))
+        if kind == 'op' and value == '(':
+            result = self.parseOr()
+            self.take(')')
+            return result
+        if kind == 'name':
+            if self.peek() == ('op', '('):
+                raise UnsupportedExpression('Function calls are not supported: %s' % self.text)
+            lowered = value.lower()
+            if lowered == 'true':
+                return _constant(True)
+            if lowered == 'false':
+                return _constant(False)
+            if lowered == 'undefined':
+                return _constant(UNDEFINED)
+            if lowered == 'error':
+                return _constant(ERROR)
+            if '.' in value:
+                scope, value = value.split('.', 1)
+                if scope.lower() != 'my':
+                    raise UnsupportedExpression('Only MY. attribute references are supported: %s' % self.text)
+            return _attribute(value)
+        raise UnsupportedExpression('Unexpected "%s": %s' % (value, self.text))
+
+
+################################################################################
+# METHODS
+################################################################################
+def parse(text):
+    '''Returns the Expression for text. Raises UnsupportedExpression if it
+    can't be parsed.'''
+    return Expression(text, _Parser(text).parse())
+
+
+def jobsExpression(jobs):
+    '''Returns an Expression matching the jobs in a jobs argument, a list of
+    clusters, cluster.proc IDs and owners as condor_q and condor_history
+    take them. Raises UnsupportedExpression if it has anything else in it,
+    such as command line options.'''
+    terms = []
+    for job in jobs.split():
+        if re.match(r'^\d+$', job):
+            terms.append('ClusterId == %s' % job)
+        elif re.match(r'^\d+\.\d+$', job):
+            terms.append('(ClusterId == %s && ProcId == %s)' % tuple(job.split('.')))
+        elif re.match(r'^[A-Za-z_][A-Za-z0-9_.@-]*$', job):
+            terms.append('Owner == "%s"' % job)
+        else:
+            raise UnsupportedExpression('Unsupported jobs argument: %s' % jobs)
+    if not terms:
+        raise UnsupportedExpression('Empty jobs argument')
+    return parse(' || '.join(terms))
+
+
+def isTrue(value):
+    '''Returns True if value counts as true for a constraint.'''
+    if value is True:
+        return True
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return value != 0
+    return False
+
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = TOKEN.match(text, pos)
+        if m is None or m.end() == pos:
+            raise UnsupportedExpression('Unexpected "%s": %s' % (text[pos:].strip()[:20], text))
+        pos = m.end()
+        tokens.append((m.lastgroup, m.group(m.lastgroup)))
+    return tokens
+
+
+def parseNumber(text):
+    if re.match(r'^\d+$', text):
+        return int(text)
+    return float(text)
+
+
+def parseString(text):
+    '''Returns the value of a quoted string literal.'''
+    result = []
+    i = 1
+    while i < len(text) - 1:
+        c = text[i]
+        if c == '\\':
+            i += 1
+            c = {'n': '\n', 't': '\t', 'r': '\r'}.get(text[i], text[i])
+        result.append(c)
+        i += 1
+    return ''.join(result)
+
+
+def parseValue(text):
+    '''Returns a function of a scope for the value of an attribute, from the
+    text of its value. Values that can't be parsed are errors.'''
+    text = text.strip()
+    if INTEGER_VALUE.match(text):
+        return _constant(int(text))
+    m = SIMPLE_STRING_VALUE.match(text)
+    if m:
+        return _constant(m.group(1))
+    evaluate = _value_cache.get(text)
+    if evaluate is None:
+        try:
+            evaluate = _Parser(text).parse()
+        except UnsupportedExpression:
+            evaluate = _constant(ERROR)
+        if len(_value_cache) >= MAX_VALUE_CACHE:
+            _value_cache.clear()
+        _value_cache[text] = evaluate
+    return evaluate
+
+
+def _isNumber(value):
+    return isinstance(value, (int, long, float))
+
+
+def _toBool(value):
+    '''Returns True, False, UNDEFINED or ERROR for a logical operand.'''
+    if value is True or value is False or value is UNDEFINED or value is ERROR:
+        return value
+    if _isNumber(value):
+        return value != 0
+    return ERROR
+
+
+def _constant(value):
+    return lambda scope: value
+
+
+def _attribute(name):
+    return lambda scope: scope.lookup(name)
+
+
+def _and(left, right):
+    def evaluate(scope):
+        a = _toBool(left(scope))
+        if a is False or a is ERROR:
+            return a
+        b = _toBool(right(scope))
+        if b is ERROR or b is False:
+            return b
+        if a is UNDEFINED or b is UNDEFINED:
+            return UNDEFINED
+        return True
+    return evaluate
+
+
+def _or(left, right):
+    def evaluate(scope):
+        a = _toBool(left(scope))
+        if a is True or a is ERROR:
+            return a
+        b = _toBool(right(scope))
+        if b is ERROR or b is True:
+            return b
+        if a is UNDEFINED or b is UNDEFINED:
+            return UNDEFINED
+        return False
+    return evaluate
+
+
+def _unary(op, operand):
+    def evaluate(scope):
+        value = operand(scope)
+        if value is UNDEFINED or value is ERROR:
+            return value
+        if op == '!':
+            value = _toBool(value)
+            if value is ERROR:
+                return ERROR
+            return not value
+        if not _isNumber(value) or isinstance(value, bool):
+            return ERROR
+        if op == '-':
+            return -value
+        return value
+    return evaluate
+
+
+def _identical(left, right, same):
+    '''=?= and =!=, which are never undefined and compare strings with
+    case.'''
+    def evaluate(scope):
+        a = left(scope)
+        b = right(scope)
+        if isinstance(a, _Value) or isinstance(b, _Value):
+            result = a is b
+        elif isinstance(a, bool) or isinstance(b, bool):
+            result = isinstance(a, bool) and isinstance(b, bool) and a == b
+        elif isinstance(a, str) or isinstance(b, str):
+            result = isinstance(a, str) and isinstance(b, str) and a == b
+        else:
+            # integers and reals are different types
+            result = isinstance(a, float) == isinstance(b, float) and a == b
+        return result == same
+    return evaluate
+
+
+COMPARISONS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+def _compare(op, left, right):
+    compare = COMPARISONS[op]
+    def evaluate(scope):
+        a = left(scope)
+        b = right(scope)
+        if a is ERROR or b is ERROR:
+            return ERROR
+        if a is UNDEFINED or b is UNDEFINED:
+            return UNDEFINED
+        if isinstance(a, str) and isinstance(b, str):
+            return compare(a.lower(), b.lower())
+        if _isNumber(a) and _isNumber(b):
+            # booleans compare as 0 and 1
+            return compare(a, b)
+        return ERROR
+    return evaluate
+
+
+def _arithmetic(op, left, right):
+    def evaluate(scope):
+        a = left(scope)
+        b = right(scope)
+        if a is ERROR or b is ERROR:
+            return ERROR
+        if a is UNDEFINED or b is UNDEFINED:
+            return UNDEFINED
+        if not _isNumber(a) or not _isNumber(b) or isinstance(a, bool) or isinstance(b, bool):
+            return ERROR
+        if op == '+':
+            return a + b
+        if op == '-':
+            return a - b
+        if op == '*':
+            return a * b
+        if b == 0:
+            return ERROR
+        if isinstance(a, float) or isinstance(b, float):
+            if op == '/':
+                return a / float(b)
+            return ERROR
+        # integer division and remainder round towards zero, as in C
+        quotient = abs(a) // abs(b)
+        if (a < 0) != (b < 0):
+            quotient = -quotient
+        if op == '/':
+            return quotient
+        return a - quotient * b
+    return evaluate
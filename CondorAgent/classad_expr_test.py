@@ -0,0 +1,74 @@
+import classad_expr
+
+
+AD = {
+    'ClusterId': '12',
+    'ProcId': '3',
+    'Owner': '"Alice"',
+    'JobStatus': '4',
+    'ExitCode': '1',
+    'RemoteWallClockTime': '3600.0',
+    'LeaveJobInQueue': 'false',
+    'Requirements': '( TARGET.Arch == "X86_64" )',
+    'Retries': 'ExitCode + 1',
+    'Loop': 'Loop + 1',
+}
+
+
+def evaluate(text):
+    return classad_expr.parse(text).evaluate(AD)
+
+
+def test_evaluate():
+    assert True is evaluate('JobStatus == 4 && Owner == "alice"')
+    assert True is evaluate('jobstatus == 4 && MY.OWNER != "bob"')
+    assert False is evaluate('Owner =?= "alice"')
+    assert True is evaluate('Owner =?= "Alice" && Missing =?= undefined && Missing is undefined')
+    assert True is evaluate('RemoteWallClockTime >= 3600 && RemoteWallClockTime < 3600.5')
+    assert True is evaluate('!LeaveJobInQueue && (ExitCode != 0 || JobStatus == 3)')
+    assert 2 == evaluate('Retries')
+    assert -4 == evaluate('-ClusterId / 3')
+    assert -2 == evaluate('-7 / 3')
+    assert 1 == evaluate('7 % -3')
+
+    # missing attributes are undefined, which only || true and && false get past
+    assert classad_expr.UNDEFINED is evaluate('Missing == 1')
+    assert classad_expr.UNDEFINED is evaluate('Missing == 1 && true')
+    assert False is evaluate('Missing == 1 && false')
+    assert True is evaluate('Missing == 1 || JobStatus == 4')
+
+    # errors: mixed types, values that can't be evaluated here, loops
+    assert classad_expr.ERROR is evaluate('Owner > 1')
+    assert classad_expr.ERROR is evaluate('Requirements')
+    assert classad_expr.ERROR is evaluate('Loop')
+    assert classad_expr.ERROR is evaluate('1 / 0')
+
+
+def test_matches():
+    assert classad_expr.parse('JobStatus == 4').matches(AD)
+    assert classad_expr.parse('ExitCode').matches(AD)
+    assert not classad_expr.parse('Missing == 1').matches(AD)
+    assert not classad_expr.parse('Requirements').matches(AD)
+    assert not classad_expr.parse('"yes"').matches(AD)
+
+
+def test_unsupported():
+    for text in ['isUndefined(Owner)', 'JobStatus == 4 ? 1 : 2', 'TARGET.Arch == "X86_64"',
+                 '{1, 2}', 'Owner == "alice', '(JobStatus == 4', 'JobStatus 4', 'JobStatus == 4;']:
+        try:
+            classad_expr.parse(text)
+            assert False, text
+        except classad_expr.UnsupportedExpression:
+            pass
+
+
+def test_jobs_expression():
+    assert classad_expr.jobsExpression('12').matches(AD)
+    assert classad_expr.jobsExpression('5 12.3').matches(AD)
+    assert not classad_expr.jobsExpression('12.4 13').matches(AD)
+    assert classad_expr.jobsExpression('alice').matches(AD)
+    try:
+        classad_expr.jobsExpression('-constraint true')
+        assert False
+    except classad_expr.UnsupportedExpression:
+        pass
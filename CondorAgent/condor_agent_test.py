@@ -0,0 +1,190 @@
+import os
+import time
+import shutil
+import socket
+import httplib
+import tempfile
+import threading
+import backend
+import util
+import condor_agent
+
+
+JOBS = [
+    'ClusterId = 1\nProcId = 0\nOwner = "alice"\nJobStatus = 2\n',
+    'ClusterId = 2\nProcId = 0\nOwner = "bob"\nJobStatus = 1\n',
+]
+
+JOBS_URL = '/condor/schedd/s1/jobs?history=false'
+
+
+# answered without running any HTCondor command
+UNKNOWN_URL = '/unknown'
+
+
+class Handler(condor_agent.CondorAgentHandler):
+    # don't let a test hang on a connection that never sends anything
+    timeout = 5
+    keepalive_timeout = 5
+
+
+class Agent:
+    '''An agent serving from a pool of workers (or a thread per connection if
+    workers is 0) on an ephemeral port, in this process, with a fake schedd
+    s1 that has JOBS in its queue.'''
+
+    def __init__(self, workers=2, queue_size=4):
+        self.tmp = tempfile.mkdtemp()
+        self.queueLog = os.path.join(self.tmp, 'job_queue.log')
+        write(self.queueLog, '105\n')
+        self.fake = backend.FakeBackend(queues={'s1': JOBS}, config={'JOB_QUEUE_LOG': self.queueLog})
+        self.old = (util.configCache, backend.setBackend(self.fake))
+        util.configCache = util.ConfigCache(ttl=60)
+        # don't go looking for the real configuration files
+        util.configCache._configFiles = {}
+        if workers:
+            self.server = condor_agent.PooledHTTPServer(('127.0.0.1', 0), Handler, workers, queue_size)
+        else:
+            self.server = condor_agent.ThreadedHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def connect(self):
+        return httplib.HTTPConnection('127.0.0.1', self.port, timeout=10)
+
+    def queries(self):
+        return [call for call in self.fake.calls if call[0] == 'queryQueue']
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        util.configCache = self.old[0]
+        backend.setBackend(self.old[1])
+        shutil.rmtree(self.tmp)
+
+
+def write(path, contents, mode='wb'):
+    f = open(path, mode)
+    f.write(contents)
+    f.close()
+
+
+def waitFor(condition, seconds=5):
+    deadline = time.time() + seconds
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def get(connection, path, headers={}):
+    connection.request('GET', path, None, headers)
+    response = connection.getresponse()
+    return (response, response.read())
+
+
+def test_busy_pool_answers_503():
+    agent = Agent(workers=1, queue_size=1)
+    try:
+        # the only worker waits on a connection that sends nothing
+        idle = socket.create_connection(('127.0.0.1', agent.port))
+        waitFor(lambda: agent.server.requests.empty())
+        time.sleep(0.1)
+        # the next connection waits in the queue, and the one after that
+        # is turned away
+        queued = agent.connect()
+        queued.request('GET', UNKNOWN_URL)
+        waitFor(lambda: agent.server.requests.qsize() == 1)
+        response, body = get(agent.connect(), UNKNOWN_URL)
+        assert 503 == response.status
+        assert '5' == response.getheader('Retry-After')
+        assert 1 == agent.server.rejected
+
+        # once the worker is free the queued request is answered
+        idle.close()
+        response = queued.getresponse()
+        assert 404 == response.status
+        assert UNKNOWN_URL in response.read()
+    finally:
+        agent.stop()
+
+
+def test_keepalive():
+    agent = Agent()
+    try:
+        connection = agent.connect()
+        response, first = get(connection, UNKNOWN_URL)
+        assert 404 == response.status
+        assert response.getheader('Connection') != 'close'
+        sock = connection.sock
+        assert sock is not None
+        # the body of a GET is read and dropped, so the connection can be
+        # used again
+        connection.request('GET', UNKNOWN_URL, 'x' * 1000)
+        response = connection.getresponse()
+        assert response.getheader('Connection') != 'close'
+        assert first == response.read()
+        response, second = get(connection, UNKNOWN_URL)
+        assert 404 == response.status
+        # all the requests went over the same socket
+        assert sock is connection.sock
+        assert first == second
+
+        # the connection is closed when the client asks
+        response, body = get(connection, UNKNOWN_URL, {'Connection': 'close'})
+        assert 'close' == response.getheader('Connection')
+        assert connection.sock is None
+    finally:
+        agent.stop()
+
+
+def test_idle_connections_are_bounded():
+    agent = Agent(workers=0)
+    agent.server.max_idle = 1
+    try:
+        kept = agent.connect()
+        response, body = get(kept, UNKNOWN_URL)
+        assert response.getheader('Connection') != 'close'
+        waitFor(lambda: agent.server.idle == 1)
+        # there is no room for another idle connection
+        response, body = get(agent.connect(), UNKNOWN_URL)
+        assert 'close' == response.getheader('Connection')
+        # a request on the idle connection makes it busy again
+        response, body = get(kept, UNKNOWN_URL)
+        assert 404 == response.status
+        waitFor(lambda: agent.server.idle == 1)
+        kept.close()
+        waitFor(lambda: agent.server.idle == 0)
+    finally:
+        agent.stop()
+
+
+def test_etag():
+    agent = Agent()
+    try:
+        connection = agent.connect()
+        response, body = get(connection, JOBS_URL)
+        etag = response.getheader('ETag')
+        assert etag.startswith('W/"')
+        assert 1 == len(agent.queries())
+
+        # the client's copy is still current, so condor_q isn't run
+        response, body = get(connection, JOBS_URL, {'If-None-Match': etag})
+        assert 304 == response.status
+        assert '' == body
+        assert etag == response.getheader('ETag')
+        assert 1 == len(agent.queries())
+        # an ETag for other jobs doesn't match
+        response, body = get(connection, '/condor/schedd/s1/jobs?history=false&jobs=1', {'If-None-Match': etag})
+        assert 200 == response.status
+
+        # once the schedd writes its job queue log the jobs are sent again
+        write(agent.queueLog, '103 1.0 JobStatus 4\n', 'ab')
+        response, body = get(connection, JOBS_URL, {'If-None-Match': etag})
+        assert 200 == response.status
+        assert 'ClusterId = 1' in body
+        assert etag != response.getheader('ETag')
+        connection.close()
+    finally:
+        agent.stop()
@@ -0,0 +1,347 @@
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import os
+import zlib
+import glob
+import struct
+import hashlib
+import logging
+import threading
+import util
+
+
+################################################################################
+# GLOBALS
+################################################################################
+__doc__ = """history_index.py
+
+Keeps an index of the ads in each history file on disk, next to nothing but
+the offset of each ad and its CompletionDate. With the index a completedSince
+query can seek straight to the first ad it needs instead of scanning the file
+backwards, and the "CompletionDate = 0" case described in
+util.readCondorHistory no longer forces a scan of the whole file.
+
+History files are only ever appended to, so the index for the live file is
+extended with the new ads each time it is used. It is rebuilt if the file is
+replaced (its inode changes) or shrinks, which is what happens on rotation.
+Rotated files never change, so their index is built once.
+
+The index is enabled by setting CONDOR_AGENT_HISTORY_INDEX_DIR to a directory
+the agent can write to.
+
+An index file is a fixed size header followed by an (offset, CompletionDate)
+pair of 64-bit integers for each ad. When the history file grows only the new
+pairs are appended and the header rewritten in place; the whole file is only
+written again when the history file is rotated or the index is unreadable.
+The header counts the pairs, so pairs appended before the header was updated
+(if the agent stopped in between) are ignored and later overwritten.
+"""
+
+# bump this if the layout of the index file changes
+INDEX_VERSION = 2
+INDEX_MAGIC = 'CAHINDEX'
+
+# magic, version, and a CRC of the rest of the header
+INDEX_PREAMBLE = struct.Struct('<8sII')
+# MD5 of the history file's path, inode, size, mtime, end, indexedTo,
+# tailDate, whether there is a tailDate, and the number of entries
+INDEX_HEADER = struct.Struct('<16sQQdQQqBQ')
+INDEX_HEADER_SIZE = INDEX_PREAMBLE.size + INDEX_HEADER.size
+# the offset and CompletionDate of one ad
+INDEX_ENTRY = struct.Struct('<qq')
+
+# indexes already loaded, by index file
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+################################################################################
+# CLASSES
+################################################################################
+class HistoryIndex:
+    '''The offsets and CompletionDates of the complete ads in one history
+    file, in file order.'''
+
+    def __init__(self, history_file, index_file):
+        self.historyFile = history_file
+        self.indexFile = index_file
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.inode = None
+        # the size and mtime of the file when the index was last brought up to date
+        self.size = 0
+        self.mtime = 0
+        # the end of the file as last read
+        self.end = 0
+        # the end of the last complete (banner terminated) ad in the index
+        self.indexedTo = 0
+        self.offsets = []
+        self.dates = []
+        # the CompletionDate of an ad that is still being written after
+        # indexedTo, or None if there is no such ad
+        self.tailDate = None
+        # the number of entries in the index file, or None if it has to be
+        # written from scratch
+        self.saved = None
+
+    def load(self):
+        '''Loads the index from disk. A missing or unreadable index is
+        treated as empty and will be rebuilt.'''
+        if not os.path.isfile(self.indexFile):
+            return
+        try:
+            fp = open(self.indexFile, 'rb')
+            try:
+                preamble = fp.read(INDEX_PREAMBLE.size)
+                header = fp.read(INDEX_HEADER.size)
+                if len(header) != INDEX_HEADER.size:
+                    raise ValueError('the file is too short')
+                (magic, version, crc) = INDEX_PREAMBLE.unpack(preamble)
+                if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                    logging.info('History index %s is out of date, rebuilding' % self.indexFile)
+                    return
+                if crc != zlib.crc32(header) & 0xffffffff:
+                    raise ValueError('the header is corrupt')
+                (digest, inode, size, mtime, end, indexed_to, tail_date, has_tail_date, count) = INDEX_HEADER.unpack(header)
+                if digest != _pathDigest(self.historyFile):
+                    logging.info('History index %s is for another file, rebuilding' % self.indexFile)
+                    return
+                data = fp.read(count * INDEX_ENTRY.size)
+            finally:
+                fp.close()
+            if len(data) != count * INDEX_ENTRY.size:
+                raise ValueError('the file is too short')
+            entries = struct.unpack('<%dq' % (count * 2), data)
+            self.inode = inode
+            self.size = size
+            self.mtime = mtime
+            self.end = end
+            self.indexedTo = indexed_to
+            self.offsets = list(entries[0::2])
+            self.dates = list(entries[1::2])
+            self.tailDate = None
+            if has_tail_date:
+                self.tailDate = tail_date
+            self.saved = count
+        except Exception, e:
+            logging.warning('Unable to load history index %s, rebuilding: %s' % (self.indexFile, str(e)))
+            self.reset()
+
+    def save(self):
+        '''Writes the index to disk: just the entries added since it was
+        last saved if it can, otherwise the whole index.'''
+        try:
+            if self.saved is None or self.saved > len(self.offsets) or not os.path.isfile(self.indexFile):
+                self._write()
+            else:
+                self._append()
+            self.saved = len(self.offsets)
+        except Exception, e:
+            logging.warning('Unable to save history index %s: %s' % (self.indexFile, str(e)))
+            self.saved = None
+
+    def _header(self):
+        header = INDEX_HEADER.pack(_pathDigest(self.historyFile), self.inode, self.size, self.mtime, self.end,
+                                   self.indexedTo, self.tailDate or 0, self.tailDate is not None, len(self.offsets))
+        return INDEX_PREAMBLE.pack(INDEX_MAGIC, INDEX_VERSION, zlib.crc32(header) & 0xffffffff) + header
+
+    def _entries(self, start):
+        return ''.join([INDEX_ENTRY.pack(self.offsets[i], self.dates[i]) for i in range(start, len(self.offsets))])
+
+    def _write(self):
+        '''Writes the whole index. It is written to a temporary file first
+        so a reader never sees a partial index.'''
+        tmp_file = self.indexFile + '.tmp'
+        fp = open(tmp_file, 'wb')
+        try:
+            fp.write(self._header())
+            fp.write(self._entries(0))
+        finally:
+            fp.close()
+        # Windows will not rename over an existing file
+        if os.name == 'nt' and os.path.exists(self.indexFile):
+            os.remove(self.indexFile)
+        os.rename(tmp_file, self.indexFile)
+
+    def _append(self):
+        '''Appends the entries added since the index was saved, then
+        updates the header to count them.'''
+        fp = open(self.indexFile, 'r+b')
+        try:
+            fp.seek(INDEX_HEADER_SIZE + self.saved * INDEX_ENTRY.size)
+            fp.truncate()
+            fp.write(self._entries(self.saved))
+            fp.flush()
+            fp.seek(0)
+            fp.write(self._header())
+        finally:
+            fp.close()
+
+    def update(self, file):
+        '''Brings the index up to date with the open history file, indexing
+        any ads written since it was last used. Returns True if the index
+        changed.'''
+        st = os.fstat(file.fileno())
+        if self.inode != st.st_ino or st.st_size < self.indexedTo:
+            if self.inode is not None:
+                logging.info('History file %s was rotated, rebuilding its index' % self.historyFile)
+            self.reset()
+            self.inode = st.st_ino
+        elif st.st_size == self.size and st.st_mtime == self.mtime:
+            return False
+
+        entries = []
+        for offset, text in util.forward_ads(file, self.indexedTo):
+            if text.strip():
+                date = util.adCompletionDate(text)
+            else:
+                date = None
+            entries.append((offset, offset + len(text), date))
+        # the file may have grown while we read it
+        self.end = max(file.tell(), st.st_size)
+        self.indexedTo = self.end
+        self.tailDate = None
+        if entries:
+            file.seek(self.end - 1, 0)
+            # the last ad is still being written if it has no banner yet, or
+            # if the banner itself has not been finished
+            if entries[-1][1] >= self.end or file.read(1) != '\n':
+                (self.indexedTo, end, self.tailDate) = entries.pop()
+
+        added = 0
+        for offset, end, date in entries:
+            if date is not None:
+                self.offsets.append(offset)
+                self.dates.append(date)
+                added += 1
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        logging.debug('Indexed %d new ads in history file %s' % (added, self.historyFile))
+        return True
+
+    def findStart(self, date):
+        '''Returns the offset of the first ad util.readCondorHistoryForward
+        would return for the given date. This applies the same rule as
+        util.readCondorHistory, working back through the index rather than
+        the file.'''
+        if self.tailDate is not None and not util.shouldOutputCompletionDate(self.tailDate, date):
+            return self.end
+        i = len(self.dates)
+        while i > 0 and util.shouldOutputCompletionDate(self.dates[i - 1], date):
+            i -= 1
+        if i == len(self.offsets):
+            return self.indexedTo
+        return self.offsets[i]
+
+    def scan(self, date):
+        '''Returns the same (start, end, max_completion) as util.scanHistory,
+        from the index.'''
+        start = self.findStart(date)
+        if start == self.end:
+            return (start, self.end, 0)
+        i = len(self.offsets)
+        while i > 0 and self.offsets[i - 1] >= start:
+            i -= 1
+        max_completion = max([0, self.tailDate or 0] + self.dates[i:])
+        return (start, self.end, max_completion)
+
+
+
+################################################################################
+# METHODS
+################################################################################
+def indexFileName(index_dir, history_base, history_file):
+    '''Returns the path of the index for history_file, one of the files for
+    the HISTORY setting history_base. The indexes for one HISTORY setting all
+    share a prefix so the indexes of deleted rotations can be found.'''
+    return os.path.join(index_dir, '%s%s.idx' % (_indexPrefix(history_base), os.path.basename(history_file)))
+
+
+def _pathDigest(history_file):
+    return hashlib.md5(history_file).digest()
+
+
+def _indexPrefix(history_base):
+    return hashlib.md5(os.path.abspath(history_base)).hexdigest()[:12] + '-'
+
+
+def getHistoryIndex(index_dir, history_base, history_file):
+    '''Returns the (cached) index for the history file, loading it from disk
+    the first time. Lock the index while using it.'''
+    index_file = indexFileName(index_dir, history_base, history_file)
+    _indexes_lock.acquire()
+    try:
+        index = _indexes.get(index_file)
+        if index is None:
+            index = HistoryIndex(history_file, index_file)
+            index.load()
+            _indexes[index_file] = index
+        return index
+    finally:
+        _indexes_lock.release()
+
+
+def findHistoryStart(index_dir, history_base, file, history_file, date):
+    '''Returns the offset of the first ad to read from the open history file
+    for the given date, updating (and saving) its index as needed.'''
+    return scanHistory(index_dir, history_base, file, history_file, date)[0]
+
+
+def scanHistory(index_dir, history_base, file, history_file, date):
+    '''Returns the same (start, end, max_completion) as util.scanHistory
+    for the open history file, updating (and saving) its index as needed.'''
+    index = getHistoryIndex(index_dir, history_base, history_file)
+    index.lock.acquire()
+    try:
+        if index.update(file):
+            index.save()
+        return index.scan(date)
+    finally:
+        index.lock.release()
+
+
+def pruneHistoryIndexes(index_dir, history_base, history_files):
+    '''Removes the indexes of history files for history_base that no longer
+    exist (rotations that have been deleted).'''
+    keep = {}
+    for f in history_files:
+        keep[indexFileName(index_dir, history_base, f)] = True
+    for index_file in glob.glob(os.path.join(index_dir, _indexPrefix(history_base) + '*.idx')):
+        if not keep.has_key(index_file):
+            logging.info('Removing index %s for deleted history file' % index_file)
+            _indexes_lock.acquire()
+            try:
+                if _indexes.has_key(index_file):
+                    del _indexes[index_file]
+            finally:
+                _indexes_lock.release()
+            try:
+                os.remove(index_file)
+            except Exception, e:
+                logging.warning('Unable to remove history index %s: %s' % (index_file, str(e)))
@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import util
+import history_index
+
+
+HISTORY = '''CompletionDate = 10000
+ProcId = 1
+*** Offset = -1 ClusterId = 1 ProcId = 1 Owner = "name" CompletionDate = 10000
+CompletionDate = 0
+ProcId = 2
+*** Offset = -1 ClusterId = 1 ProcId = 2 Owner = "name" CompletionDate = 0
+CompletionDate = 20000
+ProcId = 3
+*** Offset = -1 ClusterId = 1 ProcId = 3 Owner = "name" CompletionDate = 20000
+'''
+
+MORE_HISTORY = '''CompletionDate = 30000
+ProcId = 4
+*** Offset = -1 ClusterId = 1 ProcId = 4 Owner = "name" CompletionDate = 30000
+'''
+
+
+def read_procs(index_dir, history_file, date):
+    f = open(history_file, 'rb')
+    try:
+        start = history_index.findHistoryStart(index_dir, history_file, f, history_file, date)
+        return [ad.ad.get('ProcId') for ad in util.readCondorHistoryForward(f, date, start=start)]
+    finally:
+        f.close()
+
+
+def write(path, contents, mode='wb'):
+    f = open(path, mode)
+    f.write(contents)
+    f.close()
+
+
+def test_index_matches_scan():
+    tmp = tempfile.mkdtemp()
+    try:
+        history_file = os.path.join(tmp, 'history')
+        write(history_file, HISTORY)
+        assert ['1', '2', '3'] == read_procs(tmp, history_file, 0)
+        assert ['2', '3'] == read_procs(tmp, history_file, 10000)
+        assert [] == read_procs(tmp, history_file, 20000)
+        assert os.path.isfile(history_index.indexFileName(tmp, history_file, history_file))
+
+        # a partly written ad is not indexed until its banner is written
+        write(history_file, MORE_HISTORY[:30], 'ab')
+        assert ['2', '3', None] == read_procs(tmp, history_file, 15000)
+        assert [10000, 0, 20000] == history_index.getHistoryIndex(tmp, history_file, history_file).dates
+        write(history_file, MORE_HISTORY[30:], 'ab')
+        assert ['4'] == read_procs(tmp, history_file, 20000)
+        index = history_index.getHistoryIndex(tmp, history_file, history_file)
+        assert [10000, 0, 20000, 30000] == index.dates
+
+        # a fresh index loaded from disk gives the same answers
+        history_index._indexes.clear()
+        assert ['4'] == read_procs(tmp, history_file, 20000)
+        assert ['2', '3', '4'] == read_procs(tmp, history_file, 10000)
+
+        # the index gives the same span and latest CompletionDate as a scan
+        f = open(history_file, 'rb')
+        try:
+            for date in (0, 10000, 20000, 30000):
+                assert util.scanHistory(f, date) == history_index.scanHistory(tmp, history_file, f, history_file, date)
+        finally:
+            f.close()
+    finally:
+        history_index._indexes.clear()
+        shutil.rmtree(tmp)
+
+
+def test_index_rotation():
+    tmp = tempfile.mkdtemp()
+    try:
+        history_file = os.path.join(tmp, 'history')
+        rotated_file = history_file + '.20140101T000000'
+        write(history_file, HISTORY)
+        assert ['2', '3'] == read_procs(tmp, history_file, 15000)
+
+        # rotate: the old file is renamed and a new one started
+        os.rename(history_file, rotated_file)
+        write(history_file, MORE_HISTORY)
+        assert ['4'] == read_procs(tmp, history_file, 15000)
+        assert ['2', '3'] == read_procs(tmp, rotated_file, 15000)
+
+        # the index of a deleted rotation is removed
+        os.remove(rotated_file)
+        history_index.pruneHistoryIndexes(tmp, history_file, [history_file])
+        assert not os.path.exists(history_index.indexFileName(tmp, history_file, rotated_file))
+        assert os.path.exists(history_index.indexFileName(tmp, history_file, history_file))
+    finally:
+        history_index._indexes.clear()
+        shutil.rmtree(tmp)
+
+
+def test_index_file_is_appended():
+    tmp = tempfile.mkdtemp()
+    try:
+        history_file = os.path.join(tmp, 'history')
+        index_file = history_index.indexFileName(tmp, history_file, history_file)
+        write(history_file, HISTORY)
+        read_procs(tmp, history_file, 0)
+        inode = os.stat(index_file).st_ino
+        assert history_index.INDEX_HEADER_SIZE + 3 * history_index.INDEX_ENTRY.size == os.path.getsize(index_file)
+
+        # growth appends to the index file rather than replacing it
+        write(history_file, MORE_HISTORY, 'ab')
+        assert ['4'] == read_procs(tmp, history_file, 20000)
+        assert inode == os.stat(index_file).st_ino
+        assert history_index.INDEX_HEADER_SIZE + 4 * history_index.INDEX_ENTRY.size == os.path.getsize(index_file)
+
+        # entries past the count in the header are ignored
+        write(index_file, 'x' * 7, 'ab')
+        history_index._indexes.clear()
+        assert [10000, 0, 20000, 30000] == history_index.getHistoryIndex(tmp, history_file, history_file).dates
+        assert ['2', '3', '4'] == read_procs(tmp, history_file, 10000)
+    finally:
+        history_index._indexes.clear()
+        shutil.rmtree(tmp)
+
+
+def test_index_file_is_not_trusted():
+    tmp = tempfile.mkdtemp()
+    try:
+        history_file = os.path.join(tmp, 'history')
+        index_file = history_index.indexFileName(tmp, history_file, history_file)
+        write(history_file, HISTORY)
+
+        # anything that is not an index, such as a pickle, is rebuilt
+        write(index_file, "cos\nsystem\n(S'touch %s'\ntR." % os.path.join(tmp, 'ran'))
+        assert ['2', '3'] == read_procs(tmp, history_file, 10000)
+        assert not os.path.exists(os.path.join(tmp, 'ran'))
+
+        # as is an index with a damaged header
+        history_index._indexes.clear()
+        f = open(index_file, 'r+b')
+        f.seek(history_index.INDEX_PREAMBLE.size)
+        f.write('\xff')
+        f.close()
+        index = history_index.getHistoryIndex(tmp, history_file, history_file)
+        assert [] == index.dates and index.saved is None
+        assert ['2', '3'] == read_procs(tmp, history_file, 10000)
+    finally:
+        history_index._indexes.clear()
+        shutil.rmtree(tmp)
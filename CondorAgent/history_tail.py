@@ -0,0 +1,258 @@
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import os
+import time
+import logging
+import threading
+import itertools
+import collections
+import util
+import metrics
+
+################################################################################
+# GLOBALS
+################################################################################
+__doc__ = """history_tail.py
+
+A thread per schedd that follows the schedd's current history file and keeps
+the most recently completed jobs in memory, so that the frequent polls for
+jobs completed in the last minute or two don't have to open and parse the
+history file at all.
+
+The buffer holds at most CONDOR_AGENT_HISTORY_BUFFER_ADS ads, and only ads
+completed in the last CONDOR_AGENT_HISTORY_BUFFER_MINUTES minutes. Requests
+for older history fall back to reading the files on disk. Tailing is enabled
+by setting CONDOR_AGENT_HISTORY_TAIL to True.
+"""
+
+DEFAULT_MAX_ADS = 5000
+DEFAULT_MAX_MINUTES = 60
+DEFAULT_INTERVAL = 5
+
+# tailers by schedd name
+_tailers = {}
+_tailers_lock = threading.Lock()
+
+metrics.registry.collect('condor_agent_history_buffer_hits_total', 'counter',
+    'History requests answered from the history tailer\'s buffer, by schedd',
+    lambda: bufferCounts('hits'), ('schedd',))
+metrics.registry.collect('condor_agent_history_buffer_misses_total', 'counter',
+    'History requests the history tailer\'s buffer could not answer, by schedd',
+    lambda: bufferCounts('misses'), ('schedd',))
+
+
+################################################################################
+# CLASSES
+################################################################################
+class HistoryTailer(threading.Thread):
+    '''Follows one history file, keeping the latest ads in a bounded buffer.'''
+
+    def __init__(self, schedd_name, history_file, max_ads=DEFAULT_MAX_ADS,
+                 max_age=DEFAULT_MAX_MINUTES * 60, interval=DEFAULT_INTERVAL):
+        self.scheddName = schedd_name
+        self.historyFile = history_file
+        self.maxAds = max_ads
+        self.maxAge = max_age
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # set once the buffer has been loaded for the first time
+        self.ready = False
+        self.inode = None
+        self.size = 0
+        self.mtime = 0
+        # where the next ad will be read from
+        self.offset = 0
+        # the CompletionDate of the ad just before the first one in the
+        # buffer, or None if the buffer starts at the start of the file
+        self.previousDate = 0
+        # (CompletionDate, IncrementalAd), oldest first
+        self.ads = collections.deque()
+        self._stopevent = threading.Event()
+        threading.Thread.__init__(self, name="HistoryTailer-%s" % schedd_name)
+        self.setDaemon(True)
+
+    def run(self):
+        logging.info('[tail] Following history file %s for schedd %s' % (self.historyFile, self.scheddName))
+        while not self._stopevent.isSet():
+            # never let an error in one pass stop the thread
+            try:
+                self.lock.acquire()
+                try:
+                    self.poll()
+                finally:
+                    self.lock.release()
+            except Exception, e:
+                logging.error('[tail] Error reading history file %s: %s' % (self.historyFile, str(e)))
+            self._stopevent.wait(self.interval)
+        logging.info('[tail] Stopped following history file %s' % self.historyFile)
+
+    def stop(self):
+        self._stopevent.set()
+
+    def poll(self):
+        '''Reads any ads written since the last poll into the buffer. The
+        caller must hold the lock.'''
+        try:
+            f = open(self.historyFile, 'rb')
+        except IOError:
+            # no history written yet
+            return
+        try:
+            st = os.fstat(f.fileno())
+            if self.inode != st.st_ino or st.st_size < self.offset:
+                if self.inode is not None:
+                    logging.info('[tail] History file %s was rotated, starting over' % self.historyFile)
+                self.ads.clear()
+                self.inode = st.st_ino
+                (self.offset, self.previousDate) = self._initialOffset(f)
+            elif st.st_size == self.size and st.st_mtime == self.mtime:
+                return
+            added = 0
+            for offset, text, next in util.forward_complete_ads(f, self.offset):
+                self.offset = next
+                if text.strip():
+                    ad = util.IncrementalAd()
+                    ad.include_text(text)
+                    self.ads.append((ad.completion_date(), ad))
+                    added += 1
+            self._trim()
+            self.size = st.st_size
+            self.mtime = st.st_mtime
+            self.ready = True
+            if added:
+                logging.debug('[tail] Read %d new ads from %s, %d ads buffered' % (added, self.historyFile, len(self.ads)))
+        finally:
+            f.close()
+
+    def _initialOffset(self, f):
+        '''Returns the offset of the oldest ad that belongs in a full buffer
+        and the CompletionDate of the ad before it (None if there is none).'''
+        cutoff = time.time() - self.maxAge
+        f.seek(0, 2)
+        offset = f.tell()
+        count = 0
+        for ad_offset, text in util.reversed_ads(f):
+            if not text.strip():
+                continue
+            completion_date = util.adCompletionDate(text)
+            if count >= self.maxAds or (completion_date != 0 and completion_date < cutoff):
+                return (offset, completion_date)
+            offset = ad_offset
+            count += 1
+        return (offset, None)
+
+    def _trim(self):
+        '''Drops ads from the front of the buffer until it fits the limits.'''
+        while len(self.ads) > self.maxAds:
+            self.previousDate = self.ads.popleft()[0]
+        # ads with CompletionDate = 0 (removed jobs) are as old as the dated
+        # ad written after them, so they are dropped along with it
+        cutoff = time.time() - self.maxAge
+        while self.ads:
+            i = 0
+            while i < len(self.ads) and self.ads[i][0] == 0:
+                i += 1
+            if i == len(self.ads) or self.ads[i][0] >= cutoff:
+                break
+            for j in range(i + 1):
+                self.previousDate = self.ads.popleft()[0]
+
+    def _changed(self):
+        '''Returns True if the history file may have changed since the last
+        poll. It is only a hint, so the lock isn't needed.'''
+        try:
+            st = os.stat(self.historyFile)
+        except OSError:
+            return False
+        return st.st_ino != self.inode or st.st_size != self.size or st.st_mtime != self.mtime
+
+    def getAds(self, completed_since):
+        '''Returns the ads util.readCondorHistoryForward would return from the
+        history file for completed_since, or None if they are not all in the
+        buffer and the file has to be read instead.'''
+        changed = self._changed()
+        self.lock.acquire()
+        try:
+            if not self.ready:
+                self.misses += 1
+                logging.info('[tail] History buffer miss for schedd %s: buffer not loaded yet' % self.scheddName)
+                return None
+            if changed:
+                # pick up anything written since the last poll rather than
+                # wait for the thread
+                self.poll()
+            i = len(self.ads)
+            while i > 0 and util.shouldOutputCompletionDate(self.ads[i - 1][0], completed_since):
+                i -= 1
+            # if every buffered ad is wanted we can only be sure we have them
+            # all if the ad before the buffer would have stopped the scan
+            if i == 0 and self.previousDate is not None and util.shouldOutputCompletionDate(self.previousDate, completed_since):
+                self.misses += 1
+                logging.info('[tail] History buffer miss for schedd %s: completedSince %d is older than the %d buffered ads (%d hits, %d misses)' %
+                             (self.scheddName, completed_since, len(self.ads), self.hits, self.misses))
+                return None
+            self.hits += 1
+            ads = [ad for completion_date, ad in itertools.islice(self.ads, i, None)]
+            logging.info('[tail] History buffer hit for schedd %s: %d ads since %d (%d hits, %d misses)' %
+                         (self.scheddName, len(ads), completed_since, self.hits, self.misses))
+            return ads
+        finally:
+            self.lock.release()
+
+
+
+################################################################################
+# METHODS
+################################################################################
+def getTailer(schedd_name, history_file):
+    '''Returns the tailer for the schedd, starting one if there isn't one
+    yet or the schedd's history file has changed.'''
+    _tailers_lock.acquire()
+    try:
+        tailer = _tailers.get(schedd_name)
+        if tailer is not None and tailer.historyFile != history_file:
+            logging.info('[tail] History file for schedd %s changed to %s' % (schedd_name, history_file))
+            tailer.stop()
+            tailer = None
+        if tailer is None:
+            max_ads = int(util.getCondorConfigVal("CONDOR_AGENT_HISTORY_BUFFER_ADS", default=DEFAULT_MAX_ADS))
+            max_minutes = int(util.getCondorConfigVal("CONDOR_AGENT_HISTORY_BUFFER_MINUTES", default=DEFAULT_MAX_MINUTES))
+            tailer = HistoryTailer(schedd_name, history_file, max_ads, max_minutes * 60)
+            tailer.start()
+            _tailers[schedd_name] = tailer
+        return tailer
+    finally:
+        _tailers_lock.release()
+
+
+def bufferCounts(name):
+    '''Returns [((schedd name,), value of the attribute)] for the tailer
+    of each schedd, for metrics.'''
+    return [((schedd_name,), getattr(tailer, name)) for schedd_name, tailer in _tailers.items()]
+
@@ -0,0 +1,111 @@
+import os
+import time
+import shutil
+import tempfile
+import history_tail
+
+
+def ad(proc, completion_date):
+    return '''CompletionDate = %d
+ProcId = %d
+*** Offset = -1 ClusterId = 1 ProcId = %d Owner = "name" CompletionDate = %d
+''' % (completion_date, proc, proc, completion_date)
+
+
+def write(path, contents, mode='ab'):
+    f = open(path, mode)
+    f.write(contents)
+    f.close()
+
+
+def procs(ads):
+    if ads is None:
+        return None
+    return [a.ad['ProcId'] for a in ads]
+
+
+def test_tail_buffer():
+    tmp = tempfile.mkdtemp()
+    try:
+        history_file = os.path.join(tmp, 'history')
+        write(history_file, ad(1, 10000) + ad(2, 20000) + ad(3, 30000))
+        # no time limit, these dates are long past
+        tailer = history_tail.HistoryTailer('schedd', history_file, max_ads=3, max_age=2 ** 40)
+        assert None == tailer.getAds(0)
+        tailer.poll()
+        assert ['1', '2', '3'] == procs(tailer.getAds(0))
+        assert ['3'] == procs(tailer.getAds(25000))
+
+        # new ads are picked up, but not until their banner is written
+        text = ad(4, 0) + ad(5, 50000)
+        write(history_file, text[:-10])
+        assert ['3', '4'] == procs(tailer.getAds(25000))
+        write(history_file, text[-10:])
+        assert ['3', '4', '5'] == procs(tailer.getAds(25000))
+
+        # the first ads have been dropped so older requests must go to disk
+        assert None == procs(tailer.getAds(15000))
+        assert 0 < tailer.misses
+
+        # after a rotation only the new file is buffered
+        os.rename(history_file, history_file + '.old')
+        write(history_file, ad(6, 60000))
+        assert ['6'] == procs(tailer.getAds(0))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_tail_initial_load():
+    tmp = tempfile.mkdtemp()
+    try:
+        history_file = os.path.join(tmp, 'history')
+        write(history_file, ad(1, 10000) + ad(2, 20000) + ad(3, 30000))
+        tailer = history_tail.HistoryTailer('schedd', history_file, max_ads=2, max_age=2 ** 40)
+        tailer.poll()
+        assert None == tailer.getAds(5000)
+        assert ['2', '3'] == procs(tailer.getAds(15000))
+        assert ['3'] == procs(tailer.getAds(20000))
+        assert [] == procs(tailer.getAds(30000))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_tail_polls_only_changes():
+    tmp = tempfile.mkdtemp()
+    try:
+        history_file = os.path.join(tmp, 'history')
+        write(history_file, ad(1, 10000))
+        tailer = history_tail.HistoryTailer('schedd', history_file, max_ads=3, max_age=2 ** 40)
+        tailer.poll()
+        polls = []
+        poll = tailer.poll
+        tailer.poll = lambda: polls.append(1) or poll()
+        # an unchanged file isn't read again
+        assert ['1'] == procs(tailer.getAds(0))
+        assert [] == polls
+        write(history_file, ad(2, 20000))
+        assert ['1', '2'] == procs(tailer.getAds(0))
+        assert [1] == polls
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_tail_trims_undated_ads():
+    tmp = tempfile.mkdtemp()
+    try:
+        now = int(time.time())
+        history_file = os.path.join(tmp, 'history')
+        write(history_file, ad(1, now - 30))
+        tailer = history_tail.HistoryTailer('schedd', history_file, max_ads=10, max_age=60)
+        tailer.poll()
+        write(history_file, ad(2, 0) + ad(3, now - 20) + ad(4, 0) + ad(5, now))
+        tailer.poll()
+        assert ['1', '2', '3', '4', '5'] == procs(tailer.getAds(0))
+
+        # a removed job at the front doesn't keep older ads in the buffer
+        tailer.maxAge = 10
+        tailer._trim()
+        assert ['4', '5'] == [a.ad['ProcId'] for date, a in tailer.ads]
+        assert now - 20 == tailer.previousDate
+    finally:
+        shutil.rmtree(tmp)
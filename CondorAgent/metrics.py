@@ -0,0 +1,319 @@
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import bisect
+import logging
+import threading
+
+
+################################################################################
+# GLOBALS
+################################################################################
+__doc__ = """metrics.py
+
+Counters, gauges and histograms of what the agent is doing, served at
+/metrics in the Prometheus text format.
+
+Recording a value never takes a lock: each thread adds to a dictionary of
+its own, and the dictionaries are only added up when /metrics is read. The
+dictionaries of threads that have exited are folded into one when the
+metrics are read or a new thread records its first value. Values the agent
+keeps elsewhere (such as cache hits) are read when /metrics is, by the
+functions given to Registry.collect, which must not take locks either.
+"""
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# histogram buckets for durations, in seconds
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# histogram buckets for sizes, in bytes (1KB to 1GB)
+BYTES_BUCKETS = tuple([1024 * 4 ** i for i in range(11)])
+
+# histogram buckets for numbers of ads
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# the most per-thread dictionaries to keep before folding those of threads
+# that have exited
+MAX_SHARDS = 64
+
+
+################################################################################
+# CLASSES
+################################################################################
+class Registry:
+    '''The metrics, and the values recorded for them.'''
+
+    def __init__(self):
+        # metrics in the order they were added
+        self._metrics = []
+        self._local = threading.local()
+        # (thread, dictionary of values it has recorded)
+        self._shards = []
+        # the values recorded by threads that have exited
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self, name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        return self._add(Histogram(self, name, help, labels, buckets))
+
+    def collect(self, name, type, help, function, labels=()):
+        '''Adds a metric whose value is function(), called when the metrics
+        are read. It returns a number, or a list of (label values, number)
+        for a metric with labels.'''
+        return self._add(_Collected(self, name, type, help, labels, function))
+
+    def values(self):
+        '''Returns the sum of the values recorded by every thread, as a
+        dictionary of (metric name, label values) -> value.'''
+        self._lock.acquire()
+        try:
+            self._fold()
+            total = {}
+            _merge(total, self._retired)
+            shards = list(self._shards)
+        finally:
+            self._lock.release()
+        for thread, values in shards:
+            # items() copies the dictionary in one step, so it can't change
+            # under us
+            _merge(total, dict(values.items()))
+        return total
+
+    def render(self):
+        '''Returns the text of every metric, in the Prometheus text
+        format.'''
+        values = self.values()
+        by_name = {}
+        for (name, labels), value in values.items():
+            by_name.setdefault(name, []).append((labels, value))
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            samples = by_name.get(metric.name, [])
+            if isinstance(metric, _Collected):
+                samples = metric.samples()
+            samples.sort()
+            for labels, value in samples:
+                lines.extend(metric.format(labels, value))
+        return '\n'.join(lines) + '\n'
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def _shard(self):
+        '''Returns the calling thread's dictionary of values.'''
+        try:
+            return self._local.values
+        except AttributeError:
+            values = {}
+            self._local.values = values
+            self._lock.acquire()
+            try:
+                if len(self._shards) >= MAX_SHARDS:
+                    self._fold()
+                self._shards.append((threading.currentThread(), values))
+            finally:
+                self._lock.release()
+            return values
+
+    def _fold(self):
+        '''Adds the values of threads that have exited to _retired. Called
+        with the lock held.'''
+        live = []
+        for thread, values in self._shards:
+            if thread.isAlive():
+                live.append((thread, values))
+            else:
+                _merge(self._retired, values)
+        self._shards = live
+
+
+class _Metric:
+
+    type = None
+
+    def __init__(self, registry, name, help, labels):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def format(self, labels, value):
+        return ['%s%s %s' % (self.name, formatLabels(self.labels, labels), formatNumber(value))]
+
+
+class Counter(_Metric):
+
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        values = self.registry._shard()
+        key = (self.name, labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    '''A value that goes up and down, such as the number of requests in
+    progress. Each inc is expected to be followed by a dec.'''
+
+    type = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+
+    type = 'histogram'
+
+    def __init__(self, registry, name, help, labels, buckets):
+        _Metric.__init__(self, registry, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        values = self.registry._shard()
+        key = (self.name, labels)
+        entry = values.get(key)
+        if entry is None:
+            # the count in each bucket (the last is +Inf), the sum and the
+            # count
+            entry = [0] * (len(self.buckets) + 3)
+            values[key] = entry
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def format(self, labels, entry):
+        lines = []
+        cumulative = 0
+        for i in range(len(self.buckets) + 1):
+            cumulative += entry[i]
+            if i < len(self.buckets):
+                le = formatNumber(self.buckets[i])
+            else:
+                le = '+Inf'
+            lines.append('%s_bucket%s %d' % (self.name, formatLabels(self.labels + ('le',), labels + (le,)), cumulative))
+        lines.append('%s_sum%s %s' % (self.name, formatLabels(self.labels, labels), formatNumber(entry[-2])))
+        lines.append('%s_count%s %d' % (self.name, formatLabels(self.labels, labels), entry[-1]))
+        return lines
+
+
+class _Collected(_Metric):
+
+    def __init__(self, registry, name, type, help, labels, function):
+        _Metric.__init__(self, registry, name, help, labels)
+        self.type = type
+        self.function = function
+
+    def samples(self):
+        try:
+            value = self.function()
+        except Exception, e:
+            logging.debug('Unable to collect metric %s: %s' % (self.name, str(e)))
+            return []
+        if isinstance(value, (int, long, float)):
+            return [((), value)]
+        return list(value)
+
+
+################################################################################
+# METHODS
+################################################################################
+def formatLabels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (name, escapeLabel(value)) for name, value in zip(names, values)])
+
+
+def escapeLabel(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formatNumber(value):
+    if isinstance(value, float):
+        if value == int(value) and abs(value) < 1e15:
+            return '%d' % value
+        return repr(value)
+    return str(value)
+
+
+def _merge(total, values):
+    for key, value in values.items():
+        if isinstance(value, list):
+            entry = total.get(key)
+            if entry is None:
+                total[key] = list(value)
+            else:
+                for i in range(len(value)):
+                    entry[i] += value[i]
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+# the metrics served at /metrics
+registry = Registry()
+
+requestSeconds = registry.histogram('condor_agent_request_seconds',
+    'Time taken to handle requests, by handler and status code', ('handler', 'code'))
+requestsInProgress = registry.gauge('condor_agent_requests_in_progress',
+    'Requests being handled')
+responseBytes = registry.counter('condor_agent_response_bytes_total',
+    'Bytes of response bodies sent, by content encoding', ('encoding',))
+responseUncompressedBytes = registry.counter('condor_agent_response_uncompressed_bytes_total',
+    'Bytes of response bodies before they were compressed, by content encoding', ('encoding',))
+commandSeconds = registry.histogram('condor_agent_command_seconds',
+    'Wall time of the HTCondor commands run, by command', ('command',))
+commandFailures = registry.counter('condor_agent_command_failures_total',
+    'Commands that could not be started or exited with a non-zero code', ('command',))
+commandTimeouts = registry.counter('condor_agent_command_timeouts_total',
+    'Commands killed at their deadline', ('command',))
+commandOutputBytes = registry.counter('condor_agent_command_output_bytes_total',
+    'Bytes of output read from commands', ('command',))
+commandsRunning = registry.gauge('condor_agent_commands_running',
+    'Commands running', ('command',))
+commandsWaiting = registry.gauge('condor_agent_commands_waiting',
+    'Commands waiting for one of the same kind to finish', ('command',))
+historyBytes = registry.histogram('condor_agent_history_bytes_read',
+    'Bytes of history files read for each request', (), BYTES_BUCKETS)
+historyAds = registry.histogram('condor_agent_history_ads',
+    'History ads returned for each request', (), COUNT_BUCKETS)
+submissions = registry.counter('condor_agent_submissions_total',
+    'Submissions through the submission proxy, by result', ('result',))
+cleanerPasses = registry.counter('condor_agent_cleaner_passes_total',
+    'Passes of the local submission cleaner over the submit directory')
+cleanerRemoved = registry.counter('condor_agent_cleaner_removed_total',
+    'Submission directories removed by the local submission cleaner')
+cleanerErrors = registry.counter('condor_agent_cleaner_errors_total',
+    'Submissions the local submission cleaner was unable to check or remove')
@@ -0,0 +1,58 @@
+import threading
+import metrics
+
+
+def test_render():
+    registry = metrics.Registry()
+    requests = registry.counter('test_requests_total', 'Requests', ('handler',))
+    running = registry.gauge('test_running', 'Running')
+    seconds = registry.histogram('test_seconds', 'Seconds', ('command',), (0.1, 1))
+    registry.collect('test_hits_total', 'counter', 'Hits', lambda: 7)
+    registry.collect('test_misses_total', 'counter', 'Misses', lambda: [(('s2',), 2), (('s1',), 1)], ('schedd',))
+    registry.collect('test_broken', 'gauge', 'Broken', lambda: 1 / 0)
+
+    # values recorded by threads that have exited are kept
+    def record():
+        requests.inc(('getScheddJobs',))
+        seconds.observe(('condor_q',), 0.5)
+    threads = [threading.Thread(target=record) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    requests.inc(('get"Metrics\\',), 2)
+    running.inc()
+    running.inc()
+    running.dec()
+    seconds.observe(('condor_q',), 0.05)
+    seconds.observe(('condor_q',), 5)
+
+    assert '''# HELP test_requests_total Requests
+# TYPE test_requests_total counter
+test_requests_total{handler="get\\"Metrics\\\\"} 2
+test_requests_total{handler="getScheddJobs"} 3
+# HELP test_running Running
+# TYPE test_running gauge
+test_running 1
+# HELP test_seconds Seconds
+# TYPE test_seconds histogram
+test_seconds_bucket{command="condor_q",le="0.1"} 1
+test_seconds_bucket{command="condor_q",le="1"} 4
+test_seconds_bucket{command="condor_q",le="+Inf"} 5
+test_seconds_sum{command="condor_q"} 6.55
+test_seconds_count{command="condor_q"} 5
+# HELP test_hits_total Hits
+# TYPE test_hits_total counter
+test_hits_total 7
+# HELP test_misses_total Misses
+# TYPE test_misses_total counter
+test_misses_total{schedd="s1"} 1
+test_misses_total{schedd="s2"} 2
+# HELP test_broken Broken
+# TYPE test_broken gauge
+''' == registry.render()
+
+    # the shards of exited threads are folded together
+    registry.values()
+    assert 1 == len(registry._shards)
+    assert 3 == registry._retired[('test_requests_total', ('getScheddJobs',))]
@@ -32,6 +32,9 @@ import zipfile
 import tempfile
 import glob
 import util
+import backend
+import metrics
+import profiling
 import pickle
 import logging
 import urllib
@@ -86,25 +89,11 @@ def do_submit(handler, submitDir=None):
     zipfp = open(zipname, 'wb')
     logging.debug('Writing compressed submission data to %s' % zipname)
     try:
-        zipfp.write(handler.rfile.read(length))
+        zipfp.write(profiling.measure('receive', handler.rfile.read, length))
     finally:
         zipfp.close()
     
-    submitZip = zipfile.ZipFile(zipname, "r")
-    
-    # Now uncompress the zip file, creating any directories necessary.
-    for name in submitZip.namelist():
-        if name[-1] == '/':
-            logging.debug('Making new submission sub-directory %s' % os.path.join(tmpDir, name))
-            os.makedirs(os.path.join(tmpDir, name))
-        else:
-            data = submitZip.read(name)
-            fp = open(os.path.join(tmpDir, name), 'w')
-            logging.debug('Extracting file %s from submission archive %s' % (os.path.join(tmpDir, name), zipname))
-            try:
-                fp.write(data)
-            finally:
-                fp.close()
+    profiling.measure('unpack', extractSubmission, zipname, tmpDir)
     
     # Now we have a directory with the submit files in it. 
     # Ensure there is one and only one .sub or .submit file.
@@ -137,7 +126,7 @@ def do_submit(handler, submitDir=None):
         except Exception, e:
             logging.warn('Unable to remove submission file and zip file')
         raise Exception("%d submit files discovered. Submit requests must contain only one submit file." % len(submitFiles))
-    clusterId = doCondorSubmit(submitFiles[0], queue_name)
+    clusterId = profiling.measure('condor_submit', doCondorSubmit, submitFiles[0], queue_name)
     
     # Remove the submission files but leave the zip file in case we need to debug
     try:
@@ -172,6 +161,24 @@ def do_submit(handler, submitDir=None):
     return clusterId
 
 
+def extractSubmission(zipname, tmpDir):
+    '''Uncompresses the zip file into tmpDir, creating any directories
+    necessary.'''
+    submitZip = zipfile.ZipFile(zipname, "r")
+    for name in submitZip.namelist():
+        if name[-1] == '/':
+            logging.debug('Making new submission sub-directory %s' % os.path.join(tmpDir, name))
+            os.makedirs(os.path.join(tmpDir, name))
+        else:
+            data = submitZip.read(name)
+            fp = open(os.path.join(tmpDir, name), 'w')
+            logging.debug('Extracting file %s from submission archive %s' % (os.path.join(tmpDir, name), zipname))
+            try:
+                fp.write(data)
+            finally:
+                fp.close()
+
+
 def locate(pattern, root=os.curdir):
     '''Locate all files matching supplied filename pattern in and below
     supplied root directory.'''
@@ -186,11 +193,6 @@ def doCondorSubmit(submitFile, queueName):
     (submission_directory, filename) = os.path.split(submitFile)
     
     logging.debug("CondorAgent.post_submit.doCondorSubmit(): submission file: %s" % submitFile)
-    # TODO: make sure condor_submit is in the path and is available.
-    submit_cmd = ['condor_submit']
-    if queueName:
-        submit_cmd.append('-name')
-        submit_cmd.append('%s' % queueName)
     # Case 7108: Add a new configuration option that allows users to pass along custom command
     # line arguments to insert in to the condor_submit call made by Condor Agent.
     # The syntax for the option is a comma-seperated list. With each value in the list being
@@ -202,15 +204,13 @@ def doCondorSubmit(submitFile, queueName):
         additional_arguments = [i.strip() for i in string.split(add_str, ',')]
     if len(additional_arguments) > 0:
         logging.debug("CondorAgent.post_submit.doCondorSubmit(): Adding additional, user supplied arguments: %s" % ' '.join(additional_arguments))
-        submit_cmd.extend(additional_arguments)
-    submit_cmd.append('%s' % submitFile)
-    logging.debug("CondorAgent.post_submit.doCondorSubmit(): condor_submit command: %s" % ' '.join(submit_cmd))
     
     # Set the umask to be liberal so files that get created can be edited by anyone
     current_umask = os.umask(0)
     
     try:
-        (retcode, submit_out, submit_err) = util.runCommand2(cmd=' '.join(submit_cmd), cwd=submission_directory)
+        (retcode, submit_out, submit_err) = backend.getBackend().submit(submitFile, queueName, additional_arguments,
+                                                                        cwd=submission_directory)
     except:
         # TODO: determine exact error condition check. Possible that there are still warnings we should log.
         logging.error("CondorAgent.post_submit.doCondorSubmit(): Unexpected error: %s, %s" % (sys.exc_info()[0], str(sys.exc_info()[1])))
@@ -220,6 +220,7 @@ def doCondorSubmit(submitFile, queueName):
             logging.error("CondorAgent.post_submit.doCondorSubmit(): submit_err: %s" % submit_err)
         os.umask(current_umask)
         cleanSubmissionDir(submission_directory)
+        metrics.submissions.inc(('failed',))
         raise
     os.umask(current_umask)
     logging.debug("CondorAgent.post_submit.doCondorSubmit(): retcode:    %d" % retcode)
@@ -230,13 +231,16 @@ def doCondorSubmit(submitFile, queueName):
         if match == None:
             logging.error('CondorAgent.post_submit.doCondorSubmit(): Unable to parse submission details from condor_q output')
             cleanSubmissionDir(submission_directory)
+            metrics.submissions.inc(('failed',))
             raise Exception("Failed to parse cluster id from output:\n%s" % submit_out)
         clusterId = match.group(1)
     else:
         # TODO: parse the error to figure out what happened.
         logging.error('CondorAgent.post_submit.doCondorSubmit(): Condor submission failed')
         cleanSubmissionDir(submission_directory)
+        metrics.submissions.inc(('failed',))
         raise Exception("Failed to submit jobs to condor with error:\n%s" % submit_err)
+    metrics.submissions.inc(('ok',))
     logging.info('CondorAgent.post_submit.doCondorSubmit(): Returning cluster ID: %s' % str(clusterId))
     return clusterId
 
@@ -29,11 +29,12 @@
 # IMPORTS
 ################################################################################
 import os
-import re
 import shutil
 import pickle
 import glob
 import util
+import backend
+import metrics
 import logging
 import threading
 import time
@@ -88,6 +89,7 @@ class LocalSubmitCleaner(threading.Thread):
                 logging.info('[cleaner] CONDOR_AGENT_SKIP_CLEANUP is True. Skipping cleanup')
             else:
                 logging.info('[cleaner] Scanning submit directory \'%s\' for *.cluster files...' % submitDir)
+                metrics.cleanerPasses.inc()
                 for c in self._locate(pattern='*.cluster', root=submitDir):
                     # I never want this thread to exit because of an exception so we'll blanket trap
                     # everything at this level and just report it back as an error.
@@ -95,6 +97,7 @@ class LocalSubmitCleaner(threading.Thread):
                         self._safeRemoveClusterFiles(c)
                     except Exception, e:
                         logging.error('[cleaner] Caught unhandled exception: %s' % (str(e)))
+                        metrics.cleanerErrors.inc()
     
     def _locate(self, pattern, root=os.curdir):
         '''Locate all files matching supplied filename pattern in the
@@ -143,8 +146,10 @@ class LocalSubmitCleaner(threading.Thread):
                     shutil.rmtree(cdata.get('tmpdir'), False)
                 except Exception, e:
                     logging.error('[cleaner] Unable to remove path "%s": %s' % (cdata.get('tmpdir'), str(e)))
+                    metrics.cleanerErrors.inc()
                 else:
                     logging.info('[cleaner] ...removed path "%s"' % cdata.get('tmpdir'))
+                    metrics.cleanerRemoved.inc()
                     try:
                         os.remove(cfile)
                     except Exception, e:
@@ -159,33 +164,11 @@ class LocalSubmitCleaner(threading.Thread):
         else:
             # We got a value of None instead of an int in [0,inf) range. That's bad.
             logging.error('[cleaner] ...unable to run condor_q to count jobs in queue, no clean up done')
+            metrics.cleanerErrors.inc()
     
     def _condorJobsInQueue(self, cdata):
         '''Returns the number of jobs still in the queue for a cluster.'''
-        jobCount = None
-        # condor_q -name q1@`hostname` -f "%d\n" ClusterID 11292
-        # We don't care if jobs are in the queue in the C or X state. So filter
-        # those out with a constraint.
-        if cdata.get('queue'):
-            cmd = ['condor_q', '-name', cdata.get('queue'), '-f', '"%d\\n"', 'ClusterID', '-c', '"JobStatus != 3 && JobStatus != 4"', cdata.get('clusterid')]
-        else:
-            cmd = ['condor_q', '-f', '"%d\\n"', 'ClusterID', '-c', 'JobStatus != 3 && JobStatus != 4', cdata.get('clusterid')]
-        logging.info('[cleaner] ...running: %s' % ' '.join(cmd))
-        (return_code, stdout_value, stderr_value) = util.runCommand2(' '.join(cmd))
-        # Case #8380: Job directories are being deleted when jobs remain in the queue
-        # Pre Condor 7.2.2 it's not enough to just check the return code. Condor < 7.2.2 would often set
-        # the return code to 0 and write error notes to stderr. So we have to check that stderr is
-        # empty as well.
-        if len(stderr_value) > 0:
-            logging.error('[cleaner] ...got error running command: %s' % stderr_value)
-        else:
-            if return_code == 0:
-                # Count the lines in the output that have the cluster ID in them
-                # That's the number of jobs in the queue still.
-                repat = re.compile(r"^\s*%s\s*" % cdata.get('clusterid'), re.M)
-                matches = re.findall(repat, stdout_value)
-                jobCount = len(matches)
-        return jobCount
+        return backend.getBackend().countQueuedJobs(cdata.get('queue'), cdata.get('clusterid'))
     
 
 
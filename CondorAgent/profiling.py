@@ -0,0 +1,310 @@
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import util
+import os
+import sys
+import time
+import random
+import logging
+import threading
+import traceback
+import thread
+import itertools
+try:
+    import cProfile as profiler
+except ImportError:
+    # Python 2.4
+    import profile as profiler
+
+
+################################################################################
+# GLOBALS
+################################################################################
+__doc__ = """profiling.py
+
+Where the time of each request goes, for the Server-Timing header, the
+in-flight requests at /debug/requests and profiles of sampled requests.
+
+A request's time is divided into phases (condor_q, history, compress and so
+on) by wrapping the generators and calls that do the work with timed and
+measure. Phases nest, and each is charged only the time not spent in the
+phases inside it. Only the work done in the thread handling the request is
+divided up: time spent waiting on other threads is charged to the phase that
+waited, and work done in other threads (such as the schedds of a multi-schedd
+request) isn't timed at all.
+"""
+
+# the most profiles to write in a minute when CONDOR_AGENT_PROFILE_LIMIT
+# isn't set
+DEFAULT_PROFILE_LIMIT = 6
+
+# the request header that asks for a request to be profiled; its value must
+# be CONDOR_AGENT_PROFILE_SECRET
+PROFILE_HEADER = 'X-Condor-Agent-Profile'
+
+
+################################################################################
+# CLASSES
+################################################################################
+class RequestState:
+    '''A request being handled, and the time spent in each of its phases so
+    far. Only the thread handling the request changes it.'''
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.handler = None
+        self.started = time.time()
+        self.ident = thread.get_ident()
+        self.threadName = threading.currentThread().getName()
+        # the phase the request is in, for /debug/requests
+        self.phase = 'starting'
+        # phase names in the order they were first entered, and their
+        # seconds
+        self.phases = []
+        self.durations = {}
+        # the phases entered and not yet left, innermost last
+        self._stack = []
+        self._mark = None
+
+    def enter(self, name):
+        '''Starts charging time to the phase name, until exit is called.
+        Returns False, and does nothing, if called from another thread.'''
+        if thread.get_ident() != self.ident:
+            return False
+        now = time.time()
+        if self._stack:
+            self._charge(self._stack[-1], now)
+        self._stack.append(name)
+        self._mark = now
+        self.phase = name
+        return True
+
+    def exit(self):
+        '''Stops charging time to the phase last entered, and goes back to
+        charging the one it was entered from.'''
+        now = time.time()
+        self._charge(self._stack.pop(), now)
+        self._mark = now
+        if self._stack:
+            self.phase = self._stack[-1]
+        else:
+            self.phase = self.handler or 'handler'
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def serverTiming(self):
+        '''Returns the phases so far and the time since the request started,
+        as the value of a Server-Timing header (milliseconds).'''
+        timings = ['%s;dur=%.1f' % (name, self.durations[name] * 1000) for name in self.phases]
+        timings.append('total;dur=%.1f' % (self.elapsed() * 1000))
+        return ', '.join(timings)
+
+    def summary(self):
+        '''Returns the phases so far, for the log.'''
+        timings = ['%s %.3f' % (name, self.durations[name]) for name in self.phases]
+        timings.append('total %.3f' % self.elapsed())
+        return ', '.join(timings)
+
+    def _charge(self, name, now):
+        if not self.durations.has_key(name):
+            # /debug/requests may be reading phases, so the duration goes in first
+            self.durations[name] = 0
+            self.phases.append(name)
+        self.durations[name] += now - self._mark
+
+
+class Profiler:
+    '''Decides which requests are profiled and writes their profiles.
+
+    Nothing is profiled unless CONDOR_AGENT_PROFILE_DIR is set. Then a
+    fraction CONDOR_AGENT_PROFILE_SAMPLE of requests (none by default) is
+    profiled, as is any request with an X-Condor-Agent-Profile header giving
+    CONDOR_AGENT_PROFILE_SECRET, but never more than
+    CONDOR_AGENT_PROFILE_LIMIT requests a minute.'''
+
+    def __init__(self):
+        # the times of the profiles started in the last minute
+        self._started = []
+        self._lock = threading.Lock()
+        # numbers the profiles, so no two have the same file name
+        self._count = itertools.count(1)
+
+    def choose(self, requested=False):
+        '''Returns the directory to write the request's profile to, or None
+        if it isn't to be profiled. requested is True if the request asked
+        to be.'''
+        directory = util.getCondorConfigVal("CONDOR_AGENT_PROFILE_DIR")
+        if not directory:
+            return None
+        if not requested:
+            try:
+                sample = float(util.getCondorConfigVal("CONDOR_AGENT_PROFILE_SAMPLE", default="0"))
+            except ValueError:
+                sample = 0
+            if sample <= 0 or random.random() >= sample:
+                return None
+        try:
+            limit = int(util.getCondorConfigVal("CONDOR_AGENT_PROFILE_LIMIT", default=DEFAULT_PROFILE_LIMIT))
+        except ValueError:
+            limit = DEFAULT_PROFILE_LIMIT
+        now = time.time()
+        self._lock.acquire()
+        try:
+            self._started = [started for started in self._started if started > now - 60]
+            if len(self._started) >= limit:
+                logging.debug("Not profiling the request, %d profiles have been written in the last minute" % limit)
+                return None
+            self._started.append(now)
+        finally:
+            self._lock.release()
+        return directory.replace('"', '')
+
+    def run(self, directory, state, function, *args):
+        '''Returns function(*args), profiled, and writes the profile to a
+        .prof file in directory (see the pstats module). Only the thread
+        handling the request is profiled.'''
+        profile = profiler.Profile()
+        try:
+            return profile.runcall(function, *args)
+        finally:
+            name = '%s.%03d-%s-%d.prof' % (time.strftime('%Y%m%d-%H%M%S', time.localtime(state.started)),
+                                           int(state.started * 1000) % 1000, state.handler or 'request',
+                                           self._count.next())
+            path = os.path.join(directory, name)
+            try:
+                profile.dump_stats(path)
+                logging.info("Wrote the profile of %s %s to %s" % (state.method, state.path, path))
+            except Exception, e:
+                logging.error("Unable to write the profile of %s %s to %s: %s" % (state.method, state.path, path, str(e)))
+
+
+################################################################################
+# METHODS
+################################################################################
+def begin(method, path):
+    '''Records that the calling thread has started handling a request, and
+    returns its RequestState.'''
+    state = RequestState(method, path)
+    # each thread only adds and removes its own entry, so this doesn't need
+    # a lock
+    inflight[state.ident] = state
+    return state
+
+
+def end(state):
+    '''Records that the request is finished.'''
+    if inflight.get(state.ident) is state:
+        del inflight[state.ident]
+
+
+def current():
+    '''Returns the RequestState of the request the calling thread is
+    handling, or None.'''
+    return inflight.get(thread.get_ident())
+
+
+def timed(name, pieces):
+    '''Returns a generator of the pieces that charges the time spent
+    generating each of them to the phase name of the calling thread's
+    request. pieces is returned as it is if there is no request.'''
+    state = current()
+    if state is None:
+        return pieces
+    return _timed(state, name, pieces)
+
+
+def _timed(state, name, pieces):
+    pieces = iter(pieces)
+    try:
+        while True:
+            entered = state.enter(name)
+            try:
+                try:
+                    piece = pieces.next()
+                except StopIteration:
+                    return
+            finally:
+                if entered:
+                    state.exit()
+            yield piece
+    finally:
+        # pass on an early close, so pieces can clean up
+        if hasattr(pieces, 'close'):
+            pieces.close()
+
+
+def measure(name, function, *args):
+    '''Returns function(*args), charging the time it takes to the phase
+    name of the calling thread's request.'''
+    state = current()
+    entered = state is not None and state.enter(name)
+    try:
+        return function(*args)
+    finally:
+        if entered:
+            state.exit()
+
+
+def renderInflight():
+    '''Returns a description of each request in flight, with its phase and
+    the stack of the thread handling it.'''
+    # Python 2.4 doesn't have sys._current_frames
+    frames = getattr(sys, '_current_frames', dict)()
+    states = inflight.values()
+    states.sort(key=lambda state: state.started)
+    lines = ['%d requests in flight' % len(states)]
+    for state in states:
+        lines.append('')
+        lines.append('%s %s' % (state.method, state.path))
+        lines.append('  thread %s (%d), %.3f seconds, handler %s, phase %s' %
+                     (state.threadName, state.ident, state.elapsed(), state.handler, state.phase))
+        lines.append('  timings: %s' % state.summary())
+        frame = frames.get(state.ident)
+        if frame is not None:
+            for entry in traceback.format_stack(frame):
+                lines.extend(['  ' + line for line in entry.rstrip('\n').split('\n')])
+    return '\n'.join(lines) + '\n'
+
+
+def sameSecret(given, secret):
+    '''Returns True if given is secret, taking the same time wherever they
+    differ.'''
+    if not given or not secret or len(given) != len(secret):
+        return False
+    difference = 0
+    for a, b in zip(given, secret):
+        difference |= ord(a) ^ ord(b)
+    return difference == 0
+
+
+# the RequestState of each request in flight, by the ident of its thread
+inflight = {}
+
+# chooses and writes the profiles of requests
+profiles = Profiler()
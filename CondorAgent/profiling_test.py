@@ -0,0 +1,102 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import backend
+import profiling
+import util
+
+
+def slow(pieces, seconds):
+    for piece in pieces:
+        time.sleep(seconds)
+        yield piece
+
+
+def test_phases():
+    state = profiling.begin('GET', '/condor/schedd/s1/jobs')
+    try:
+        assert state is profiling.current()
+        inner = profiling.timed('condor_q', slow(['a', 'b'], 0.02))
+        assert 'ab' == ''.join(profiling.timed('compress', slow(inner, 0.01)))
+        assert 42 == profiling.measure('send', lambda x: x * 2, 21)
+        # each phase has only its own time
+        assert ['compress', 'condor_q', 'send'] == state.phases
+        assert 0.04 <= state.durations['condor_q'] < 0.2
+        assert 0.02 <= state.durations['compress'] < state.durations['condor_q']
+        assert state.serverTiming().startswith('compress;dur=')
+        assert state.serverTiming().find(', total;dur=') > -1
+
+        # other threads don't change the request's phases
+        pieces = profiling.timed('history', ['x'])
+        result = []
+        worker = threading.Thread(target=lambda: result.append(''.join(pieces)))
+        worker.start()
+        worker.join()
+        assert ['x'] == result
+        assert 'history' not in state.phases
+
+        # closing a timed generator closes what it wraps
+        closed = []
+        def source():
+            try:
+                yield 'a'
+                yield 'b'
+            finally:
+                closed.append(True)
+        pieces = profiling.timed('history', source())
+        assert 'a' == pieces.next()
+        pieces.close()
+        assert [True] == closed
+
+        text = profiling.renderInflight()
+        assert text.find('GET /condor/schedd/s1/jobs') > -1
+        assert text.find('test_phases') > -1
+    finally:
+        profiling.end(state)
+    assert profiling.current() is None
+    # without a request nothing is wrapped
+    pieces = ['a']
+    assert pieces is profiling.timed('condor_q', pieces)
+
+
+def test_profiler():
+    directory = tempfile.mkdtemp()
+    fake = backend.FakeBackend(config={'CONDOR_AGENT_PROFILE_DIR': directory, 'CONDOR_AGENT_PROFILE_LIMIT': '2'})
+    old = (util.configCache, backend.setBackend(fake))
+    util.configCache = util.ConfigCache(ttl=60)
+    util.configCache._configFiles = {}
+    try:
+        profiler = profiling.Profiler()
+        # nothing is sampled by default
+        assert None is profiler.choose()
+        assert directory == profiler.choose(True)
+        assert directory == profiler.choose(True)
+        # no more than the limit a minute
+        assert None is profiler.choose(True)
+        profiler._started = [time.time() - 61]
+        assert directory == profiler.choose(True)
+
+        state = profiling.begin('GET', '/metrics')
+        state.handler = 'getMetrics'
+        try:
+            assert 3 == profiler.run(directory, state, lambda x: x + 1, 2)
+            assert 4 == profiler.run(directory, state, lambda x: x + 2, 2)
+        finally:
+            profiling.end(state)
+        names = os.listdir(directory)
+        assert 2 == len(names)
+        assert names[0].endswith('-getMetrics-1.prof') or names[0].endswith('-getMetrics-2.prof')
+    finally:
+        util.configCache = old[0]
+        backend.setBackend(old[1])
+        shutil.rmtree(directory)
+
+
+def test_same_secret():
+    assert profiling.sameSecret('s3cret', 's3cret')
+    assert not profiling.sameSecret('s3creT', 's3cret')
+    assert not profiling.sameSecret('s3cre', 's3cret')
+    assert not profiling.sameSecret('', '')
+    assert not profiling.sameSecret('s3cret', None)
@@ -0,0 +1,256 @@
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import os
+import re
+import time
+import hashlib
+import binascii
+import logging
+import threading
+import util
+import metrics
+
+
+################################################################################
+# GLOBALS
+################################################################################
+__doc__ = """queue_delta.py
+
+Delta polling of the job queue. A client that asks for the jobs with a
+syncToken argument gets back, after the job ads, a new token:
+
+    -- SyncToken: <token>
+    -- Delta: true
+    -- Removed: 12.0 12.1
+
+For the token the agent remembers a fingerprint of each job ad it returned.
+When the client next asks with that token only the ads that were added or
+have changed since are returned, with the IDs of the jobs that have left the
+queue on the Removed line. If the token is empty, unknown or has expired the
+whole queue is returned with "-- Delta: false" and no Removed line, and the
+client should replace what it has.
+
+The fingerprints for all tokens together are limited to
+CONDOR_AGENT_SYNC_TOKEN_JOBS jobs, with the least recently used tokens
+dropped first, and tokens expire after CONDOR_AGENT_SYNC_TOKEN_MINUTES
+minutes.
+"""
+
+DEFAULT_MAX_JOBS = 1000000
+DEFAULT_MAX_MINUTES = 10
+
+# attributes condor_q sets at query time, which are left out of fingerprints
+IGNORED_ATTRIBUTES = re.compile('^(ServerTime) = .*\n?', re.M)
+
+AD_CLUSTER_ID = re.compile('^ClusterId = (\d+)\r?$', re.M)
+AD_PROC_ID = re.compile('^ProcId = (\d+)\r?$', re.M)
+
+# the blank line after each ad
+AD_END = re.compile('\n\r?\n')
+
+# the store used by streamDelta, created when first needed
+_store = None
+_store_lock = threading.Lock()
+
+# read without the store's lock, which only means a value can be a moment old
+metrics.registry.collect('condor_agent_sync_tokens', 'gauge',
+    'Sync tokens held for delta polling', lambda: _store is not None and len(_store._tokens) or 0)
+metrics.registry.collect('condor_agent_sync_token_jobs', 'gauge',
+    'Job fingerprints held for all sync tokens', lambda: _store is not None and _store._jobs or 0)
+
+
+################################################################################
+# CLASSES
+################################################################################
+class SyncTokenStore:
+    '''The job fingerprints for each sync token that has been handed out.'''
+
+    def __init__(self, max_jobs=DEFAULT_MAX_JOBS, max_age=DEFAULT_MAX_MINUTES * 60):
+        self.maxJobs = max_jobs
+        self.maxAge = max_age
+        # token -> [key, fingerprints, last used]
+        self._tokens = {}
+        # the number of fingerprints held for all tokens
+        self._jobs = 0
+        self._lock = threading.Lock()
+
+    def get(self, token, key):
+        '''Returns the fingerprints for the token, or None if it is unknown,
+        has expired or was handed out for a different query (key).'''
+        self._lock.acquire()
+        try:
+            self._expire()
+            entry = self._tokens.get(token)
+            if entry is None:
+                logging.info('[delta] Sync token %s is unknown or has expired, returning all jobs' % token)
+                return None
+            if entry[0] != key:
+                logging.info('[delta] Sync token %s is for a different query, returning all jobs' % token)
+                return None
+            entry[2] = time.time()
+            return entry[1]
+        finally:
+            self._lock.release()
+
+    def put(self, key, fingerprints, previous_token=None):
+        '''Returns a token for the fingerprints. If previous_token holds the
+        same fingerprints it is returned rather than a new one. Returns None
+        if there is no room for them.'''
+        self._lock.acquire()
+        try:
+            if previous_token is not None:
+                entry = self._tokens.get(previous_token)
+                if entry is not None and entry[0] == key and entry[1] == fingerprints:
+                    entry[2] = time.time()
+                    return previous_token
+            if len(fingerprints) > self.maxJobs:
+                logging.warning('[delta] %d jobs is more than CONDOR_AGENT_SYNC_TOKEN_JOBS (%d), no sync token issued' %
+                                (len(fingerprints), self.maxJobs))
+                return None
+            token = binascii.hexlify(os.urandom(12))
+            self._tokens[token] = [key, fingerprints, time.time()]
+            self._jobs += len(fingerprints)
+            self._expire()
+            self._evict()
+            return token
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        self._lock.acquire()
+        try:
+            return {'tokens': len(self._tokens), 'jobs': self._jobs}
+        finally:
+            self._lock.release()
+
+    def _expire(self):
+        cutoff = time.time() - self.maxAge
+        for token, entry in self._tokens.items():
+            if entry[2] < cutoff:
+                self._remove(token)
+
+    def _evict(self):
+        '''Drops the least recently used tokens until the fingerprints fit.'''
+        if self._jobs <= self.maxJobs:
+            return
+        entries = [(entry[2], token) for token, entry in self._tokens.items()]
+        entries.sort()
+        for last_used, token in entries:
+            if self._jobs <= self.maxJobs:
+                break
+            logging.info('[delta] Dropping sync token %s to stay within CONDOR_AGENT_SYNC_TOKEN_JOBS' % token)
+            self._remove(token)
+
+    def _remove(self, token):
+        self._jobs -= len(self._tokens[token][1])
+        del self._tokens[token]
+
+
+
+################################################################################
+# METHODS
+################################################################################
+def getSyncTokenStore():
+    '''Returns the store of sync tokens, creating it the first time.'''
+    global _store
+    _store_lock.acquire()
+    try:
+        if _store is None:
+            max_jobs = int(util.getCondorConfigVal("CONDOR_AGENT_SYNC_TOKEN_JOBS", default=DEFAULT_MAX_JOBS))
+            max_minutes = int(util.getCondorConfigVal("CONDOR_AGENT_SYNC_TOKEN_MINUTES", default=DEFAULT_MAX_MINUTES))
+            _store = SyncTokenStore(max_jobs, max_minutes * 60)
+        return _store
+    finally:
+        _store_lock.release()
+
+
+def splitAds(pieces):
+    '''Generates each ad (with the blank line that ends it) in condor_q -long
+    output that is generated in pieces.'''
+    pending = ''
+    for piece in pieces:
+        pending = pending + piece
+        pos = 0
+        while True:
+            end = AD_END.search(pending, pos)
+            if end is None:
+                break
+            yield pending[pos:end.end()]
+            pos = end.end()
+        pending = pending[pos:]
+    if pending:
+        yield pending
+
+
+def jobId(ad):
+    '''Returns "ClusterId.ProcId" for the ad, or None if it isn't a job.'''
+    cluster = AD_CLUSTER_ID.search(ad)
+    proc = AD_PROC_ID.search(ad)
+    if cluster is None or proc is None:
+        return None
+    return '%s.%s' % (cluster.group(1), proc.group(1))
+
+
+def fingerprint(ad):
+    '''Returns a short hash of the ad that changes when any attribute other
+    than the IGNORED_ATTRIBUTES does.'''
+    return hashlib.md5(IGNORED_ATTRIBUTES.sub('', ad)).digest()[:8]
+
+
+def streamDelta(key, token, pieces, store=None):
+    '''Generates the condor_q -long output generated by pieces, leaving out
+    the jobs that are unchanged since token was handed out, followed by the
+    SyncToken, Delta and Removed lines described above. key identifies the
+    query, so a token can only be used again for the same query.'''
+    if store is None:
+        store = getSyncTokenStore()
+    previous = None
+    if token:
+        previous = store.get(token, key)
+    fingerprints = {}
+    sent = 0
+    for ad in splitAds(pieces):
+        job = jobId(ad)
+        if job is None:
+            # blank lines and anything else that isn't a job are passed on
+            yield ad
+            continue
+        ad_fingerprint = fingerprint(ad)
+        fingerprints[job] = ad_fingerprint
+        if previous is None or previous.get(job) != ad_fingerprint:
+            sent += 1
+            yield ad
+    new_token = store.put(key, fingerprints, token or None)
+    yield "-- SyncToken: %s\n" % (new_token or '')
+    if previous is None:
+        yield "-- Delta: false\n"
+        return
+    removed = [job for job in previous.keys() if not fingerprints.has_key(job)]
+    logging.info('[delta] Sending %d of %d jobs, %d removed' % (sent, len(fingerprints), len(removed)))
+    yield "-- Delta: true\n"
+    yield "-- Removed: %s\n" % ' '.join(removed)
+
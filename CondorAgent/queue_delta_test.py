@@ -0,0 +1,80 @@
+import time
+import queue_delta
+
+
+def job(cluster, proc, status, server_time=1000):
+    return 'ClusterId = %d\nProcId = %d\nJobStatus = %d\nServerTime = %d\n\n' % (cluster, proc, status, server_time)
+
+
+def parse(output):
+    '''Returns the job IDs sent and the values of the -- lines.'''
+    jobs = []
+    lines = {}
+    for ad in queue_delta.splitAds([output]):
+        job_id = queue_delta.jobId(ad)
+        if job_id:
+            jobs.append(job_id)
+        elif ad.startswith('-- '):
+            for line in ad.splitlines():
+                name, value = line[3:].split(':', 1)
+                lines[name] = value.strip()
+    return jobs, lines
+
+
+def delta(store, token, queue, key=('schedd', '')):
+    # split the output in awkward places to check ads are put back together
+    pieces = [queue[i:i + 7] for i in range(0, len(queue), 7)]
+    return parse(''.join(queue_delta.streamDelta(key, token, pieces, store)))
+
+
+def test_delta():
+    store = queue_delta.SyncTokenStore()
+    queue = job(1, 0, 1) + job(1, 1, 1) + job(2, 0, 2)
+    jobs, lines = delta(store, '', queue)
+    assert ['1.0', '1.1', '2.0'] == jobs
+    assert 'false' == lines['Delta']
+    assert not lines.has_key('Removed')
+    token = lines['SyncToken']
+
+    # nothing has changed but the time of the query
+    queue = job(1, 0, 1, 2000) + job(1, 1, 1, 2000) + job(2, 0, 2, 2000)
+    jobs, lines = delta(store, token, queue)
+    assert [] == jobs
+    assert {'SyncToken': token, 'Delta': 'true', 'Removed': ''} == lines
+
+    # one job changes, one leaves and one arrives
+    queue = job(1, 0, 2) + job(2, 0, 2) + job(3, 0, 1)
+    jobs, lines = delta(store, token, queue)
+    assert ['1.0', '3.0'] == jobs
+    assert 'true' == lines['Delta']
+    assert '1.1' == lines['Removed']
+    assert token != lines['SyncToken']
+
+    # the old token still works until it expires
+    jobs, lines = delta(store, token, queue)
+    assert ['1.0', '3.0'] == jobs
+
+    # but not for a different query
+    jobs, lines = delta(store, token, queue, ('schedd', '1'))
+    assert 'false' == lines['Delta']
+    assert 3 == len(jobs)
+
+
+def test_token_limits():
+    store = queue_delta.SyncTokenStore(max_jobs=4, max_age=60)
+    first = delta(store, '', job(1, 0, 1) + job(1, 1, 1))[1]['SyncToken']
+    second = delta(store, '', job(2, 0, 1) + job(2, 1, 1))[1]['SyncToken']
+    # a third token pushes out the least recently used one
+    delta(store, second, job(2, 0, 2) + job(2, 1, 1))
+    assert 'false' == delta(store, first, job(1, 0, 1))[1]['Delta']
+    assert 4 >= store.stats()['jobs']
+
+    # too many jobs for any token
+    assert '' == delta(store, '', ''.join([job(3, i, 1) for i in range(5)]))[1]['SyncToken']
+
+    # tokens expire
+    store = queue_delta.SyncTokenStore(max_age=60)
+    token = delta(store, '', job(1, 0, 1))[1]['SyncToken']
+    store._tokens[token][2] = time.time() - 61
+    assert 'false' == delta(store, token, job(1, 0, 1))[1]['Delta']
+    assert {'tokens': 1, 'jobs': 1} == store.stats()
@@ -25,11 +25,25 @@
 # IMPORTS
 ################################################################################
 import util
+import backend
+import history_index
+import history_tail
+import queue_delta
+import classad_expr
+import ad_json
+import metrics
+import profiling
 import time
 import math
 import logging
 import os
 import glob
+import hashlib
+import threading
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
 
 ################################################################################
@@ -41,40 +55,122 @@ __doc__ = "CondorAgent Utilities for Condor: Scheduler"
 # used when deciding what history files need to be processed
 COMPLETED_SINCE_OVERLAP = 5
 
+# condor_q queries in progress, shared by identical requests
+currentQueries = util.SingleFlight('condor_q')
+
+# the most history files read at once for a request
+DEFAULT_HISTORY_THREADS = 4
+
+# the attributes always returned when the request asks for only some of them
+REQUIRED_ATTRIBUTES = ('ClusterId', 'ProcId')
+
+# the number of seconds a schedd ad is served from ScheddAdCache
+DEFAULT_SCHEDD_AD_REFRESH = 30
+
+# the most schedds queried at once by a multi-schedd jobs request
+DEFAULT_SCHEDD_THREADS = 4
+
 
 ################################################################################
 # CLASSES
 ################################################################################
 class ScheddQuery:
     
-    def __init__(self, schedd_name):
+    def __init__(self, schedd_name, attrs=None, constraint=None):
+        '''If attrs (a list of attribute names) is given the job and history
+        ads only have those attributes, and ClusterId and ProcId. If
+        constraint (a ClassAd expression) is given only the jobs it is true
+        for are returned.'''
         self.scheddName=schedd_name
+        self.constraint = constraint
+        # the constraint is evaluated here for history if it can be (see
+        # classad_expr), otherwise condor_history is run for each file
+        self.constraintExpr = None
+        if constraint is not None:
+            try:
+                self.constraintExpr = classad_expr.parse(constraint)
+            except classad_expr.UnsupportedExpression, e:
+                logging.info("The constraint will be evaluated by condor_history: %s" % e)
+        self.attrs = None
+        if attrs is not None:
+            self.attrs = list(REQUIRED_ATTRIBUTES)
+            for name in attrs:
+                if name.lower() not in [a.lower() for a in self.attrs]:
+                    self.attrs.append(name)
+        self.attrSet = util.attributeSet(self.attrs)
+        # (bytes read, ads returned) for each history file read, for metrics
+        self.historyReads = []
     
-    def execute(self, completed_since, jobs, history):
+    def execute(self, completed_since, jobs, history, sync_token=None):
+        return "".join(self.stream(completed_since, jobs, history, sync_token))
+
+    def stream(self, completed_since, jobs, history, sync_token=None):
+        '''Generates the text execute returns in pieces, as condor_q and
+        the history files produce it, so a large queue never has to be held
+        in memory all at once. If sync_token is given (it may be empty) only
+        the jobs that changed since it was handed out are returned; see
+        queue_delta.'''
         # Get timestamp for upcoming condor_history call (this will be the next
         # completedSince), add results from condor_history if appropriate.
-        q_data = self.getCurrent(jobs)
+        current = profiling.timed('condor_q', self.streamCurrent(jobs))
+        if sync_token is not None:
+            current = queue_delta.streamDelta((self.scheddName, jobs, self.attrKey(), self.constraint), sync_token, current)
+            current = profiling.timed('delta', current)
+        for q_data in current:
+            yield q_data
         
         if history:
-            history_data, new_completed_since = self.getHistory(completed_since, jobs)
-            return_time  = "-- CompletedSince: " + str(new_completed_since) + "\n"
-            data         = q_data + return_time + history_data
-        else:
-            data = q_data
-        return data
+            self.historyReads = []
+            new_completed_since, history_data = profiling.measure('history_scan', self.streamHistory, completed_since, jobs)
+            yield "-- CompletedSince: " + str(new_completed_since) + "\n"
+            for data in profiling.timed('history', history_data):
+                yield data
+            metrics.historyBytes.observe((), sum([read[0] for read in self.historyReads]))
+            metrics.historyAds.observe((), sum([read[1] for read in self.historyReads]))
+    
+    def getETag(self, completed_since, jobs, history, sync_token=None):
+        '''Returns a weak ETag for what execute would return, or None if it
+        can't be worked out. The ETag comes from the size, modification time
+        and inode of the schedd's job queue log and history files rather
+        than from running condor_q, so it only changes when the schedd has
+        written one of them.'''
+        queue_log = util.getCondorConfigVal("JOB_QUEUE_LOG", "schedd", self.scheddName)
+        if not queue_log:
+            spool = util.getCondorConfigVal("SPOOL", "schedd", self.scheddName)
+            if not spool:
+                return None
+            queue_log = os.path.join(spool, "job_queue.log")
+        queue_state = fileState(queue_log)
+        if queue_state is None:
+            logging.debug("Unable to read the job queue log %s, no ETag" % queue_log)
+            return None
+        state = [self.scheddName, os.environ.get("CONDOR_VERSION"), completed_since, jobs, history, sync_token, self.attrKey(), self.constraint, queue_state]
+        if history:
+            history_file = util.getCondorConfigVal("HISTORY", "schedd", self.scheddName)
+            if history_file:
+                files = glob.glob(os.path.normpath(history_file) + "*")
+                files.sort()
+                for f in files:
+                    state.append((f, fileState(f)))
+        return 'W/"%s"' % hashlib.md5(repr(state)).hexdigest()
     
+    def attrKey(self):
+        '''Returns the requested attributes in a form that can be compared,
+        or None if all of them were requested.'''
+        if self.attrs is None:
+            return None
+        return tuple(sorted(self.attrSet.keys()))
+
     def getCurrent(self, jobs):
+        return "".join(self.streamCurrent(jobs))
+
+    def streamCurrent(self, jobs):
         # Get results from condor_q
-        if os.environ.has_key("CONDOR_MAJOR_VERSION") and float(os.environ["CONDOR_MAJOR_VERSION"]) >= 8.5:
-            q_cmd = 'condor_q -allusers -name %s -long %s' % (self.scheddName, jobs)
-        else:
-            q_cmd = 'condor_q -name %s -long %s' % (self.scheddName, jobs)
-        logging.info("condor_q command: %s" %q_cmd)
-        q_data, err_data = util.runCommand(q_cmd)
-        if err_data != '':
-            # We really should be checking the return code but that's not available
-            raise Exception("Executing condor_q command:\n%s" %err_data)
-        return q_data
+        all_users = os.environ.has_key("CONDOR_MAJOR_VERSION") and float(os.environ["CONDOR_MAJOR_VERSION"]) >= 8.5
+        # Identical queries that arrive while this one is running share its output.
+        return currentQueries.stream((self.scheddName, jobs, all_users, self.attrKey(), self.constraint),
+                                     lambda: backend.getBackend().queryQueue(self.scheddName, jobs, self.attrs,
+                                                                              self.constraint, all_users))
     
         
     def getHistory(self, completed_since, jobs):
@@ -83,6 +179,15 @@ class ScheddQuery:
         CompletionDate) that was read. This ensures that the next time
         the client reads we resume from the last value we read in the
         file. (Previously we used the current timestamp.)'''
+        new_completed_since, history_data = self.streamHistory(completed_since, jobs)
+        return ("".join(history_data), new_completed_since)
+
+    def streamHistory(self, completed_since, jobs):
+        '''Same as getHistory, but returns new_completed_since and a
+        generator of the history text. Each file is scanned for the ads it
+        will return before anything is generated, so new_completed_since is
+        known up front. The files are scanned and read several at once, and
+        their text is generated in order, oldest file first.'''
         new_completed_since = completed_since
         history_file = util.getCondorConfigVal("HISTORY", "schedd", self.scheddName)
         if history_file == None:
@@ -96,8 +201,41 @@ class ScheddQuery:
             raise Exception("The HISTORY setting is an empty string")
         history_file = os.path.normpath(history_file)
         logging.info("History file for daemon %s: %s"%(self.scheddName, history_file))
+        use_mmap = util.getCondorConfigVal("CONDOR_AGENT_HISTORY_MMAP")
+        use_mmap = bool(use_mmap) and use_mmap.lower() == 'true'
+        index_dir = util.getCondorConfigVal("CONDOR_AGENT_HISTORY_INDEX_DIR")
+        if index_dir:
+            index_dir = index_dir.replace('"', '')
+            if not os.path.isdir(index_dir):
+                logging.warning('History index directory %s does not exist, history will not be indexed' % index_dir)
+                index_dir = None
+        tailer = None
+        use_tail = util.getCondorConfigVal("CONDOR_AGENT_HISTORY_TAIL")
+        if use_tail and use_tail.lower() == 'true':
+            tailer = history_tail.getTailer(self.scheddName, history_file)
         files        = glob.glob(history_file + "*")
-        history_data = ''
+        if index_dir:
+            history_index.pruneHistoryIndexes(index_dir, history_file, [f for f in files if os.path.isfile(f)])
+        # the jobs and constraint are matched here unless one of them can't be
+        filters = []
+        use_condor_history = False
+        if jobs != "":
+            try:
+                filters.append(classad_expr.jobsExpression(jobs))
+            except classad_expr.UnsupportedExpression, e:
+                logging.info("The jobs will be selected by condor_history: %s" % e)
+                use_condor_history = True
+        if self.constraint is not None:
+            if self.constraintExpr is None:
+                use_condor_history = True
+            else:
+                filters.append(self.constraintExpr)
+        # rotated files are named for the time they were rotated, so sorting
+        # puts them oldest first, followed by the current file
+        files.sort(key=lambda f: (os.path.normpath(f) == history_file, f))
+        # each task returns the new completedSince for a file (None if it
+        # doesn't give one) and a generator of its text
+        tasks = []
         for f in files:
             if os.path.isfile(f):
                 mod = os.path.getmtime(f)
@@ -107,45 +245,317 @@ class ScheddQuery:
                 if mod >= (completed_since - COMPLETED_SINCE_OVERLAP) or os.path.normpath(f) == history_file:
                     # each output from condor_history has a trailing newline so we can
                     # just concatenate them
-                    if jobs != "":
-                        history_data = history_data + self.getItemizedHistoryFromFile(completed_since, jobs, f)
+                    if jobs != "" and use_condor_history:
+                        tasks.append(lambda f=f: (None, self.streamItemizedHistoryFromFile(completed_since, jobs, f)))
+                    elif jobs != "":
+                        tasks.append(lambda f=f: (None, self.streamMatchingHistoryFromFile(filters, f, use_mmap)))
+                    elif use_condor_history:
+                        tasks.append(lambda f=f: self.streamConstrainedHistoryFromFile(completed_since, f, use_mmap))
+                    elif tailer and os.path.normpath(f) == history_file:
+                        tasks.append(lambda f=f: self.streamHistoryFromTailer(completed_since, f, tailer, use_mmap, index_dir, history_file))
                     else:
-                        new_data, new_time = self.getHistoryFromFile(completed_since, f)
-                        # keep the latest we've seen
-                        new_completed_since = max(new_time, new_completed_since)
-                        logging.debug("New CompletedSince: %s" % new_completed_since)
-                        history_data = history_data + new_data
+                        tasks.append(lambda f=f: self.streamHistoryFromFile(completed_since, f, use_mmap, index_dir, history_file))
                 else:
                     logging.info("History file %s was last modified before given completedSince, skipped" % os.path.basename(f))
-        return (history_data, new_completed_since)
+        # the files are scanned, and then read, up to CONDOR_AGENT_HISTORY_THREADS at a time
+        threads = int(util.getCondorConfigVal("CONDOR_AGENT_HISTORY_THREADS", default=DEFAULT_HISTORY_THREADS))
+        if threads > 1 and len(tasks) > 1:
+            logging.debug("Reading %d history files with up to %d threads" % (len(tasks), threads))
+        sources = []
+        for new_time, new_data in util.parallelMap(lambda task: task(), tasks, threads):
+            if new_time is not None:
+                # keep the latest we've seen
+                new_completed_since = max(new_time, new_completed_since)
+            sources.append(new_data)
+        logging.debug("New CompletedSince: %s" % new_completed_since)
+        return (new_completed_since, util.parallelChain(sources, threads))
     
-    def getHistoryFromFile(self, completed_since, history_file):
+    def getHistoryFromFile(self, completed_since, history_file, use_mmap=False, index_dir=None, history_base=None):
         '''Reads from the history file backwards to just get the changes.
-        Returns the text and the latest non-zero CompletionDate found.'''
+        Returns the text and the latest non-zero CompletionDate found. If
+        use_mmap is set the file is memory-mapped rather than read. If
+        index_dir is set the first ad to read is found with the file's
+        index (see history_index) instead of scanning the file.'''
+        max_completion, data = self.streamHistoryFromFile(completed_since, history_file, use_mmap, index_dir, history_base)
+        return ("".join(data), max_completion)
+
+    def streamHistoryFromFile(self, completed_since, history_file, use_mmap=False, index_dir=None, history_base=None):
+        '''Returns the latest non-zero CompletionDate getHistoryFromFile
+        would find and a generator of its text. Only the ads that were in
+        the file when it was scanned are generated; anything written after
+        that is left for the next request.'''
+        f = open(history_file, "rb")
+        try:
+            if index_dir:
+                start, end, max_completion = history_index.scanHistory(index_dir, history_base or history_file, f, history_file, completed_since)
+            else:
+                start, end, max_completion = util.scanHistory(f, completed_since, use_mmap)
+        except:
+            f.close()
+            raise
+        return (max_completion, self._streamHistoryFromOpenFile(f, completed_since, use_mmap, start, end, history_file))
+
+    def _streamHistoryFromOpenFile(self, f, completed_since, use_mmap, start, end, history_file):
+        try:
+            if self.constraintExpr is None:
+                ads = util.readCondorHistoryForward(f, completed_since, use_mmap, start, end, self.attrSet)
+                attrs = None
+            else:
+                # the constraint may refer to any attribute, so whole ads are
+                # read and cut down as they are written
+                ads = self.filterHistory(util.readCondorHistoryForward(f, completed_since, use_mmap, start, end),
+                                         [self.constraintExpr])
+                attrs = self.attrSet
+            for data in self.formatHistory(ads, history_file, attrs, end - start):
+                yield data
+        finally:
+            f.close()
+
+    def getHistoryFromTailer(self, completed_since, history_file, tailer, use_mmap=False, index_dir=None, history_base=None):
+        '''Returns the same as getHistoryFromFile for the current history
+        file, from the ads buffered by the schedd's history tailer if it has
+        all of them.'''
+        max_completion, data = self.streamHistoryFromTailer(completed_since, history_file, tailer, use_mmap, index_dir, history_base)
+        return ("".join(data), max_completion)
+
+    def streamHistoryFromTailer(self, completed_since, history_file, tailer, use_mmap=False, index_dir=None, history_base=None):
+        '''Same as streamHistoryFromFile, from the tailer's buffer if it can.'''
+        ads = tailer.getAds(completed_since)
+        if ads is None:
+            return self.streamHistoryFromFile(completed_since, history_file, use_mmap, index_dir, history_base)
+        max_completion = 0
+        for job in ads:
+            # CompletionDate may not be specified, or may appear as 0, both of which are ignored
+            max_completion = max(job.completion_date(), max_completion)
+        if self.constraintExpr is not None:
+            ads = self.filterHistory(ads, [self.constraintExpr])
+        # the tailer holds whole ads, so they are cut down as they are written
+        return (max_completion, self.formatHistory(ads, history_file, self.attrSet))
+
+    def formatHistory(self, ads, history_file, attrs=None, bytes_read=0):
+        '''Generates the text of each of the ads, with only the attributes in
+        attrs if it is given. bytes_read is how much of the history file
+        was read for them, for metrics.'''
+        count = 0
+        for job in ads:
+            # each ad is followed by a blank line, as with condor_history -l
+            yield job.get_text(attrs) + "\n"
+            count += 1
+        logging.debug("Read %s jobs from history file %s" % (count, history_file))
+        self.historyReads.append((bytes_read, count))
+
+    def filterHistory(self, ads, filters):
+        '''Generates the ads that all of filters (classad_expr Expressions)
+        match.'''
+        for ad in ads:
+            for f in filters:
+                if not f.matches(ad.ad):
+                    break
+            else:
+                yield ad
+
+    def streamMatchingHistoryFromFile(self, filters, history_file, use_mmap=False):
+        '''Generates the text of the ads in the history file that all of
+        filters match, whenever they completed, newest first as
+        condor_history lists them.'''
+        f = open(history_file, "rb")
+        try:
+            ads = self.filterHistory(util.readCondorHistory(f, -1, use_mmap), filters)
+            for data in self.formatHistory(ads, history_file, self.attrSet, os.fstat(f.fileno()).st_size):
+                yield data
+        finally:
+            f.close()
+
+    def streamConstrainedHistoryFromFile(self, completed_since, history_file, use_mmap=False):
+        '''Same as streamHistoryFromFile, for a constraint that only
+        condor_history can evaluate.'''
         f = open(history_file, "rb")
         try:
-            ads = list(util.readCondorHistory(f, completed_since))
-            jobs = []
-            max_completion = 0
-            for job in reversed(ads):
-                jobs.append(job.get_text())
-                # CompletionDate may not be specified, or may appear as 0, both of which are ignored
-                max_completion = max(job.ad.get("CompletionDate", 0), max_completion)
-
-            logging.debug("Read %s jobs from history file %s" % (len(jobs), history_file))
-            return ("\n".join(jobs) + "\n", max_completion)
+            max_completion = util.scanHistory(f, completed_since, use_mmap)[2]
         finally:
             f.close()
+        return (max_completion, self.streamItemizedHistoryFromFile(completed_since, "", history_file, True))
 
-    def getItemizedHistoryFromFile(self, completed_since, jobs, history_file):
-        '''Note: we could modify the above method to take a constraint on jobs,
-        and process the list of X.Y Z into a filter. Then we would not need to run condor_history at all.'''
-        history_data = ''
-        err_data     = ''
-        history_cmd = 'condor_history -l -f %s %s' % (history_file, jobs)
-        history_data, err_data = util.runCommand(history_cmd)
-        if err_data != '':
-            raise Exception("Executing condor_history command:\n%s" %err_data)
+    def streamItemizedHistoryFromFile(self, completed_since, jobs, history_file, only_since=False):
+        '''Generates the output of getItemizedHistoryFromFile, running
+        condor_history only when the output is wanted.'''
+        yield self.getItemizedHistoryFromFile(completed_since, jobs, history_file, only_since)
+
+    def getItemizedHistoryFromFile(self, completed_since, jobs, history_file, only_since=False):
+        '''Runs condor_history for the jobs and constraint, for when
+        classad_expr can't select them (see streamMatchingHistoryFromFile).
+        If only_since is set only the jobs that completed after
+        completed_since are returned.'''
+        constraint = self.constraint
+        if constraint is not None and only_since:
+            constraint = '(CompletionDate =?= undefined || CompletionDate == 0 || CompletionDate > %d) && (%s)' % \
+                         (completed_since, constraint)
+        history_data = backend.getBackend().queryHistoryFile(history_file, jobs, constraint)
+        # condor_history reads the whole file
+        self.historyReads.append((os.path.getsize(history_file), history_data.count('\n\n')))
+        if self.attrSet is not None:
+            # older versions of condor_history don't have -attributes
+            history_data = util.projectAdText(history_data, self.attrSet)
         return history_data
     
 
+
+class ScheddAdCache:
+    '''The ClassAd of each schedd, as condor_status -schedd -long gives it,
+    fetched again once it is older than CONDOR_AGENT_SCHEDD_AD_REFRESH
+    seconds.'''
+
+    def __init__(self, fetch=None):
+        # fetch(schedd_name) returns the text of the ad, fetchScheddAd if
+        # it isn't given
+        self.fetch = fetch
+        # schedd name -> (ad text, time fetched)
+        self._ads = {}
+        self._lock = threading.Lock()
+        # one lock for each schedd, so only one caller fetches its ad at once
+        self._fetching = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, schedd_name, refresh=None):
+        '''Returns the text of the schedd's ad, fetching it if the cached
+        copy is older than refresh seconds (CONDOR_AGENT_SCHEDD_AD_REFRESH
+        if it isn't given). If fetching it fails the cached copy is returned
+        if there is one.'''
+        if refresh is None:
+            refresh = int(util.getCondorConfigVal("CONDOR_AGENT_SCHEDD_AD_REFRESH", default=DEFAULT_SCHEDD_AD_REFRESH))
+        cached = self._cached(schedd_name, refresh)
+        if cached is not None:
+            return cached
+        self._lock.acquire()
+        try:
+            fetching = self._fetching.setdefault(schedd_name, threading.Lock())
+        finally:
+            self._lock.release()
+        fetching.acquire()
+        try:
+            # somebody else may have fetched it while we waited
+            cached = self._cached(schedd_name, refresh)
+            if cached is not None:
+                return cached
+            self._lock.acquire()
+            try:
+                self.misses += 1
+            finally:
+                self._lock.release()
+            try:
+                text = (self.fetch or fetchScheddAd)(schedd_name)
+            except Exception, e:
+                stale = self._ads.get(schedd_name)
+                if stale is None:
+                    raise
+                logging.warning("Unable to refresh the ad for schedd %s, returning the one from %d seconds ago: %s" %
+                                (schedd_name, time.time() - stale[1], str(e)))
+                return stale[0]
+            self._lock.acquire()
+            try:
+                self._ads[schedd_name] = (text, time.time())
+            finally:
+                self._lock.release()
+            return text
+        finally:
+            fetching.release()
+
+    def stats(self):
+        self._lock.acquire()
+        try:
+            return {'schedds': len(self._ads), 'hits': self.hits, 'misses': self.misses}
+        finally:
+            self._lock.release()
+
+    def _cached(self, schedd_name, refresh):
+        self._lock.acquire()
+        try:
+            entry = self._ads.get(schedd_name)
+            if entry is not None and time.time() - entry[1] < refresh:
+                self.hits += 1
+                return entry[0]
+            return None
+        finally:
+            self._lock.release()
+
+
+# the schedd ads served by the schedd status endpoint
+scheddAds = ScheddAdCache()
+
+# the names of the schedds on this host, one per line, by host name
+localSchedds = ScheddAdCache(lambda host: fetchLocalScheddNames(host))
+
+metrics.registry.collect('condor_agent_condor_q_started_total', 'counter',
+    'condor_q queries started', lambda: currentQueries.started)
+metrics.registry.collect('condor_agent_condor_q_shared_total', 'counter',
+    'Requests that shared a condor_q query already running', lambda: currentQueries.coalesced)
+metrics.registry.collect('condor_agent_schedd_ad_cache_hits_total', 'counter',
+    'Schedd ads served from the cache', lambda: scheddAds.hits)
+metrics.registry.collect('condor_agent_schedd_ad_cache_misses_total', 'counter',
+    'Schedd ads fetched from the collector', lambda: scheddAds.misses)
+
+
+################################################################################
+# METHODS
+################################################################################
+def fetchScheddAd(schedd_name):
+    '''Returns the text of the schedd's ad from the collector.'''
+    return backend.getBackend().scheddAd(schedd_name)
+
+
+def fetchLocalScheddNames(host):
+    '''Returns the names of the schedds the collector knows of on the host,
+    one per line.'''
+    return backend.getBackend().scheddNames(host)
+
+
+def getLocalScheddNames():
+    '''Returns the names of the schedds on this host.'''
+    host = util.getCondorConfigVal("FULL_HOSTNAME")
+    if not host:
+        raise Exception("Unable to find this host's name (FULL_HOSTNAME)")
+    return localSchedds.get(host).split()
+
+
+def streamScheddSection(schedd_name, pieces, output_format='text'):
+    '''Generates one schedd's part of a multi-schedd jobs response: a
+    line naming the schedd, followed by its response generated by pieces in
+    the given format (text or ndjson). If that fails, the error is reported
+    on a line after whatever had been generated instead of being raised, so
+    the other schedds' parts are still returned.'''
+    if output_format == 'ndjson':
+        header = '{"schedd": %s}\n' % json.dumps(schedd_name)
+        pieces = ad_json.streamJSON(pieces, 'ndjson')
+    else:
+        header = "-- Schedd: %s\n" % schedd_name
+    # the header isn't generated until there is something to follow it, so
+    # the part isn't taken as ready while the schedd is still being queried
+    try:
+        for piece in pieces:
+            if header is not None:
+                yield header
+                header = None
+            yield piece
+    except Exception, e:
+        logging.error("Error querying schedd %s: %s" % (schedd_name, str(e)))
+        message = ' '.join(str(e).split())
+        if header is not None:
+            yield header
+            header = None
+        if output_format == 'ndjson':
+            yield '{"error": %s}\n' % json.dumps(message)
+        else:
+            yield "-- Error: %s\n" % message
+    if header is not None:
+        yield header
+
+
+def fileState(path):
+    '''Returns (inode, size, mtime) for the file, or None if it can't be
+    read.'''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime)
@@ -0,0 +1,40 @@
+import schedd
+
+
+def test_schedd_ad_cache():
+    fetched = []
+    def fetch(name):
+        fetched.append(name)
+        if len(fetched) == 3:
+            raise Exception("collector is down")
+        return 'Name = "%s"\nTotalRunningJobs = %d\n' % (name, len(fetched))
+    cache = schedd.ScheddAdCache(fetch)
+    assert 'Name = "s1"\nTotalRunningJobs = 1\n' == cache.get('s1', 60)
+    assert 'Name = "s1"\nTotalRunningJobs = 1\n' == cache.get('s1', 60)
+    assert ['s1'] == fetched
+    assert {'schedds': 1, 'hits': 1, 'misses': 1} == cache.stats()
+
+    # an old ad is fetched again
+    assert 'Name = "s1"\nTotalRunningJobs = 2\n' == cache.get('s1', 0)
+    # but kept if that fails
+    assert 'Name = "s1"\nTotalRunningJobs = 2\n' == cache.get('s1', 0)
+    assert 3 == len(fetched)
+    # unless there isn't one
+    fetched[:] = [None, None]
+    try:
+        cache.get('s2', 60)
+        assert False
+    except Exception, e:
+        assert "collector is down" == str(e)
+
+
+def test_schedd_section():
+    def failing():
+        yield 'ClusterId = 1\nProcId = 0\n\n'
+        raise Exception("Executing condor_q command:\ncannot connect")
+    assert '-- Schedd: s1\nClusterId = 1\nProcId = 0\n\n-- Error: Executing condor_q command: cannot connect\n' == \
+        ''.join(schedd.streamScheddSection('s1', failing()))
+    assert '{"schedd": "s1"}\n{"job": {"ClusterId": 1, "ProcId": 0}}\n' + \
+        '{"error": "Executing condor_q command: cannot connect"}\n' == \
+        ''.join(schedd.streamScheddSection('s1', failing(), 'ndjson'))
+    assert '-- Schedd: s2\n' == ''.join(schedd.streamScheddSection('s2', iter([])))
@@ -29,10 +29,18 @@ import time
 import re
 import StringIO
 import gzip
+import zlib
 import urllib
 import logging
 import os
 import string
+import mmap
+import threading
+import tempfile
+import pipes
+import signal
+import backend
+import metrics
 
 
 ################################################################################
@@ -42,10 +50,630 @@ __doc__ = "CondorAgent Utilities for Condor:Utilities"
 
 URL_ATTR_VALUE = re.compile('(?P<attr>.*?)=(?P<value>.*)$')
 
+# the size of the reads used when scanning history files
+HISTORY_BLOCK_SIZE = 64 * 1024
+
+# the largest piece of a command's output streamCommand generates at once
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# a valid ClassAd attribute name
+ATTRIBUTE_NAME = re.compile('^[A-Za-z_][A-Za-z0-9_]*$')
+
+# the default zlib compression level for responses
+COMPRESSION_LEVEL = 6
+
+# the content encodings we can compress responses with and the zlib window
+# bits that produce each of them
+ENCODINGS = {'gzip'    : 16 + zlib.MAX_WBITS,
+             'deflate' : zlib.MAX_WBITS}
+
+# the CompletionDate line of an ad in a history file
+AD_COMPLETION_DATE = re.compile('^[ \t]*CompletionDate = [ \t]*(\S.*)$', re.M)
+
+# how long (in seconds) configuration values are cached by default
+CONFIG_CACHE_TTL = 60
+
+# how often (in seconds) the configuration files are checked for changes
+CONFIG_CHECK_INTERVAL = 1
+
+# returned by _runCondorConfigVal when condor_config_val fails
+ERROR = object()
+
+# the number of seconds a command may run before it is killed
+COMMAND_TIMEOUT = 300
+
+# the most commands of each kind (condor_q, condor_history, ...) run at once
+COMMAND_LIMIT = 8
+
 
 ################################################################################
 # CLASSES
 ################################################################################
+class ConfigCache:
+    '''A thread-safe cache of condor_config_val results, keyed by (attr,
+    daemon, name). Settings that are not defined are cached too. Entries
+    expire after ttl seconds (a ttl of 0 turns the cache off), and the whole
+    cache is dropped when invalidate() is called or any of the HTCondor
+    configuration files changes.
+
+    Values are looked up in a snapshot of the whole configuration, taken with
+    one condor_config_val -dump for the local configuration and one for each
+    named daemon, rather than running condor_config_val for each setting.
+    Only if the dump fails are settings looked up one at a time.'''
+
+    def __init__(self, ttl=CONFIG_CACHE_TTL):
+        self.ttl = ttl
+        self._values = {}
+        # (daemon, name) -> (dictionary of settings or None if the dump failed, time)
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        # held while taking a snapshot; separate from _lock so cached values
+        # can still be read during a slow dump
+        self._refreshLock = threading.Lock()
+        # path -> mtime of the configuration files, None until first looked up
+        self._configFiles = None
+        self._lastCheck = 0
+
+    def get(self, key):
+        '''Returns (True, value) if the key is cached, where value is None for
+        a setting that is not defined, or (False, None) if it is not.'''
+        if self.ttl <= 0:
+            return (False, None)
+        self._checkConfigFiles()
+        self._lock.acquire()
+        try:
+            entry = self._values.get(key)
+            if entry is not None and time.time() - entry[1] < self.ttl:
+                return (True, entry[0])
+            return (False, None)
+        finally:
+            self._lock.release()
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        self._lock.acquire()
+        try:
+            self._values[key] = (value, time.time())
+        finally:
+            self._lock.release()
+
+    def getSnapshot(self, daemon='', name=''):
+        '''Returns a dictionary of every setting (by upper case name) for the
+        daemon, or None if the configuration could not be dumped.'''
+        if self.ttl <= 0:
+            return None
+        key = (daemon, name)
+        entry = self._snapshots.get(key)
+        if entry is not None and time.time() - entry[1] < self.ttl:
+            return entry[0]
+        # choosing the backend reads the configuration itself, so it is done
+        # before taking the lock
+        source = backend.getBackend()
+        # only one caller dumps the configuration; the others wait for it
+        # and use its snapshot
+        self._refreshLock.acquire()
+        try:
+            entry = self._snapshots.get(key)
+            if entry is not None and time.time() - entry[1] < self.ttl:
+                return entry[0]
+            (values, files) = dumpCondorConfig(daemon, name, source)
+            self._snapshots[key] = (values, time.time())
+            if files and key == ('', '') and self._configFiles is None:
+                self._configFiles = _statFiles(files)
+            return values
+        finally:
+            self._refreshLock.release()
+
+    def invalidate(self, reason='requested'):
+        '''Drops every cached value. This does not take the lock (replacing
+        the dictionaries is atomic) so it is safe to call from a signal
+        handler.'''
+        logging.info('Clearing cached configuration (%s)' % reason)
+        self._values = {}
+        self._snapshots = {}
+        self._configFiles = None
+
+    def _checkConfigFiles(self):
+        '''Invalidates the cache if a configuration file has changed since the
+        values were cached. The files are looked at no more than once every
+        CONFIG_CHECK_INTERVAL seconds.'''
+        now = time.time()
+        if now - self._lastCheck < CONFIG_CHECK_INTERVAL:
+            return
+        self._lastCheck = now
+        config_files = self._configFiles
+        if config_files is None:
+            # the local snapshot lists the files it came from
+            self.getSnapshot()
+            if self._configFiles is None:
+                self._configFiles = _statFiles(getCondorConfigFiles())
+            return
+        current = _statFiles(config_files.keys())
+        if current != config_files:
+            self.invalidate('configuration files changed')
+            self._configFiles = current
+
+
+# the cache used by getCondorConfigVal
+configCache = ConfigCache()
+
+
+class SingleFlight:
+    '''Lets concurrent callers that want the same output share one
+    generator of it, so an expensive command is only run once however many
+    requests for it arrive while it is running. Callers that join get all of
+    its output from the start, so they can only join until the first piece
+    has been read by everybody already reading it. Each piece is only kept
+    until every caller has read it.'''
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+        self._lock = threading.Lock()
+        # the number of generators started, and the number of callers that
+        # shared one somebody else had started
+        self.started = 0
+        self.coalesced = 0
+
+    def stream(self, key, start):
+        '''Generates the output for key. If nobody else is reading it
+        already (or it is too late to join them), start() is called to get
+        the generator for it.'''
+        self._lock.acquire()
+        try:
+            flight = self._flights.get(key)
+            reader = None
+            if flight is not None:
+                reader = flight.join()
+            if reader is None:
+                if flight is not None:
+                    logging.debug('[%s] Too late to share the output being generated for %s' % (self.name, str(key)))
+                flight = _Flight(start())
+                self._flights[key] = flight
+                reader = flight.join()
+                self.started += 1
+            else:
+                self.coalesced += 1
+                logging.info('[%s] Sharing the output already being generated for %s' % (self.name, str(key)))
+            flight.callers += 1
+            flight.readers += 1
+        finally:
+            self._lock.release()
+        return self._follow(key, flight, reader)
+
+    def stats(self):
+        '''Returns the counts of generators started, callers coalesced and
+        generators running.'''
+        self._lock.acquire()
+        try:
+            return {'started': self.started, 'coalesced': self.coalesced, 'inflight': len(self._flights)}
+        finally:
+            self._lock.release()
+
+    def _follow(self, key, flight, reader):
+        i = 0
+        try:
+            while True:
+                chunk = flight.get(reader, i)
+                if chunk is None:
+                    break
+                yield chunk
+                i += 1
+        finally:
+            flight.leave(reader)
+            self._lock.acquire()
+            try:
+                flight.readers -= 1
+                # once it is finished (or nobody wants it) new callers have
+                # to start again
+                if (flight.done or flight.readers == 0) and self._flights.get(key) is flight:
+                    del self._flights[key]
+                    if flight.callers > 1:
+                        logging.info('[%s] Output for %s was shared by %d callers' % (self.name, str(key), flight.callers))
+                abandoned = flight.readers == 0 and not flight.done
+            finally:
+                self._lock.release()
+            if abandoned:
+                flight.close()
+
+
+class _Flight:
+    '''The output of one generator shared by the callers of a
+    SingleFlight. Whichever caller is furthest ahead reads the next piece,
+    and a piece is dropped once every caller has read it.'''
+
+    def __init__(self, source):
+        self.source = source
+        # the pieces from number first on, which somebody has still to read
+        self.chunks = []
+        self.first = 0
+        # reader -> the number of the piece it will read next
+        self.positions = {}
+        self.nextReader = 0
+        self.done = False
+        self.error = None
+        self.callers = 0
+        self.readers = 0
+        # held while reading the next piece from the generator
+        self.lock = threading.Lock()
+        # held while looking at or changing the pieces kept
+        self.chunksLock = threading.Lock()
+
+    def join(self):
+        '''Adds a reader, starting at the first piece, and returns it. None
+        is returned if the first piece has already been dropped.'''
+        self.chunksLock.acquire()
+        try:
+            if self.first > 0:
+                return None
+            reader = self.nextReader
+            self.nextReader += 1
+            self.positions[reader] = 0
+            return reader
+        finally:
+            self.chunksLock.release()
+
+    def leave(self, reader):
+        self.chunksLock.acquire()
+        try:
+            if self.positions.has_key(reader):
+                del self.positions[reader]
+            self._drop()
+        finally:
+            self.chunksLock.release()
+
+    def get(self, reader, i):
+        '''Returns piece i of the output for reader, waiting for it to be
+        generated, or None if there are no more. Asking for piece i means
+        the reader is done with the ones before it. An error raised by the
+        generator is raised to every caller when it gets that far.'''
+        self.chunksLock.acquire()
+        try:
+            self.positions[reader] = i
+            self._drop()
+        finally:
+            self.chunksLock.release()
+        while True:
+            self.chunksLock.acquire()
+            try:
+                if i < self.first + len(self.chunks):
+                    return self.chunks[i - self.first]
+                if self.done:
+                    break
+            finally:
+                self.chunksLock.release()
+            self.lock.acquire()
+            try:
+                if i >= self.first + len(self.chunks) and not self.done:
+                    try:
+                        chunk = self.source.next()
+                        self.chunksLock.acquire()
+                        try:
+                            self.chunks.append(chunk)
+                        finally:
+                            self.chunksLock.release()
+                    except StopIteration:
+                        self.done = True
+                    except Exception, e:
+                        self.error = e
+                        self.done = True
+            finally:
+                self.lock.release()
+        if self.error is not None:
+            raise self.error
+        return None
+
+    def _drop(self):
+        '''Drops the pieces every reader has read. Call with chunksLock
+        held.'''
+        if not self.positions:
+            return
+        lowest = min(self.positions.values())
+        if lowest > self.first:
+            del self.chunks[:lowest - self.first]
+            self.first = lowest
+
+    def close(self):
+        '''Stops the generator when nobody is reading it any more.'''
+        self.lock.acquire()
+        try:
+            self.done = True
+            try:
+                self.source.close()
+            except Exception, e:
+                logging.warning('Error stopping abandoned generator: %s' % str(e))
+        finally:
+            self.lock.release()
+
+
+class _Pipe:
+    '''A bounded buffer of the pieces one generator run by parallelChain
+    has produced, that the caller hasn't read yet. Several can share cond
+    so the caller can wait for any of them.'''
+
+    def __init__(self, size, cond=None):
+        self.size = size
+        self.items = []
+        self.cancelled = False
+        # True once the generator has finished or failed
+        self.done = False
+        self.cond = cond or threading.Condition()
+
+    def put(self, item):
+        '''Adds an item, waiting while the buffer is full. Returns False if
+        the caller has stopped reading.'''
+        self.cond.acquire()
+        try:
+            while len(self.items) >= self.size and not self.cancelled:
+                self.cond.wait()
+            if self.cancelled:
+                return False
+            self.items.append(item)
+            self.cond.notifyAll()
+            return True
+        finally:
+            self.cond.release()
+
+    def finish(self, item):
+        '''Adds the last item, whether or not there is room for it.'''
+        self.cond.acquire()
+        try:
+            self.done = True
+            self.items.append(item)
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def get(self):
+        self.cond.acquire()
+        try:
+            while not self.items:
+                self.cond.wait()
+            item = self.items.pop(0)
+            self.cond.notifyAll()
+            return item
+        finally:
+            self.cond.release()
+
+    def cancel(self):
+        self.cond.acquire()
+        try:
+            self.cancelled = True
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+
+class CommandExecutor:
+    '''Runs the commands the agent uses to talk to HTCondor. A command is an
+    argv list, run without a shell, or a string, run by the shell. Each
+    command is killed, with any children it started, if it hasn't finished
+    within its deadline (CONDOR_AGENT_COMMAND_TIMEOUT seconds), and at most
+    CONDOR_AGENT_COMMAND_LIMIT commands of each kind (condor_q,
+    condor_history, ...) run at once; the rest wait for one to finish.
+    condor_config_val is not limited, since the settings are read with it.
+
+    The wall time, exit code and output size of every command are logged,
+    and totals for each kind are kept for stats().'''
+
+    def __init__(self, limit=None, timeout=None):
+        # limit and timeout are read from the configuration if not given
+        self.limit = limit
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # kind -> Semaphore
+        self._slots = {}
+        # kind -> dictionary of totals, see stats()
+        self._totals = {}
+
+    def run(self, cmd, cwd=None, timeout=None):
+        '''Runs the command and returns (exit code, stdout, stderr). A
+        command that can't be started gets exit code 127, and one that is
+        killed at its deadline a negative exit code, with the reason in
+        stderr.'''
+        kind = commandKind(cmd)
+        (limit, timeout) = self._settings(kind, timeout)
+        logging.info('Executing cmd "%s" in "%s"' % (commandText(cmd), cwd))
+        slot = self._begin(kind, limit)
+        started = time.time()
+        deadline = None
+        return_code = None
+        stdout_value = ''
+        try:
+            try:
+                proc = _startCommand(cmd, cwd, subprocess.PIPE, subprocess.PIPE)
+            except OSError, e:
+                return_code = 127
+                return (return_code, '', 'Unable to run %s: %s\n' % (kind, str(e)))
+            deadline = _Deadline(proc, timeout)
+            try:
+                stdout_value, stderr_value = proc.communicate()
+            finally:
+                deadline.cancel()
+            return_code = proc.returncode
+            if deadline.expired:
+                stderr_value += 'Killed %s after %s seconds\n' % (kind, timeout)
+            return (return_code, stdout_value, stderr_value)
+        finally:
+            self._end(kind, slot, started, return_code, len(stdout_value), deadline)
+
+    def stream(self, cmd, cwd=None, error_message=None, blocksize=STREAM_BLOCK_SIZE, timeout=None):
+        '''Generates the command's stdout in pieces as it is written. stderr
+        goes to a temporary file so the command can never block writing to
+        it. If error_message is given and the command wrote to stderr, an
+        Exception with error_message % stderr is raised once stdout has been
+        generated. Reaching the deadline always raises an Exception, since
+        the output is incomplete.'''
+        kind = commandKind(cmd)
+        (limit, timeout) = self._settings(kind, timeout)
+        logging.info('Executing cmd "%s" in "%s"' % (commandText(cmd), cwd))
+        slot = self._begin(kind, limit)
+        started = time.time()
+        deadline = None
+        return_code = None
+        output_bytes = 0
+        err_data = ''
+        try:
+            err_file = tempfile.TemporaryFile()
+            try:
+                try:
+                    proc = _startCommand(cmd, cwd, subprocess.PIPE, err_file)
+                except OSError, e:
+                    return_code = 127
+                    err_data = 'Unable to run %s: %s\n' % (kind, str(e))
+                else:
+                    deadline = _Deadline(proc, timeout)
+                    try:
+                        while True:
+                            # os.read returns whatever is available rather
+                            # than waiting for a whole block
+                            data = os.read(proc.stdout.fileno(), blocksize)
+                            if not data:
+                                break
+                            output_bytes += len(data)
+                            yield data
+                    finally:
+                        # if we were abandoned early the command gets a broken pipe
+                        proc.stdout.close()
+                        proc.wait()
+                        deadline.cancel()
+                        return_code = proc.returncode
+                    err_file.seek(0)
+                    err_data = err_file.read()
+            finally:
+                err_file.close()
+        finally:
+            self._end(kind, slot, started, return_code, output_bytes, deadline)
+        if deadline is not None and deadline.expired:
+            message = 'Killed %s after %s seconds\n' % (kind, timeout)
+            if error_message is not None:
+                message = error_message % (err_data + message)
+            raise Exception(message)
+        if error_message is not None and err_data != '':
+            raise Exception(error_message % err_data)
+
+    def stats(self):
+        '''Returns a dictionary for each kind of command run with the number
+        run (calls), those that failed or were killed at their deadline
+        (failures, timeouts), the number running and waiting to run now,
+        and their total wall time (seconds) and output (bytes).'''
+        self._lock.acquire()
+        try:
+            return dict([(kind, totals.copy()) for kind, totals in self._totals.items()])
+        finally:
+            self._lock.release()
+
+    def _settings(self, kind, timeout):
+        '''Returns (limit, timeout) for a kind of command, None for
+        either meaning there isn't one.'''
+        limit = self.limit
+        if timeout is None:
+            timeout = self.timeout
+        if kind == 'condor_config_val':
+            # reading these settings runs condor_config_val
+            limit = None
+            if timeout is None:
+                timeout = COMMAND_TIMEOUT
+        else:
+            if limit is None:
+                limit = int(getCondorConfigVal("CONDOR_AGENT_COMMAND_LIMIT", default=COMMAND_LIMIT))
+            if timeout is None:
+                timeout = float(getCondorConfigVal("CONDOR_AGENT_COMMAND_TIMEOUT", default=COMMAND_TIMEOUT))
+        if limit is not None and limit <= 0:
+            limit = None
+        if timeout is not None and timeout <= 0:
+            timeout = None
+        return (limit, timeout)
+
+    def _begin(self, kind, limit):
+        '''Waits for a slot to run a command of the kind in, and returns
+        it (None if the kind isn't limited).'''
+        self._lock.acquire()
+        try:
+            totals = self._totals.setdefault(kind, {'calls': 0, 'failures': 0, 'timeouts': 0, 'running': 0,
+                                                    'waiting': 0, 'seconds': 0.0, 'bytes': 0})
+            slot = None
+            if limit is not None:
+                # the limit is read when the first command of a kind is run
+                slot = self._slots.setdefault(kind, threading.Semaphore(limit))
+            totals['waiting'] += 1
+        finally:
+            self._lock.release()
+        metrics.commandsWaiting.inc((kind,))
+        if slot is not None:
+            if not slot.acquire(False):
+                logging.info('Waiting for one of the %d %s commands running to finish' % (limit, kind))
+                slot.acquire()
+        self._lock.acquire()
+        try:
+            totals['waiting'] -= 1
+            totals['running'] += 1
+        finally:
+            self._lock.release()
+        metrics.commandsWaiting.dec((kind,))
+        metrics.commandsRunning.inc((kind,))
+        return slot
+
+    def _end(self, kind, slot, started, return_code, output_bytes, deadline):
+        elapsed = time.time() - started
+        timed_out = deadline is not None and deadline.expired
+        if slot is not None:
+            slot.release()
+        self._lock.acquire()
+        try:
+            totals = self._totals[kind]
+            totals['running'] -= 1
+            totals['calls'] += 1
+            totals['seconds'] += elapsed
+            totals['bytes'] += output_bytes
+            if return_code != 0:
+                totals['failures'] += 1
+            if timed_out:
+                totals['timeouts'] += 1
+        finally:
+            self._lock.release()
+        metrics.commandsRunning.dec((kind,))
+        metrics.commandSeconds.observe((kind,), elapsed)
+        metrics.commandOutputBytes.inc((kind,), output_bytes)
+        if return_code != 0:
+            metrics.commandFailures.inc((kind,))
+        if timed_out:
+            metrics.commandTimeouts.inc((kind,))
+        if timed_out:
+            logging.error('%s was killed at its deadline after %.3f seconds, %d bytes of output' %
+                          (kind, elapsed, output_bytes))
+        else:
+            logging.info('%s finished in %.3f seconds with exit code %s, %d bytes of output' %
+                         (kind, elapsed, return_code, output_bytes))
+
+
+class _Deadline:
+    '''Kills a command's process group if it is still running after
+    timeout seconds (never if timeout is None).'''
+
+    def __init__(self, proc, timeout):
+        self.proc = proc
+        self.expired = False
+        self._timer = None
+        if timeout is not None:
+            self._timer = threading.Timer(timeout, self._expire)
+            self._timer.setDaemon(True)
+            self._timer.start()
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def _expire(self):
+        if self.proc.poll() is not None:
+            return
+        self.expired = True
+        killCommand(self.proc)
+
+
+# the executor used by runCommand, runCommand2 and streamCommand
+commands = CommandExecutor()
 
 
 ################################################################################
@@ -56,29 +684,22 @@ def getCondorConfigVal(attr, daemon='', name='', default=None):
     '''Query Condor for a configuration value. Returns the value as a string or
     None if the value cannot be found. If the name of the attribute stars with
     CONDOR_ and cannot be found the command will also try to find the CYCLE_
-    equivalent of the configuration value (for backwards compatibility).'''
+    equivalent of the configuration value (for backwards compatibility).
+    Results are cached in configCache.'''
     
     cycle_attr = string.replace(attr.upper(), 'CONDOR_', 'CYCLE_', 1)
     
-    if daemon!='':
-        if name!='':
-            config_val_cmd = "condor_config_val -%s -name %s %s" %(daemon, name, attr)
-        else:
-            config_val_cmd = "condor_config_val -%s %s" %(daemon, attr)
-    else:
-        config_val_cmd = "condor_config_val %s" %(attr)
-    try:
-        (rc, o, e) = runCommand2(config_val_cmd)
-    except Exception, e:
-        logging.error('Unable to get value for configuration setting %s:' % (attr, str(e)))
-        return None
-    
-    if o.find('Not defined') > -1 or e.find('Not defined') > -1:
-        value = None
-    elif len(o) == 0:
-        value = None
-    else:
-        value = o.splitlines()[0]
+    (cached, value) = configCache.get((attr, daemon, name))
+    if not cached:
+        snapshot = configCache.getSnapshot(daemon, name)
+        if snapshot is not None:
+            value = snapshot.get(attr.upper())
+        # values with macros the dump did not expand are looked up on their own
+        if snapshot is None or (value and value.find('$(') > -1):
+            value = _runCondorConfigVal(attr, daemon, name)
+            if value is ERROR:
+                return None
+        configCache.put((attr, daemon, name), value)
         
     # If we didn't file the value, and the CONDOR_ -> CYCLE_ substitution happened,
     # try looking for the setting using the CYCLE_ prefix since this may be 
@@ -92,43 +713,414 @@ def getCondorConfigVal(attr, daemon='', name='', default=None):
     
     return value
 
-def runCommand(cmd, cwd=None):
-    """Run the command and return (stdout, stderr) data"""
-    logging.info('Executing cmd "%s" in "%s"'  % (cmd, cwd))
-    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
-    #logging.debug("Created subprocess %i" % proc.pid)
-    stdout_value, stderr_value = proc.communicate()
-    return (stdout_value, stderr_value)
+def _runCondorConfigVal(attr, daemon, name):
+    '''Looks up one setting with the backend in use (condor_config_val by
+    default). Returns the value, None if it is not defined, or ERROR if it
+    could not be looked up.'''
+    return backend.getBackend().configValue(attr, daemon, name)
+
+def dumpCondorConfig(daemon='', name='', source=None):
+    '''Returns (settings, files): a dictionary of every configuration setting
+    (by upper case name) from the backend source, or the one in use
+    (condor_config_val -dump -expand by default), and the configuration files
+    it lists. settings is None if the dump fails.'''
+    if source is None:
+        source = backend.getBackend()
+    return source.dumpConfig(daemon, name)
+
+def parseConfigDump(output):
+    '''Parses condor_config_val -dump output into (settings, files). Setting
+    names are upper cased since HTCondor does not care about case.'''
+    values = {}
+    files = []
+    in_files = False
+    for line in output.splitlines():
+        if line.startswith('#'):
+            # the header comments list the files the configuration came from:
+            # # Contributing configuration file(s):
+            # #	/etc/condor/condor_config
+            if line.find('configuration file') > -1:
+                in_files = True
+            elif in_files and line[1:2] in (' ', '\t') and line[1:].strip():
+                path = line[1:].strip()
+                files.append(path)
+                files.append(os.path.dirname(path))
+            else:
+                in_files = False
+            continue
+        split = line.split('=', 1)
+        if len(split) == 2 and split[0].strip():
+            values[split[0].strip().upper()] = split[1].strip()
+    return (values, files)
+
+def getCondorConfigFiles():
+    '''Returns the HTCondor configuration files in use, and the directories
+    they are in (so new files in LOCAL_CONFIG_DIR are noticed), as reported by
+    condor_config_val -config.'''
+    files = []
+    if os.environ.has_key('CONDOR_CONFIG'):
+        files.append(os.environ['CONDOR_CONFIG'])
+    try:
+        (rc, o, e) = runCommand2(['condor_config_val', '-config'])
+    except Exception, e:
+        logging.warning('Unable to list configuration files: %s' % str(e))
+        return files
+    for line in o.splitlines():
+        # the files are listed indented, under headings
+        if line[:1] in (' ', '\t') and line.strip():
+            path = line.strip()
+            files.append(path)
+            files.append(os.path.dirname(path))
+    return files
+
+def _statFiles(paths):
+    '''Returns a dictionary of path to mtime (None if it does not exist).'''
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.path.getmtime(path)
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+def parallelMap(function, items, workers):
+    '''Returns [function(item) for item in items], calling function for up
+    to workers of the items at once, each in a thread. If any of the calls
+    raise an exception the first one (in the order of items) is raised once
+    they have all finished.'''
+    if workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    remaining = range(len(items))
+    lock = threading.Lock()
+    def work():
+        while True:
+            lock.acquire()
+            try:
+                if not remaining:
+                    return
+                i = remaining.pop(0)
+            finally:
+                lock.release()
+            try:
+                results[i] = function(items[i])
+            except Exception, e:
+                errors[i] = e
+    threads = [threading.Thread(target=work) for i in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
+
+
+def parallelChain(generators, workers, readahead=16):
+    '''Generates the pieces of each of the generators in turn, as
+    itertools.chain does, while up to workers of them run at once, each in a
+    thread, keeping up to readahead pieces each that haven't been read yet.
+    The generators are started in order, so the one being read is always
+    running. An exception raised by a generator is raised when its pieces
+    have been read. If the caller stops reading, the workers are stopped and
+    the generators that haven't finished are closed in order before
+    returning.'''
+    if workers <= 1 or len(generators) <= 1:
+        for generator in generators:
+            for piece in generator:
+                yield piece
+        return
+    buffers = [_Pipe(readahead) for generator in generators]
+    stop = _startPipes(generators, buffers, workers)
+    try:
+        for pipe in buffers:
+            for piece in _readPipe(pipe):
+                yield piece
+    finally:
+        stop()
+
+
+def parallelSections(generators, workers, readahead=16):
+    '''Generates (i, piece) for the pieces of each generators[i]. Up to
+    workers of them run at once as in parallelChain, and the pieces of each
+    are generated together, but they are taken in the order they have
+    something to give rather than the order of generators, so one that is
+    slow to start doesn't hold up the others.'''
+    cond = threading.Condition()
+    buffers = [_Pipe(readahead, cond) for generator in generators]
+    stop = _startPipes(generators, buffers, max(workers, 1))
+    try:
+        remaining = range(len(generators))
+        while remaining:
+            cond.acquire()
+            try:
+                while True:
+                    ready = [i for i in remaining if buffers[i].items]
+                    if ready:
+                        break
+                    cond.wait()
+            finally:
+                cond.release()
+            i = ready[0]
+            remaining.remove(i)
+            for piece in _readPipe(buffers[i]):
+                yield (i, piece)
+    finally:
+        stop()
+
+
+def _startPipes(generators, buffers, workers):
+    '''Starts up to workers threads that run the generators in order, each
+    filling the matching buffer. Returns a function that stops them, waits
+    for them to return and closes the generators that haven't finished, in
+    order.'''
+    remaining = range(len(generators))
+    lock = threading.Lock()
+    def work():
+        while True:
+            lock.acquire()
+            try:
+                if not remaining:
+                    return
+                i = remaining.pop(0)
+            finally:
+                lock.release()
+            pipe = buffers[i]
+            try:
+                for piece in generators[i]:
+                    if not pipe.put((True, piece)):
+                        # the caller closes the generator
+                        return
+                pipe.finish((False, None))
+            except Exception, e:
+                pipe.finish((False, e))
+    threads = [threading.Thread(target=work) for i in range(min(workers, len(generators)))]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    def stop():
+        # there is nothing to do if all of it was read
+        lock.acquire()
+        try:
+            del remaining[:]
+        finally:
+            lock.release()
+        for pipe in buffers:
+            pipe.cancel()
+        for thread in threads:
+            thread.join()
+        for i in range(len(generators)):
+            if not buffers[i].done and hasattr(generators[i], 'close'):
+                generators[i].close()
+    return stop
+
+
+def _readPipe(pipe):
+    '''Generates the pieces put in a buffer by _startPipes, raising the
+    exception the generator raised if it failed.'''
+    while True:
+        is_piece, value = pipe.get()
+        if is_piece:
+            yield value
+        elif value is not None:
+            raise value
+        else:
+            return
+
+
+def quoteArgument(arg):
+    """Returns arg quoted for use in a command line run by runCommand or
+    streamCommand."""
+    if os.name == 'nt':
+        return subprocess.list2cmdline([arg])
+    return pipes.quote(arg)
+
+
+def runCommand(cmd, cwd=None, timeout=None):
+    """Run the command and return (stdout, stderr) data. cmd is an argv list,
+    or a string to be run by the shell. See CommandExecutor."""
+    return commands.run(cmd, cwd, timeout)[1:]
 
 
-def runCommand2(cmd, cwd=None):
+def runCommand2(cmd, cwd=None, timeout=None):
     """Similar to runCommand, but returns the returncode as well as stdout/err."""
-    logging.info('Executing cmd "%s" in "%s"' % (cmd, cwd))
-    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
-    #logging.debug("Created subprocess %i" % proc.pid)
-    stdout_value, stderr_value = proc.communicate()
-    return_code = proc.returncode
-    # Poll until the process finishes.
-    while (return_code is None):
-        time.sleep(1)
-        return_code = proc.returncode
-        
-    return (return_code, stdout_value, stderr_value)
+    return commands.run(cmd, cwd, timeout)
+
+
+def streamCommand(cmd, cwd=None, error_message=None, blocksize=STREAM_BLOCK_SIZE, timeout=None):
+    """Run the command and generate its stdout in pieces as it is written,
+    rather than returning all of it at once like runCommand. If
+    error_message is given and the command wrote to stderr, an Exception with
+    error_message % stderr is raised once stdout has been generated."""
+    return commands.stream(cmd, cwd, error_message, blocksize, timeout)
+
+
+def commandKind(cmd):
+    """Returns the name of the program a command runs, such as condor_q."""
+    if isinstance(cmd, basestring):
+        words = cmd.split()
+        if not words:
+            return ''
+        program = words[0]
+    else:
+        program = cmd[0]
+    name = os.path.basename(program)
+    if os.name == 'nt' and name.lower().endswith('.exe'):
+        name = name[:-4]
+    return name
+
+
+def commandText(cmd):
+    """Returns a command as it would be typed, for logging."""
+    if isinstance(cmd, basestring):
+        return cmd
+    return ' '.join([quoteArgument(arg) for arg in cmd])
+
+
+def _startCommand(cmd, cwd, stdout, stderr):
+    if os.name == 'nt':
+        return subprocess.Popen(cmd, shell=isinstance(cmd, basestring), stdout=stdout, stderr=stderr, cwd=cwd)
+    # the command gets a process group of its own so killCommand can kill
+    # anything it has started too
+    return subprocess.Popen(cmd, shell=isinstance(cmd, basestring), stdout=stdout, stderr=stderr, cwd=cwd,
+                            preexec_fn=os.setsid)
+
+
+def killCommand(proc):
+    """Kills a command started by CommandExecutor and its children."""
+    try:
+        if os.name == 'nt':
+            proc.kill()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError, e:
+        # it has already exited
+        logging.debug('Unable to kill process %d: %s' % (proc.pid, str(e)))
 
 
 def getHTTPHeaderTime(epoch_time):
     return time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(epoch_time))
 
 
-def gzipBuffer(buf):
+def gzipBuffer(buf, level=9):
     '''Returns a gzipped version of the input stream. Adds the necessary gzip
     headers to the base zlib compression.'''
     zbuf = StringIO.StringIO()
-    zfile = gzip.GzipFile(None, 'wb', 9, zbuf)
+    zfile = gzip.GzipFile(None, 'wb', level, zbuf)
     zfile.write(buf)
     zfile.close()
     return zbuf.getvalue()
 
+
+def negotiateEncoding(accept_encoding):
+    '''Returns the content encoding to use for a response ('gzip' or
+    'deflate') given the request's Accept-Encoding header, or None to send
+    it uncompressed. gzip is preferred when the client weights both the
+    same.'''
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        parts = item.split(';')
+        coding = parts[0].strip().lower()
+        q = 1.0
+        for param in parts[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if coding == 'x-gzip':
+            coding = 'gzip'
+        weights[coding] = q
+    best = None
+    best_q = 0.0
+    for coding in ('gzip', 'deflate'):
+        q = weights.get(coding, weights.get('*', 0.0))
+        if q > best_q:
+            best = coding
+            best_q = q
+    return best
+
+
+class StreamEncoder:
+    '''Compresses a response body a piece at a time for the gzip or deflate
+    content encodings, so a body can be compressed as it is generated.'''
+
+    def __init__(self, encoding, level=COMPRESSION_LEVEL):
+        if not ENCODINGS.has_key(encoding):
+            raise ValueError('Unsupported content encoding: %s' % encoding)
+        self.encoding = encoding
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+
+    def compress(self, data):
+        '''Returns the compressed output for data, which may be empty if
+        zlib is still buffering it.'''
+        return self.compressor.compress(data)
+
+    def flush(self):
+        '''Returns the rest of the compressed output, ending the stream.'''
+        return self.compressor.flush()
+
+
+def encodeBuffer(buf, encoding, level=COMPRESSION_LEVEL):
+    '''Returns buf compressed for the content encoding.'''
+    metrics.responseUncompressedBytes.inc((encoding,), len(buf))
+    encoder = StreamEncoder(encoding, level)
+    return encoder.compress(buf) + encoder.flush()
+
+
+def encodeStream(pieces, encoding, level=COMPRESSION_LEVEL):
+    '''Generates the compressed output for a body generated by pieces.'''
+    encoder = StreamEncoder(encoding, level)
+    for piece in pieces:
+        metrics.responseUncompressedBytes.inc((encoding,), len(piece))
+        data = encoder.compress(piece)
+        if data:
+            yield data
+    yield encoder.flush()
+
+def parseAttributeList(value):
+    '''Returns the list of ClassAd attribute names in value, separated by
+    commas, spaces or plus signs. Raises an Exception if one of them isn't
+    a valid attribute name.'''
+    attrs = []
+    for name in re.split('[,+\s]+', value.strip()):
+        if not name:
+            continue
+        if not ATTRIBUTE_NAME.match(name):
+            raise Exception("Invalid attribute name: %s" % name)
+        attrs.append(name)
+    return attrs
+
+
+def attributeSet(attrs):
+    '''Returns a dictionary for looking up the attribute names in attrs
+    without regard to case (ClassAd attribute names are case insensitive),
+    or None if attrs is None.'''
+    if attrs is None:
+        return None
+    result = {}
+    for name in attrs:
+        result[name.lower()] = True
+    return result
+
+
+def projectAdText(text, attrs):
+    '''Removes the attributes not in attrs (see attributeSet) from the
+    text of one or more ads, leaving any other lines as they are.'''
+    lines = []
+    for line in text.split('\n'):
+        split = line.split(' = ', 1)
+        if len(split) < 2 or attrs.has_key(split[0].strip().lower()):
+            lines.append(line)
+    return '\n'.join(lines)
+
+
 def processRequestArgs(raw_args):
     '''Return a dictionary of arguments. Where arguments match the
     k=v type style of arguments.'''
@@ -227,7 +1219,7 @@ def getCondorUsername():
     return username
 
 
-def readCondorHistory(file, date):
+def readCondorHistory(file, date, use_mmap=False):
     '''Reads the file backwards until it hits the first job
     whose date is on or before the given date. This is critical because
     the history file is not rotated under Windows while there are any jobs
@@ -263,54 +1255,352 @@ def readCondorHistory(file, date):
     really old (say, 15 minutes old). At this point, the schedd has
     written out everything it was going to, so we can stop processing
     all those invalid jobs. For now we just do extra work.
-    '''
-    ad = IncrementalAd()
-    part = ''
-    offset_re = re.compile("\*\*\* .+ CompletionDate = (\d+)")
-
-    for block in reversed_blocks(file):
-        for c in reversed(block):
-            if c == '\n' and part:
-                line = part[::-1].strip()
-                part = ''
-                if line.startswith("*** "):
-                    if ad.ad:
-                        if ad.should_output(date):
-                            yield ad
-                        else:
-                            return
-
-                    ad = IncrementalAd()
 
-                else:
-                    ad.include(line)
+    If use_mmap is set the file is memory-mapped and searched in place
+    instead of being read a block at a time (see readMappedHistory). Files
+    that cannot be mapped are read normally.
+    '''
+    if use_mmap:
+        mm = mapHistory(file)
+        if mm is not None:
+            try:
+                for ad in readMappedHistory(mm, date, forward=False):
+                    yield ad
+            finally:
+                mm.close()
+            return
+    for offset, text in reversed_ads(file):
+        if not text.strip():
+            continue
+        ad = IncrementalAd()
+        ad.include_text(text)
+        if ad.should_output(date):
+            yield ad
+        else:
+            return
 
-            part = part + c
 
-    if part:
-        line = part[::-1].strip()
-        ad.include(line)
+def readCondorHistoryForward(file, date, use_mmap=False, start=None, end=None, attrs=None):
+    '''Same as readCondorHistory but yields the ads in the order they appear
+    in the file (oldest first). The file is scanned backwards only to find
+    where the ads we need begin, then read forwards from that offset, so the
+    caller never has to hold the whole result to reverse it. If the offset
+    of the first ad is already known (see history_index and scanHistory) it
+    can be given as start and the backwards scan is skipped. If end is given
+    nothing at or past that offset is read, so ads written after the file was
+    scanned are left for the next request. If attrs (see attributeSet) is
+    given the ads only keep those attributes.'''
+    if use_mmap:
+        mm = mapHistory(file)
+        if mm is not None:
+            try:
+                for ad in readMappedHistory(mm, date, forward=True, start=start, end=end, attrs=attrs):
+                    yield ad
+            finally:
+                mm.close()
+            return
+    if start is None:
+        start = findHistoryStart(file, date)
+    for offset, text in forward_ads(file, start, end=end):
+        if not text.strip():
+            continue
+        ad = IncrementalAd(attrs)
+        ad.include_text(text)
         if ad.should_output(date):
             yield ad
 
 
-def reversed_blocks(file, blocksize=4096):
-    "Generate blocks of file's contents in reverse order."
+def findHistoryStart(file, date):
+    '''Returns the offset of the first ad readCondorHistory would return for
+    the given date, or the size of the file if there are none. Only the
+    CompletionDate of each ad is looked at while scanning.'''
+    return scanHistory(file, date)[0]
+
+
+def scanHistory(file, date, use_mmap=False):
+    '''Returns (start, end, max_completion) for the ads readCondorHistory
+    would return for the given date: the offset of the first of them, the
+    size of the file when it was scanned and the latest non-zero
+    CompletionDate among them (0 if there is none). This lets the caller
+    know the CompletionDate to resume from before it reads any of the ads.'''
+    if use_mmap:
+        mm = mapHistory(file)
+        if mm is not None:
+            try:
+                start = end = len(mm)
+                max_completion = 0
+                for ad_start, ad_end in mmap_reversed_ads(mm):
+                    completion_date = _mappedCompletionDate(mm, ad_start, ad_end)
+                    if not shouldOutputCompletionDate(completion_date, date):
+                        break
+                    start = ad_start
+                    max_completion = max(completion_date, max_completion)
+                return (start, end, max_completion)
+            finally:
+                mm.close()
+    file.seek(0, 2)
+    start = end = file.tell()
+    max_completion = 0
+    for offset, text in reversed_ads(file, end=end):
+        if not text.strip():
+            continue
+        completion_date = adCompletionDate(text)
+        if not shouldOutputCompletionDate(completion_date, date):
+            break
+        start = offset
+        max_completion = max(completion_date, max_completion)
+    return (start, end, max_completion)
+
+
+def adCompletionDate(text):
+    '''Returns the latest CompletionDate in the raw text of an ad (0 if it
+    has none) without parsing the rest of the ad.'''
+    dates = AD_COMPLETION_DATE.findall(text)
+    if not dates:
+        return 0
+    return int(dates[-1].strip())
+
+
+def shouldOutputCompletionDate(completion_time, date):
+    '''See readCondorHistory: jobs with a CompletionDate of 0 are always
+    returned.'''
+    return completion_time == 0 or completion_time > date
+
+
+def reversed_ads(file, blocksize=HISTORY_BLOCK_SIZE, end=None):
+    '''Generate (offset, text) for each ad in the file, last ad first. The
+    offset is where the body of the ad starts and the text is the body without
+    the "*** " banner line that ends it. Banners are found with rfind on whole
+    blocks rather than by walking the file a character at a time. If end is
+    given the file is treated as ending there.'''
     # Python 2.4 compatibility: use the numeric value for os.SEEK_*
     SEEK_SET = 0 # os.SEEK_SET
     SEEK_END = 2 # os.SEEK_END
-    file.seek(0, SEEK_END)
-    here = file.tell()
+    if end is None:
+        file.seek(0, SEEK_END)
+        here = file.tell()
+    else:
+        here = end
+    # text from here to the end of the ad we are working back through
+    pending = ''
     while 0 < here:
         delta = min(blocksize, here)
-        file.seek(here - delta, SEEK_SET)
-        yield file.read(delta)
         here -= delta
+        file.seek(here, SEEK_SET)
+        buf = file.read(delta) + pending
+        if here > 0:
+            # the first line may be incomplete, only look for banners after it
+            cut = buf.find('\n') + 1
+            if cut == 0:
+                pending = buf
+                continue
+        else:
+            cut = 0
+        ad_end = len(buf)
+        while ad_end > cut:
+            banner = _rfindBanner(buf, cut, ad_end, here == 0)
+            if banner == -1:
+                break
+            body = buf.find('\n', banner, ad_end)
+            if body == -1:
+                body = ad_end
+            else:
+                body += 1
+            yield (here + body, buf[body:ad_end])
+            ad_end = banner
+        pending = buf[:ad_end]
+    if pending:
+        yield (0, pending)
+
+
+def forward_ads(file, offset=0, blocksize=HISTORY_BLOCK_SIZE, end=None):
+    '''Generate (offset, text) for each ad in the file starting at offset,
+    which must be the start of an ad, through to the end of the file (or to
+    end, if given). This is the forward counterpart of reversed_ads. A
+    trailing ad with no banner yet (still being written) is returned as
+    well.'''
+    file.seek(offset, 0)
+    pending = ''
+    eof = False
+    while not eof:
+        if end is None:
+            block = file.read(blocksize)
+        else:
+            block = file.read(max(min(blocksize, end - offset - len(pending)), 0))
+        if not block:
+            eof = True
+        pending = pending + block
+        pos = 0
+        while True:
+            if pending.startswith('*** ', pos):
+                banner = pos
+            else:
+                banner = pending.find('\n*** ', pos)
+                if banner == -1:
+                    break
+                banner += 1
+            next = pending.find('\n', banner) + 1
+            if next == 0:
+                if not eof:
+                    break
+                # the last banner in the file may be missing its newline
+                next = len(pending)
+            yield (offset + pos, pending[pos:banner])
+            pos = next
+        pending = pending[pos:]
+        offset += pos
+    if pending.strip():
+        yield (offset, pending)
+
+
+def forward_complete_ads(file, offset=0):
+    '''Like forward_ads, but only generates the ads whose banner has been
+    written, as (offset, text, next) where next is the offset just past the
+    banner. The ad still being written at the end of the file, if any, is
+    left for the next call, which should start at the last next returned.'''
+    last = None
+    for ad in forward_ads(file, offset):
+        if last is not None:
+            yield (last[0], last[1], ad[0])
+        last = ad
+    if last is not None:
+        end = file.tell()
+        if last[0] + len(last[1]) < end:
+            # the banner is complete once its newline has been written
+            file.seek(end - 1, 0)
+            if file.read(1) == '\n':
+                yield (last[0], last[1], end)
+
+
+def mapHistory(file):
+    '''Returns a read-only memory map of the file, or None if the file is
+    empty or cannot be mapped (e.g. it is not a real file).'''
+    try:
+        fd = file.fileno()
+        if os.fstat(fd).st_size == 0:
+            return None
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except Exception, e:
+        logging.debug('Unable to map history file, reading it instead: %s' % str(e))
+        return None
+
+
+def readMappedHistory(mm, date, forward=True, start=None, end=None, attrs=None):
+    '''Generates the ads readCondorHistory (or readCondorHistoryForward if
+    forward is set) would return, from a memory map of the history file.
+    Banners and CompletionDates are found by searching the mapping in place,
+    so only the ads that are returned are ever copied out and parsed.'''
+    if forward:
+        if start is None:
+            start = len(mm)
+            for ad_start, ad_end in mmap_reversed_ads(mm):
+                if not shouldOutputCompletionDate(_mappedCompletionDate(mm, ad_start, ad_end), date):
+                    break
+                start = ad_start
+        spans = mmap_forward_ads(mm, start, end)
+    else:
+        spans = mmap_reversed_ads(mm)
+    for ad_start, ad_end in spans:
+        if not forward and not shouldOutputCompletionDate(_mappedCompletionDate(mm, ad_start, ad_end), date):
+            return
+        text = mm[ad_start:ad_end]
+        if not text.strip():
+            continue
+        ad = IncrementalAd(attrs)
+        ad.include_text(text)
+        if ad.should_output(date):
+            yield ad
+        elif not forward:
+            return
+
+
+def mmap_reversed_ads(mm):
+    '''Generate (start, end) for the body of each ad in the memory map, last
+    ad first. The mmap equivalent of reversed_ads.'''
+    ad_end = len(mm)
+    while ad_end > 0:
+        banner = mm.rfind('\n*** ', 0, ad_end)
+        if banner != -1:
+            banner += 1
+        elif mm[0:4] == '*** ':
+            banner = 0
+        else:
+            yield (0, ad_end)
+            return
+        body = mm.find('\n', banner, ad_end)
+        if body == -1:
+            body = ad_end
+        else:
+            body += 1
+        yield (body, ad_end)
+        ad_end = banner
+
+
+def mmap_forward_ads(mm, offset=0, end=None):
+    '''Generate (start, end) for the body of each ad in the memory map from
+    offset onwards, stopping at end if it is given. The mmap equivalent of
+    forward_ads.'''
+    size = len(mm)
+    if end is not None:
+        size = min(end, size)
+    pos = offset
+    while pos < size:
+        if mm[pos:pos + 4] == '*** ':
+            banner = pos
+        else:
+            banner = mm.find('\n*** ', pos, size)
+            if banner == -1:
+                break
+            banner += 1
+        next = mm.find('\n', banner, size) + 1
+        if next == 0:
+            next = size
+        yield (pos, banner)
+        pos = next
+    if pos < size:
+        yield (pos, size)
+
+
+def _mappedCompletionDate(mm, start, end):
+    '''Returns the latest CompletionDate in mm[start:end] (0 if there is
+    none) without copying the ad out of the map.'''
+    key = 'CompletionDate = '
+    i = mm.rfind('\n' + key, max(start - 1, 0), end)
+    if i != -1:
+        i += 1
+    elif mm[start:start + len(key)] == key:
+        i = start
+    else:
+        return 0
+    i += len(key)
+    j = mm.find('\n', i, end)
+    if j == -1:
+        j = end
+    value = mm[i:j].strip()
+    if not value:
+        # an unfinished line, do it the slow way
+        return adCompletionDate(mm[start:end])
+    return int(value)
+
+
+def _rfindBanner(buf, start, end, at_file_start):
+    '''Returns the index of the last "*** " banner line that starts in
+    buf[start:end], or -1. buf[start] must be the start of a line.'''
+    i = buf.rfind('\n*** ', max(start - 1, 0), end)
+    if i != -1:
+        return i + 1
+    if start == 0 and at_file_start and buf.startswith('*** '):
+        return 0
+    return -1
+
 
 def getCondorVersion():
-    output = subprocess.check_output("condor_version")
-    condorMatch = re.compile('\$CondorVersion: (?P<version>\d+\.\d+\.\d+) ')
-    condor_version = condorMatch.match(output).group('version')
+    # the configuration snapshot usually has it, which saves running condor_version
+    condor_version = getCondorConfigVal("CONDOR_VERSION")
+    if not condor_version or not re.match('^\d+\.\d+\.\d+$', condor_version):
+        output = backend.getBackend().versionText()
+        condorMatch = re.compile('\$CondorVersion: (?P<version>\d+\.\d+\.\d+) ')
+        condor_version = condorMatch.match(output).group('version')
 
     if not os.environ.has_key("CONDOR_VERSION"):
         os.environ["CONDOR_VERSION"] = condor_version
@@ -319,24 +1609,52 @@ def getCondorVersion():
 
 
 class IncrementalAd:
-    def __init__(self):
+    def __init__(self, attrs=None):
+        '''If attrs (see attributeSet) is given only those attributes are
+        kept.'''
         self.ad = {}
+        self.attrs = attrs
+        # the latest CompletionDate, kept even if it is not one of attrs
+        self.completionDate = None
 
     def include(self, line):
         # we put this in a dictionary in part because the condor history file
         # contains duplicates that are filtered out by processing it
         split = line.split(" = ", 1)
+        if len(split) < 2:
+            # not an attribute, e.g. the last line of an ad still being written
+            return
+        if split[0] == "CompletionDate" and self.completionDate is None:
+            self.completionDate = split[1]
+        if self.attrs is not None and not self.attrs.has_key(split[0].lower()):
+            return
         # note: we always want the latest version (there are duplicates in each job in a history file),
         # but we are reading the file backwards so we only keep the "first" found.
         if not split[0] in self.ad:
             self.ad[split[0]] = split[1]
 
+    def include_text(self, text):
+        '''Includes every line of the raw text of an ad, latest line first.'''
+        lines = text.split('\n')
+        lines.reverse()
+        for line in lines:
+            line = line.strip()
+            if line:
+                self.include(line)
+
+    def completion_date(self):
+        '''Returns the CompletionDate of the job, 0 if it has none.'''
+        return int(self.completionDate or 0)
+
     def should_output(self, date):
-        completion_time = int(self.ad.get("CompletionDate", 0))
+        completion_time = self.completion_date()
         return completion_time == 0 or completion_time > date
 
-    def get_text(self):
+    def get_text(self, attrs=None):
+        '''Returns the text of the ad, only the attributes in attrs (see
+        attributeSet) if it is given.'''
         result = []
         for k, v in self.ad.iteritems():
-            result.append(k + " = " + v)
+            if attrs is None or attrs.has_key(k.lower()):
+                result.append(k + " = " + v)
         return "\n".join(reversed(result)) + "\n"
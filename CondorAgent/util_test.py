@@ -1,4 +1,12 @@
 import StringIO
+import gzip
+import zlib
+import os
+import time
+import threading
+import tempfile
+import threading
+import backend
 import util
 
 
@@ -87,16 +95,489 @@ ProcId = 3
     ads = list(util.readCondorHistory(file, 9000))
     assert len(ads) == 4
 
-    
+
+def test_read_history_forward():
+    '''The forward reader returns the same ads as readCondorHistory, oldest first.'''
+    contents = '''CompletionDate = 0
+ProcId = 1
+*** Offset = -1 ClusterId = 1 ProcId = 1 Owner = "name" CompletionDate = 0
+CompletionDate = 10000
+ProcId = 2
+*** Offset = -1 ClusterId = 1 ProcId = 2 Owner = "name" CompletionDate = 10000
+CompletionDate = 20000
+ProcId = 3
+*** Offset = -1 ClusterId = 1 ProcId = 3 Owner = "name" CompletionDate = 20000
+CompletionDate = 0
+ProcId = 4
+*** Offset = -1 ClusterId = 1 ProcId = 4 Owner = "name" CompletionDate = 0
+'''
+
+    file = StringIO.StringIO(contents)
+    for date in (0, 9000, 10000, 17000, 20000):
+        backwards = [ad.ad for ad in util.readCondorHistory(file, date)]
+        forwards = [ad.ad for ad in util.readCondorHistoryForward(file, date)]
+        backwards.reverse()
+        assert backwards == forwards
+
+    ads = list(util.readCondorHistoryForward(file, 10000))
+    assert ["3", "4"] == [ad.ad["ProcId"] for ad in ads]
+    assert contents.index("CompletionDate = 20000") == util.findHistoryStart(file, 10000)
+
+
+def test_block_boundaries():
+    '''Ads and banners that straddle blocks are put back together.'''
+    contents = '''A = 1
+*** Offset = -1 ClusterId = 1 ProcId = 0 Owner = "name" CompletionDate = 0
+A = 2
+B = "two"
+*** Offset = -1 ClusterId = 1 ProcId = 1 Owner = "name" CompletionDate = 0
+A = 3'''
+
+    file = StringIO.StringIO(contents)
+    expected = [(0, "A = 1\n"),
+                (contents.index("A = 2"), 'A = 2\nB = "two"\n'),
+                (contents.index("A = 3"), "A = 3")]
+    for blocksize in (1, 2, 5, 64, 4096):
+        backwards = list(util.reversed_ads(file, blocksize))
+        backwards.reverse()
+        assert expected == backwards
+        assert expected == list(util.forward_ads(file, 0, blocksize))
+
+
+def test_scan_history():
+    '''scanHistory finds the span of the ads to read and their latest
+    CompletionDate, and ads appended after the scan are not read.'''
+    contents = '''ProcId = 1
+CompletionDate = 10000
+*** Offset = -1 ClusterId = 1 ProcId = 1 Owner = "name" CompletionDate = 10000
+ProcId = 2
+CompletionDate = 30000
+*** Offset = -1 ClusterId = 1 ProcId = 2 Owner = "name" CompletionDate = 30000
+ProcId = 3
+CompletionDate = 0
+*** Offset = -1 ClusterId = 1 ProcId = 3 Owner = "name" CompletionDate = 0
+ProcId = 4
+CompletionDate = 20000
+*** Offset = -1 ClusterId = 1 ProcId = 4 Owner = "name" CompletionDate = 20000
+'''
+    later = '''ProcId = 5
+CompletionDate = 40000
+*** Offset = -1 ClusterId = 1 ProcId = 5 Owner = "name" CompletionDate = 40000
+'''
+
+    (fd, path) = tempfile.mkstemp()
+    os.write(fd, contents)
+    os.close(fd)
+    file = open(path, "rb")
+    try:
+        for use_mmap in (False, True):
+            assert (contents.index("ProcId = 2"), len(contents), 30000) == util.scanHistory(file, 10000, use_mmap)
+            assert (len(contents), len(contents), 0) == util.scanHistory(file, 20000, use_mmap)
+        (start, end, max_completion) = util.scanHistory(file, 10000)
+        appended = open(path, "ab")
+        appended.write(later)
+        appended.close()
+        for use_mmap in (False, True):
+            ads = list(util.readCondorHistoryForward(file, 10000, use_mmap, start, end))
+            assert ["2", "3", "4"] == [ad.ad["ProcId"] for ad in ads]
+    finally:
+        file.close()
+        os.remove(path)
+
+
+def test_negotiate_encoding():
+    assert None == util.negotiateEncoding(None)
+    assert None == util.negotiateEncoding("identity")
+    assert "gzip" == util.negotiateEncoding("gzip, deflate")
+    assert "gzip" == util.negotiateEncoding("x-gzip")
+    assert "deflate" == util.negotiateEncoding("deflate")
+    assert "deflate" == util.negotiateEncoding("gzip;q=0.5, deflate")
+    assert "deflate" == util.negotiateEncoding("gzip;q=0, *")
+    assert None == util.negotiateEncoding("gzip;q=0")
+
+
+def test_stream_encoder():
+    data = "".join(['ClusterId = %d\nOwner = "user"\n\n' % i for i in range(1000)])
+    pieces = [data[i:i + 100] for i in range(0, len(data), 100)]
+    gzipped = "".join(util.encodeStream(pieces, "gzip", 1))
+    assert data == gzip.GzipFile(fileobj=StringIO.StringIO(gzipped)).read()
+    assert data == zlib.decompress(util.encodeBuffer(data, "deflate"))
+    assert data == zlib.decompress("".join(util.encodeStream(pieces, "deflate")))
+
+
+def test_single_flight():
+    started = []
+    def source():
+        started.append(1)
+        for piece in ("a", "b", "c"):
+            yield piece
+    flights = util.SingleFlight("test")
+    first = flights.stream("key", source)
+    assert "a" == first.next()
+    # a caller that joins late still gets everything from the start
+    second = flights.stream("key", source)
+    assert "abc" == "".join(second)
+    assert "bc" == "".join(first)
+    assert 1 == len(started)
+    assert {"started": 1, "coalesced": 1, "inflight": 0} == flights.stats()
+    # once it has finished the next caller starts again
+    assert "abc" == "".join(flights.stream("key", source))
+    assert 2 == len(started)
+
+
+def test_single_flight_memory():
+    def source():
+        for i in range(1000):
+            yield "%d " % i
+    flights = util.SingleFlight("test")
+    reader = flights.stream("key", source)
+    flight = flights._flights["key"]
+    for i in range(500):
+        reader.next()
+        # a single reader only holds the piece it was just given
+        assert len(flight.chunks) <= 1
+    # a second reader can't join once the start has been dropped
+    late = flights.stream("key", source)
+    assert flight is not flights._flights["key"]
+    assert "0 1 " == late.next() + late.next()
+    assert 1000 == len(list(reader)) + 500
+    assert 0 == len(flight.chunks)
+
+    # two readers only keep the pieces between them
+    flights = util.SingleFlight("test")
+    ahead = flights.stream("key", source)
+    behind = flights.stream("key", source)
+    flight = flights._flights["key"]
+    for i in range(100):
+        ahead.next()
+    behind.next()
+    assert 100 == len(flight.chunks)
+    for i in range(50):
+        behind.next()
+    assert 50 == len(flight.chunks)
+    # the pieces the reader behind hasn't read are kept for it alone
+    ahead.close()
+    behind.next()
+    assert 49 == len(flight.chunks)
+    for i in range(100):
+        behind.next()
+    assert len(flight.chunks) <= 1
+
+
+def test_single_flight_errors():
+    closed = []
+    def failing():
+        yield "a"
+        raise Exception("failed")
+    def endless():
+        try:
+            while True:
+                yield "x"
+        finally:
+            closed.append(1)
+    flights = util.SingleFlight("test")
+    callers = [flights.stream("fail", failing), flights.stream("fail", failing)]
+    for caller in callers:
+        assert "a" == caller.next()
+        try:
+            caller.next()
+            assert False
+        except Exception, e:
+            assert "failed" == str(e)
+    # the generator is stopped once every caller has given up on it
+    callers = [flights.stream("endless", endless), flights.stream("endless", endless)]
+    for caller in callers:
+        assert "x" == caller.next()
+    callers[0].close()
+    assert [] == closed
+    callers[1].close()
+    assert [1] == closed
+    assert 0 == flights.stats()["inflight"]
+
+
+def test_parallel_map():
+    def slow(i):
+        time.sleep(0.01 * (5 - i))
+        if i == 3:
+            raise Exception("failed %d" % i)
+        return i * 2
+    assert [0, 2, 4] == util.parallelMap(slow, range(3), 3)
+    assert [0, 2, 4] == util.parallelMap(slow, range(3), 1)
+    try:
+        util.parallelMap(slow, range(5), 2)
+        assert False
+    except Exception, e:
+        assert "failed 3" == str(e)
+
+
+def test_parallel_chain():
+    closed = []
+    def pieces(name, count, delay):
+        try:
+            for i in range(count):
+                time.sleep(delay)
+                yield "%s%d " % (name, i)
+        finally:
+            closed.append(name)
+    def failing():
+        yield "f0 "
+        raise Exception("failed")
+    # the later generators finish first, but the order is kept
+    generators = [pieces("a", 3, 0.02), pieces("b", 30, 0), pieces("c", 2, 0)]
+    assert "a0 a1 a2 " + "".join(["b%d " % i for i in range(30)]) + "c0 c1 " == \
+        "".join(util.parallelChain(generators, 2, readahead=4))
+    output = util.parallelChain([pieces("d", 2, 0), failing(), pieces("e", 1, 0)], 3)
+    assert ["d0 ", "d1 ", "f0 "] == [output.next() for i in range(3)]
+    try:
+        output.next()
+        assert False
+    except Exception, e:
+        assert "failed" == str(e)
+    # generators are stopped when the caller stops reading
+    class Pieces:
+        def __init__(self, name):
+            self.name = name
+            self.count = 0
+        def __iter__(self):
+            return self
+        def next(self):
+            self.count += 1
+            return "%s%d " % (self.name, self.count)
+        def close(self):
+            closed.append(self.name)
+    del closed[:]
+    generators = [Pieces("g"), Pieces("h"), Pieces("i")]
+    output = util.parallelChain(generators, 2, readahead=2)
+    assert "g1 " == output.next()
+    output.close()
+    # all of them are closed, in order, by the time close returns
+    assert ["g", "h", "i"] == closed
+    # the third was never started
+    assert 0 == generators[2].count
+
+
+def test_parallel_sections():
+    def pieces(name, count, delay):
+        time.sleep(delay)
+        for i in range(count):
+            yield "%s%d " % (name, i)
+    # the slow one doesn't hold up the others, and each is kept together
+    sections = list(util.parallelSections([pieces("a", 2, 0.2), pieces("b", 40, 0), pieces("c", 2, 0)], 3, readahead=4))
+    assert [1, 2, 0] == [i for i, piece in sections if piece[1:] == "0 "]
+    assert "".join(["b%d " % i for i in range(40)]) == "".join([piece for i, piece in sections if i == 1])
+    assert 44 == len(sections)
+
+
+def test_stream_command():
+    assert "one\ntwo\n" == "".join(util.streamCommand("echo one; echo two"))
+    try:
+        list(util.streamCommand("echo one; echo oops >&2", error_message="failed: %s"))
+        assert False
+    except Exception, e:
+        assert "failed: oops\n" == str(e)
+
+
+
+def test_command_executor():
+    executor = util.CommandExecutor(limit=1, timeout=10)
+    assert (3, "one\n", "oops\n") == executor.run(["sh", "-c", "echo one; echo oops >&2; exit 3"])
+    assert "a b\n" == "".join(executor.stream(["echo", "a b"]))
+    (rc, out, err) = executor.run(["no-such-command"])
+    assert 127 == rc
+    assert err.find("no-such-command") > -1
+
+    # the deadline kills the command and anything it has started
+    started = time.time()
+    (rc, out, err) = executor.run(["sh", "-c", "sleep 5 & echo started; wait"], timeout=0.5)
+    assert time.time() - started < 3
+    assert rc < 0
+    assert "started\n" == out
+    assert err.find("Killed sh after 0.5 seconds") > -1
+    try:
+        list(executor.stream(["sh", "-c", "echo started; sleep 5"], error_message="failed: %s", timeout=0.5))
+        assert False
+    except Exception, e:
+        assert str(e).startswith("failed: Killed sh")
+
+    # only one sleep runs at once
+    started = time.time()
+    threads = [threading.Thread(target=executor.run, args=(["sleep", "0.3"],)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.time() - started >= 0.6
+
+    stats = executor.stats()
+    assert {'calls': 3, 'failures': 3, 'timeouts': 2, 'running': 0, 'waiting': 0, 'bytes': 20} == \
+        dict([(key, value) for key, value in stats['sh'].items() if key != 'seconds'])
+    assert 2 == stats['sleep']['calls']
+    assert 0 == stats['sleep']['failures']
+    assert 1 == stats['no-such-command']['failures']
+
+
+def test_read_history_mmap():
+    '''The memory-mapped reader returns exactly what the block reader does.'''
+    contents = '''CompletionDate = 19000
+EnteredCurrentStatus = 19000
+*** Offset = -1 ClusterId = 1 ProcId = 2 Owner = "name" CompletionDate = 19000
+CompletionDate = 10000
+EnteredCurrentStatus = 10000
+*** Offset = -1 ClusterId = 1 ProcId = 2 Owner = "name" CompletionDate = 10000
+CompletionDate = 0
+EnteredCurrentStatus = 7000
+EnteredCurrentStatus = 8000
+*** Offset = -1 ClusterId = 1 ProcId = 1 Owner = "name" CompletionDate = 0
+CompletionDate = 20000
+EnteredCurrentStatus = 20000
+*** Offset = -1 ClusterId = 1 ProcId = 3 Owner = "name" CompletionDate = 20000
+'''
+
+    (fd, path) = tempfile.mkstemp()
+    os.write(fd, contents)
+    os.close(fd)
+    file = open(path, "rb")
+    try:
+        for date in (0, 9000, 17000, 20000):
+            expected = [ad.ad for ad in util.readCondorHistory(file, date)]
+            assert expected == [ad.ad for ad in util.readCondorHistory(file, date, use_mmap=True)]
+            expected.reverse()
+            assert expected == [ad.ad for ad in util.readCondorHistoryForward(file, date, use_mmap=True)]
+        ads = list(util.readCondorHistory(file, 17000, use_mmap=True))
+        assert 2 == len(ads)
+        assert "8000" == ads[1].ad["EnteredCurrentStatus"]
+    finally:
+        file.close()
+        os.remove(path)
+
+    # files that cannot be mapped are read normally
+    file = StringIO.StringIO(contents)
+    assert 4 == len(list(util.readCondorHistory(file, 0, use_mmap=True)))
+
+
+
+def test_config_cache():
+    cache = util.ConfigCache(ttl=60)
+    # don't go looking for the real configuration files
+    cache._configFiles = {}
+    key = ("HISTORY", "schedd", "name")
+    assert (False, None) == cache.get(key)
+    cache.put(key, "/var/lib/condor/spool/history")
+    assert (True, "/var/lib/condor/spool/history") == cache.get(key)
+    # settings that are not defined are cached as None
+    cache.put(("UNDEFINED", "", ""), None)
+    assert (True, None) == cache.get(("UNDEFINED", "", ""))
+    cache.invalidate()
+    cache._configFiles = {}
+    assert (False, None) == cache.get(key)
+
+    # expired entries are not returned
+    cache.put(key, "value")
+    cache.ttl = 0
+    assert (False, None) == cache.get(key)
+
+
+
+def test_parse_config_dump():
+    output = '''# Configuration from machine: schedd.example.com
+
+# Parameters with names that match :
+# Contributing configuration file(s):
+#	/etc/condor/condor_config
+#	/etc/condor/config.d/10-agent.config
+
+CONDOR_AGENT_PORT = 8008
+Condor_Agent_Submit_Dir = "/var/lib/condor/submit"
+HISTORY = /var/lib/condor/spool/history
+EMPTY = 
+'''
+    values, files = util.parseConfigDump(output)
+    assert "8008" == values["CONDOR_AGENT_PORT"]
+    assert '"/var/lib/condor/submit"' == values["CONDOR_AGENT_SUBMIT_DIR"]
+    assert "" == values["EMPTY"]
+    assert 4 == len(values)
+    assert "/etc/condor/condor_config" in files
+    assert "/etc/condor/config.d" in files
+
+
+def test_config_dumped_once_by_concurrent_callers():
+    cache = util.ConfigCache(ttl=60)
+    cache._configFiles = {}
+    dumps = []
+    def slowDump(daemon='', name='', source=None):
+        dumps.append((daemon, name))
+        time.sleep(0.1)
+        return ({'HISTORY': '/var/lib/condor/spool/history'}, [])
+    results = []
+    def lookup():
+        results.append(cache.getSnapshot()['HISTORY'])
+    # the backend is chosen before the dump, so don't look for one here
+    old = (util.dumpCondorConfig, backend.setBackend(backend.FakeBackend()))
+    util.dumpCondorConfig = slowDump
+    try:
+        threads = [threading.Thread(target=lookup) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        util.dumpCondorConfig = old[0]
+        backend.setBackend(old[1])
+    assert ['/var/lib/condor/spool/history'] * 8 == results
+    assert [('', '')] == dumps
+
+
+def test_attribute_projection():
+    assert ["ClusterId", "JobStatus", "Owner"] == util.parseAttributeList(" ClusterId, JobStatus+Owner")
+    try:
+        util.parseAttributeList("JobStatus;rm")
+        assert False
+    except Exception, e:
+        assert "JobStatus;rm" in str(e)
+
+    contents = '''ClusterId = 1
+ProcId = 0
+Owner = "name"
+CompletionDate = 100
+*** Offset = 0 ClusterId = 1 ProcId = 0 Owner = "name" CompletionDate = 100
+ClusterId = 1
+ProcId = 1
+JobStatus = 4
+Owner = "name"
+CompletionDate = 200
+*** Offset = 0 ClusterId = 1 ProcId = 1 Owner = "name" CompletionDate = 200
+'''
+    attrs = util.attributeSet(["procid", "Owner"])
+    for use_mmap in (False, True):
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, contents)
+            os.close(fd)
+            f = open(path, "rb")
+            try:
+                ads = list(util.readCondorHistoryForward(f, 100, use_mmap, attrs=attrs))
+            finally:
+                f.close()
+        finally:
+            os.remove(path)
+        # the CompletionDate is still used to pick the ads, but isn't kept
+        assert 1 == len(ads)
+        assert {"ProcId": "1", "Owner": '"name"'} == ads[0].ad
+        assert 200 == ads[0].completion_date()
+
+    ad = util.IncrementalAd()
+    ad.include_text('ClusterId = 1\nProcId = 0\nOwner = "name"\n')
+    assert 'ProcId = 0\nOwner = "name"\n' == ad.get_text(attrs)
+    assert 0 == ad.completion_date()
+    assert 'ProcId = 0\nOwner = "name"\n\n-- CompletedSince: 5\n' == \
+        util.projectAdText('ClusterId = 1\nProcId = 0\nOwner = "name"\n\n-- CompletedSince: 5\n', attrs)
+
+
 import sys
 
 if __name__ == "__main__":
-    files = list(util.readCondorHistory(file(sys.argv[1], "rb"), int(sys.argv[2])))
-    jobs = []
-    for ad in reversed(files):
-        jobs.append(ad.get_text())
-        
-    print "\n".join(jobs)
+    for ad in util.readCondorHistoryForward(file(sys.argv[1], "rb"), int(sys.argv[2])):
+        print ad.get_text()
 
 
 
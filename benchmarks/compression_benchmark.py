@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+# python benchmarks/compression_benchmark.py [jobs] [condor_q output file]
+#
+# Compares the time taken and the size of the result when compressing a jobs
+# response at each zlib level, for the gzip and deflate encodings, both in one
+# call and a piece at a time as a streamed response is. Uses synthetic
+# condor_q -long output unless a file of real output is given.
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import CondorAgent.util
+
+
+################################################################################
+# GLOBALS
+################################################################################
+# the size of the pieces a streamed response is compressed in
+PIECE_SIZE = 64 * 1024
+
+
+################################################################################
+# METHODS
+################################################################################
+def makeQueue(jobs):
+    '''Returns text like condor_q -long output for the given number of jobs:
+    a mix of attributes that are the same for every job, the same for a
+    cluster, and different for every job.'''
+    random.seed(jobs)
+    ads = []
+    cluster = 100
+    proc = 0
+    submitted = 1400000000
+    for i in range(jobs):
+        if random.random() < 0.05:
+            cluster += 1
+            proc = 0
+            submitted += random.randint(1, 3600)
+        owner = 'user%d' % (cluster % 17)
+        status = random.choice([1, 1, 1, 2, 2, 5])
+        lines = ['MyType = "Job"',
+                 'TargetType = "Machine"',
+                 'ClusterId = %d' % cluster,
+                 'ProcId = %d' % proc,
+                 'GlobalJobId = "submit.example.com#%d.%d#%d"' % (cluster, proc, submitted),
+                 'Owner = "%s"' % owner,
+                 'User = "%s@example.com"' % owner,
+                 'AccountingGroup = "group_%s.%s"' % (random.choice(['physics', 'chem', 'bio']), owner),
+                 'QDate = %d' % submitted,
+                 'EnteredCurrentStatus = %d' % (submitted + random.randint(0, 86400)),
+                 'JobStatus = %d' % status,
+                 'JobPrio = 0',
+                 'JobUniverse = 5',
+                 'Cmd = "/home/%s/bin/simulate"' % owner,
+                 'Args = "--seed %d --input data/part-%05d.dat"' % (random.randint(0, 1 << 30), proc),
+                 'Iwd = "/home/%s/runs/%d"' % (owner, cluster),
+                 'Out = "out.%d.%d"' % (cluster, proc),
+                 'Err = "err.%d.%d"' % (cluster, proc),
+                 'UserLog = "/home/%s/runs/%d/log"' % (owner, cluster),
+                 'RequestCpus = 1',
+                 'RequestMemory = %d' % random.choice([1024, 2048, 4096]),
+                 'RequestDisk = %d' % random.randint(100000, 1000000),
+                 'ImageSize = %d' % random.randint(1000, 5000000),
+                 'DiskUsage = %d' % random.randint(1, 1000000),
+                 'RemoteUserCpu = %d.0' % random.randint(0, 100000),
+                 'RemoteWallClockTime = %d.0' % random.randint(0, 100000),
+                 'NumJobStarts = %d' % random.randint(0, 3),
+                 'Requirements = ( TARGET.Arch == "X86_64" ) && ( TARGET.OpSys == "LINUX" ) && ( TARGET.Disk >= RequestDisk ) && ( TARGET.Memory >= RequestMemory ) && ( TARGET.HasFileTransfer )',
+                 'Rank = 0.0',
+                 'ShouldTransferFiles = "YES"',
+                 'WhenToTransferOutput = "ON_EXIT"',
+                 'TransferInput = "data/part-%05d.dat,bin/simulate"' % proc,
+                 'LeaveJobInQueue = false',
+                 'OnExitRemove = true',
+                 'PeriodicHold = false',
+                 'PeriodicRelease = false',
+                 'PeriodicRemove = false',
+                 'Environment = ""',
+                 'JobNotification = 0',
+                 'CondorVersion = "$CondorVersion: 8.6.8 Oct 31 2017 $"',
+                 'CondorPlatform = "$CondorPlatform: X86_64-CentOS_7.4 $"']
+        if status == 2:
+            lines.append('RemoteHost = "slot1_%d@node%03d.example.com"' % (random.randint(1, 32), random.randint(1, 400)))
+            lines.append('JobCurrentStartDate = %d' % (submitted + random.randint(0, 86400)))
+        ads.append('\n'.join(lines) + '\n\n')
+        proc += 1
+    return ''.join(ads)
+
+
+def timeEncoding(data, encoding, level, streamed):
+    start = time.time()
+    if streamed:
+        pieces = [data[i:i + PIECE_SIZE] for i in range(0, len(data), PIECE_SIZE)]
+        size = 0
+        for output in CondorAgent.util.encodeStream(pieces, encoding, level):
+            size += len(output)
+    else:
+        size = len(CondorAgent.util.encodeBuffer(data, encoding, level))
+    return (max(time.time() - start, 1e-9), size)
+
+
+def main():
+    jobs = 10000
+    if len(sys.argv) > 1:
+        jobs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        fp = open(sys.argv[2], 'rb')
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
+        print 'condor_q output: %s, %.1f MB' % (sys.argv[2], len(data) / (1024.0 * 1024))
+    else:
+        data = makeQueue(jobs)
+        print 'Synthetic condor_q output: %d jobs, %.1f MB' % (jobs, len(data) / (1024.0 * 1024))
+
+    start = time.time()
+    legacy = len(CondorAgent.util.gzipBuffer(data))
+    legacy_time = time.time() - start
+    print '%-24s %8.3f s %10.1f MB/s %10d bytes %6.1f%%' % ('gzipBuffer (level 9)', legacy_time,
+        len(data) / legacy_time / (1024 * 1024), legacy, 100.0 * legacy / len(data))
+    for encoding in ('gzip', 'deflate'):
+        for streamed in (False, True):
+            for level in range(1, 10):
+                elapsed, size = timeEncoding(data, encoding, level, streamed)
+                name = '%s level %d%s' % (encoding, level, streamed and ' streamed' or '')
+                print '%-24s %8.3f s %10.1f MB/s %10d bytes %6.1f%%' % (name, elapsed,
+                    len(data) / elapsed / (1024 * 1024), size, 100.0 * size / len(data))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+# python benchmarks/corpus.py history|queue output_file [options]
+#
+# Writes a synthetic history file (as the schedd writes them) or condor_q
+# -long output, for benchmarks and load tests. The same options always give
+# the same file. Run with --help for the options.
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import sys
+import random
+import optparse
+
+
+################################################################################
+# GLOBALS
+################################################################################
+# the default shape of a corpus
+DEFAULT_JOBS = 5000
+DEFAULT_ATTRIBUTES = 40
+# the fraction of attributes that appear twice in an ad, first with an older
+# value, as the schedd writes them when a job's ad is updated
+DEFAULT_DUPLICATE_RATE = 0.1
+# the fraction of history ads with CompletionDate = 0, as removed jobs have
+DEFAULT_ZERO_COMPLETION = 0.05
+
+# the CompletionDate of the first job in a history file; one job completes
+# each second after it
+FIRST_COMPLETION = 1000000000
+
+
+################################################################################
+# CLASSES
+################################################################################
+class Corpus:
+    '''The shape of a synthetic set of job ads.'''
+
+    def __init__(self, jobs=DEFAULT_JOBS, attributes=DEFAULT_ATTRIBUTES,
+                 duplicate_rate=DEFAULT_DUPLICATE_RATE, zero_completion=DEFAULT_ZERO_COMPLETION, seed=0):
+        self.jobs = jobs
+        self.attributes = attributes
+        self.duplicateRate = duplicate_rate
+        self.zeroCompletion = zero_completion
+        self.seed = seed
+
+    def parameters(self):
+        '''Returns the shape as a dictionary, to record with results.'''
+        return {'jobs': self.jobs, 'attributes': self.attributes, 'duplicate_rate': self.duplicateRate,
+                'zero_completion': self.zeroCompletion, 'seed': self.seed}
+
+    def historyAds(self):
+        '''Generates the text of each history ad, oldest first, ending with
+        its *** banner line.'''
+        rand = random.Random(self.seed)
+        for i in range(self.jobs):
+            completion = FIRST_COMPLETION + i
+            if rand.random() < self.zeroCompletion:
+                completion = 0
+            cluster = 100 + i / 10
+            lines = ['ClusterId = %d' % cluster,
+                     'ProcId = %d' % (i % 10),
+                     'Owner = "user%d"' % (cluster % 17),
+                     'JobStatus = %d' % (completion and 4 or 3)]
+            lines.extend(self._attributes(rand, i))
+            lines.append('EnteredCurrentStatus = %d' % (completion or FIRST_COMPLETION + i))
+            lines.append('CompletionDate = %d' % completion)
+            lines.append('*** Offset = 0 ClusterId = %d ProcId = %d Owner = "user%d" CompletionDate = %d' %
+                         (cluster, i % 10, cluster % 17, completion))
+            yield '\n'.join(lines) + '\n'
+
+    def queueAds(self):
+        '''Generates the text of each job in the queue, as condor_q -long
+        prints them (followed by a blank line).'''
+        rand = random.Random(self.seed)
+        for i in range(self.jobs):
+            cluster = 100 + i / 10
+            lines = ['ClusterId = %d' % cluster,
+                     'ProcId = %d' % (i % 10),
+                     'Owner = "user%d"' % (cluster % 17),
+                     'JobStatus = %d' % rand.choice([1, 1, 1, 2, 2, 5])]
+            lines.extend(self._attributes(rand, i))
+            yield '\n'.join(lines) + '\n\n'
+
+    def writeHistory(self, fp):
+        for ad in self.historyAds():
+            fp.write(ad)
+
+    def writeQueue(self, fp):
+        for ad in self.queueAds():
+            fp.write(ad)
+
+    def _attributes(self, rand, i):
+        lines = []
+        for a in range(self.attributes):
+            if rand.random() < self.duplicateRate:
+                lines.append('Attribute%d = "old value of attribute %d for job %d"' % (a, a, i))
+            lines.append('Attribute%d = "value of attribute %d for job %d"' % (a, a, i))
+        return lines
+
+
+################################################################################
+# METHODS
+################################################################################
+def addOptions(parser):
+    '''Adds the options that shape a corpus to an optparse parser.'''
+    parser.add_option('--jobs', type='int', default=DEFAULT_JOBS,
+                      help='number of jobs (default %d)' % DEFAULT_JOBS)
+    parser.add_option('--attributes', type='int', default=DEFAULT_ATTRIBUTES,
+                      help='attributes per ad besides the usual few (default %d)' % DEFAULT_ATTRIBUTES)
+    parser.add_option('--duplicate-rate', type='float', default=DEFAULT_DUPLICATE_RATE,
+                      help='fraction of attributes written twice (default %s)' % DEFAULT_DUPLICATE_RATE)
+    parser.add_option('--zero-completion', type='float', default=DEFAULT_ZERO_COMPLETION,
+                      help='fraction of history ads with CompletionDate = 0 (default %s)' % DEFAULT_ZERO_COMPLETION)
+    parser.add_option('--seed', type='int', default=0, help='random seed (default 0)')
+
+
+def fromOptions(options):
+    return Corpus(options.jobs, options.attributes, options.duplicate_rate, options.zero_completion, options.seed)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog history|queue output_file [options]')
+    addOptions(parser)
+    (options, args) = parser.parse_args()
+    if len(args) != 2 or args[0] not in ('history', 'queue'):
+        parser.error('give history or queue and an output file')
+    corpus = fromOptions(options)
+    fp = open(args[1], 'wb')
+    try:
+        if args[0] == 'history':
+            corpus.writeHistory(fp)
+        else:
+            corpus.writeQueue(fp)
+    finally:
+        fp.close()
+
+
+if __name__ == '__main__':
+    main()
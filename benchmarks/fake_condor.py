@@ -0,0 +1,489 @@
+#!/usr/bin/env python
+
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+# python benchmarks/fake_condor.py install directory [options]
+#
+# Installs stand-ins for condor_q, condor_history, condor_status,
+# condor_submit, condor_config_val and condor_version in directory/bin, with
+# a synthetic queue and history for each schedd (see corpus.py), so the agent
+# can be run and load tested without HTCondor:
+#
+#   python benchmarks/fake_condor.py install /tmp/fake --schedds s1,s2 --latency 0.05
+#   PATH=/tmp/fake/bin:$PATH CONDOR_BIN_PATH=/tmp/fake/bin CONDOR_CONFIG=/tmp/fake/condor_config \
+#       python condor_agent.py
+#
+# The agent adds CONDOR_BIN_PATH to the end of PATH, so the fake directory
+# goes at the front of PATH as well in case HTCondor is installed.
+#
+# The commands wait --latency seconds (give or take --jitter) and fail with
+# --failure-rate. Submitted jobs join the queue of their schedd as idle jobs.
+# Run with --help for the other options. The commands themselves run as
+#
+#   python benchmarks/fake_condor.py --home directory <command> [arguments]
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import os
+import re
+import sys
+import time
+import random
+import socket
+import optparse
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import corpus
+import CondorAgent.util
+import CondorAgent.classad_expr
+
+
+################################################################################
+# GLOBALS
+################################################################################
+COMMANDS = ('condor_q', 'condor_history', 'condor_status', 'condor_submit',
+            'condor_config_val', 'condor_version')
+
+# the commands that are slowed down and made to fail; condor_config_val and
+# condor_version always answer at once, as the agent can't start without them
+SIMULATED_COMMANDS = ('condor_q', 'condor_history', 'condor_status', 'condor_submit')
+
+VERSION = '8.8.1'
+
+# the first cluster given to submitted jobs
+FIRST_SUBMITTED_CLUSTER = 100000
+
+
+################################################################################
+# CLASSES
+################################################################################
+class Toolchain:
+    '''An installed set of fake commands: their settings, and the queue and
+    history files of each schedd.'''
+
+    def __init__(self, home):
+        self.home = os.path.abspath(home)
+        fp = open(os.path.join(self.home, 'fake_condor.json'))
+        try:
+            self.settings = json.load(fp)
+        finally:
+            fp.close()
+        # the names come back from JSON as unicode
+        self.schedds = [str(name) for name in self.settings['schedds']]
+
+    def queueFiles(self, schedd):
+        '''The files of the schedd's queue: the jobs it started with and the
+        jobs submitted since.'''
+        return [os.path.join(self.home, 'queue', schedd),
+                os.path.join(self.home, 'queue', schedd + '.submitted')]
+
+    def historyFile(self, schedd):
+        return os.path.join(self.home, 'spool', schedd, 'history')
+
+    def config(self, schedd=None):
+        '''Returns the configuration as a dictionary, as the schedd sees it if
+        one is given.'''
+        if schedd is None:
+            schedd = self.schedds[0]
+        values = {'LOG': os.path.join(self.home, 'log'),
+                  'FULL_HOSTNAME': socket.getfqdn(),
+                  'HISTORY': self.historyFile(schedd),
+                  'CONDOR_VERSION': VERSION,
+                  'CONDOR_AGENT_PORT': str(self.settings['port']),
+                  'CONDOR_AGENT_SUBMIT_DIR': os.path.join(self.home, 'submit'),
+                  'SCHEDD_NAME': schedd}
+        for key, value in self.settings['config'].items():
+            values[key.upper()] = value
+        return values
+
+    def simulate(self, command):
+        '''Waits as long as a command takes, and fails it sometimes.'''
+        if command not in SIMULATED_COMMANDS:
+            return
+        delay = self.settings['latency'] + random.uniform(-1, 1) * self.settings['jitter']
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < self.settings['failure_rate']:
+            fail('Error: simulated failure of %s' % command)
+
+    def schedd(self, name):
+        if name is None:
+            return self.schedds[0]
+        # -name may be given as name@host
+        if name not in self.schedds and name.split('@')[0] in self.schedds:
+            name = name.split('@')[0]
+        if name not in self.schedds:
+            fail('Error: Can\'t find address for schedd %s' % name)
+        return name
+
+
+################################################################################
+# METHODS
+################################################################################
+def fail(message):
+    sys.stderr.write(message + '\n')
+    sys.exit(1)
+
+
+def parseArguments(args, with_values, formats=False):
+    '''Returns the options (a dictionary of option to a list of its values;
+    flags have None for a value) and the other arguments. with_values lists
+    the options that take a value. If formats is set -f and -format take a
+    format and an attribute, as they do for condor_q and condor_status.'''
+    options = {}
+    rest = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith('-') and len(arg) > 1:
+            if formats and arg in ('-f', '-format'):
+                # a format and an attribute
+                options.setdefault('-format', []).append((args[i + 1], args[i + 2]))
+                i += 3
+                continue
+            if arg in with_values:
+                options.setdefault(arg, []).append(args[i + 1])
+                i += 2
+                continue
+            options.setdefault(arg, []).append(None)
+        else:
+            rest.append(arg)
+        i += 1
+    return (options, rest)
+
+
+def readAds(paths):
+    '''Generates the text of each ad in files of ads separated by blank
+    lines.'''
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        fp = open(path)
+        try:
+            text = fp.read()
+        finally:
+            fp.close()
+        for ad in text.split('\n\n'):
+            if ad.strip():
+                yield ad.strip('\n') + '\n'
+
+
+def adDict(text):
+    ad = {}
+    for line in text.splitlines():
+        split = line.split(' = ', 1)
+        if len(split) == 2:
+            ad[split[0]] = split[1]
+    return ad
+
+
+def jobFilters(jobs, constraint):
+    filters = []
+    if jobs:
+        filters.append(CondorAgent.classad_expr.jobsExpression(' '.join(jobs)))
+    if constraint:
+        filters.append(CondorAgent.classad_expr.parse(constraint))
+    return filters
+
+
+def printFormatted(ad, formats):
+    '''Prints the attributes of the ad with -format, which takes a printf
+    format and an attribute.'''
+    for format, attribute in formats:
+        value = ad.get(attribute)
+        if value is None:
+            # the name is matched without regard to case
+            for name in ad.keys():
+                if name.lower() == attribute.lower():
+                    value = ad[name]
+        if value is None:
+            continue
+        format = format.replace('\\n', '\n').replace('\\t', '\t')
+        if format.find('%d') > -1:
+            value = int(float(value))
+        elif value.startswith('"'):
+            value = value[1:-1]
+        sys.stdout.write(format % value)
+
+
+def condor_q(toolchain, args):
+    options, jobs = parseArguments(args, ('-name', '-attributes', '-constraint', '-c', '-pool'), True)
+    schedd = toolchain.schedd((options.get('-name') or [None])[0])
+    constraint = (options.get('-constraint') or options.get('-c') or [None])[0]
+    filters = jobFilters(jobs, constraint)
+    attrs = None
+    if options.has_key('-attributes'):
+        attrs = CondorAgent.util.attributeSet(CondorAgent.util.parseAttributeList(options['-attributes'][0]))
+    out = sys.stdout
+    for text in readAds(toolchain.queueFiles(schedd)):
+        if filters:
+            ad = adDict(text)
+            if [f for f in filters if not f.matches(ad)]:
+                continue
+        if options.has_key('-format'):
+            printFormatted(adDict(text), options['-format'])
+        elif attrs is not None:
+            out.write(CondorAgent.util.projectAdText(text, attrs) + '\n')
+        else:
+            out.write(text + '\n')
+
+
+def condor_history(toolchain, args):
+    options, jobs = parseArguments(args, ('-f', '-file', '-constraint', '-name', '-match'))
+    history_file = (options.get('-f') or options.get('-file') or [None])[0]
+    if not history_file:
+        fail('Error: no history file given')
+    filters = jobFilters(jobs, (options.get('-constraint') or [None])[0])
+    fp = open(history_file, 'rb')
+    try:
+        # newest first, as condor_history lists them
+        for ad in CondorAgent.util.readCondorHistory(fp, -1):
+            if [f for f in filters if not f.matches(ad.ad)]:
+                continue
+            sys.stdout.write(ad.get_text() + '\n')
+    finally:
+        fp.close()
+
+
+def condor_status(toolchain, args):
+    options, names = parseArguments(args, ('-constraint', '-pool', '-attributes'), True)
+    # every schedd is on this host, which is how the agent finds them
+    host = socket.getfqdn()
+    filters = jobFilters(None, (options.get('-constraint') or [None])[0])
+    schedds = [schedd for schedd in toolchain.schedds
+               if not [f for f in filters if not f.matches({'Name': '"%s"' % schedd, 'Machine': '"%s"' % host})]]
+    if options.has_key('-format'):
+        for schedd in schedds:
+            printFormatted({'Name': '"%s"' % schedd}, options['-format'])
+        return
+    for name in names or schedds:
+        schedd = toolchain.schedd(name)
+        counts = {}
+        for text in readAds(toolchain.queueFiles(schedd)):
+            status = adDict(text).get('JobStatus')
+            counts[status] = counts.get(status, 0) + 1
+        sys.stdout.write('MyType = "Scheduler"\n'
+                         'Name = "%s"\n'
+                         'Machine = "%s"\n'
+                         'CondorVersion = "$CondorVersion: %s Jan 01 2020 $"\n'
+                         'TotalIdleJobs = %d\n'
+                         'TotalRunningJobs = %d\n'
+                         'TotalHeldJobs = %d\n\n' % (schedd, host, VERSION,
+                                                     counts.get('1', 0), counts.get('2', 0), counts.get('5', 0)))
+
+
+def condor_submit(toolchain, args):
+    options, files = parseArguments(args, ('-name', '-remote', '-pool', '-append', '-a'))
+    schedd = toolchain.schedd((options.get('-name') or [None])[0])
+    if not files:
+        fail('ERROR: no submit file given')
+    fp = open(files[-1])
+    try:
+        description = fp.read()
+    finally:
+        fp.close()
+    count = 0
+    for match in re.finditer(r'(?im)^\s*queue\s*(\d*)', description):
+        count += int(match.group(1) or 1)
+    if count == 0:
+        fail('ERROR: the submit file has no queue statement')
+    # clusters are numbered across all the schedds, one process at a time
+    counter = open(os.path.join(toolchain.home, 'queue', 'next_cluster'), 'a+')
+    try:
+        if fcntl:
+            fcntl.flock(counter.fileno(), fcntl.LOCK_EX)
+        counter.seek(0)
+        cluster = int(counter.read().strip() or FIRST_SUBMITTED_CLUSTER)
+        counter.seek(0)
+        counter.truncate()
+        counter.write('%d\n' % (cluster + 1))
+        counter.flush()
+        queue = open(toolchain.queueFiles(schedd)[1], 'a')
+        try:
+            for proc in range(count):
+                queue.write('ClusterId = %d\nProcId = %d\nOwner = "%s"\nJobStatus = 1\nQDate = %d\n\n' %
+                            (cluster, proc, os.environ.get('USER', 'condor'), time.time()))
+        finally:
+            queue.close()
+    finally:
+        counter.close()
+    sys.stdout.write('Submitting job(s)%s\n%d job(s) submitted to cluster %d.\n' % ('.' * count, count, cluster))
+
+
+def condor_config_val(toolchain, args):
+    options, names = parseArguments(args, ('-name',))
+    if options.has_key('-config'):
+        sys.stdout.write('Configuration source:\n\t%s\n' % os.path.join(toolchain.home, 'condor_config'))
+        return
+    schedd = None
+    if options.has_key('-name'):
+        schedd = toolchain.schedd(options['-name'][0])
+    config = toolchain.config(schedd)
+    if options.has_key('-dump'):
+        sys.stdout.write('# Configuration from machine: %s\n\n' % socket.getfqdn())
+        sys.stdout.write('# Contributing configuration file(s):\n#\t%s\n\n' % os.path.join(toolchain.home, 'condor_config'))
+        keys = config.keys()
+        keys.sort()
+        for key in keys:
+            sys.stdout.write('%s = %s\n' % (key, config[key]))
+        return
+    if not names:
+        fail('Usage: condor_config_val [options] variable')
+    for name in names:
+        if not config.has_key(name.upper()):
+            fail('Not defined: %s' % name)
+        sys.stdout.write(config[name.upper()] + '\n')
+
+
+def condor_version(toolchain, args):
+    sys.stdout.write('$CondorVersion: %s Jan 01 2020 BuildID: fake $\n'
+                     '$CondorPlatform: X86_64-Fake $\n' % VERSION)
+
+
+def install(home, shape, schedds, options):
+    '''Writes the settings, queues, history files and commands of a fake
+    HTCondor to home.'''
+    home = os.path.abspath(home)
+    for directory in ('bin', 'queue', 'log', 'submit'):
+        path = os.path.join(home, directory)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    config = {}
+    for setting in options.config:
+        key, value = setting.split('=', 1)
+        config[key.strip()] = value.strip()
+    settings = {'schedds': schedds,
+                'port': options.port,
+                'latency': options.latency,
+                'jitter': options.jitter,
+                'failure_rate': options.failure_rate,
+                'corpus': shape.parameters(),
+                'config': config}
+    fp = open(os.path.join(home, 'fake_condor.json'), 'w')
+    try:
+        json.dump(settings, fp, indent=2, sort_keys=True)
+    finally:
+        fp.close()
+    open(os.path.join(home, 'condor_config'), 'w').close()
+    toolchain = Toolchain(home)
+
+    for i in range(len(schedds)):
+        # each schedd has different jobs
+        schedd_shape = corpus.Corpus(shape.jobs, shape.attributes, shape.duplicateRate, shape.zeroCompletion, shape.seed + i)
+        queue_file, submitted_file = toolchain.queueFiles(schedds[i])
+        fp = open(queue_file, 'w')
+        try:
+            schedd_shape.writeQueue(fp)
+        finally:
+            fp.close()
+        if os.path.exists(submitted_file):
+            os.remove(submitted_file)
+        writeHistory(toolchain.historyFile(schedds[i]), schedd_shape, options.history_files)
+
+    script = os.path.abspath(__file__)
+    if script.endswith('.pyc'):
+        script = script[:-1]
+    for command in COMMANDS:
+        path = os.path.join(home, 'bin', command)
+        fp = open(path, 'w')
+        try:
+            fp.write('#!/bin/sh\nexec "%s" "%s" --home "%s" %s "$@"\n' % (sys.executable, script, home, command))
+        finally:
+            fp.close()
+        os.chmod(path, 0755)
+    return toolchain
+
+
+def writeHistory(history_file, shape, files):
+    '''Writes the ads of the corpus to the history file, and the oldest of
+    them to files - 1 rotated files named for when they were rotated.'''
+    directory = os.path.dirname(history_file)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    ads = list(shape.historyAds())
+    per_file = max(1, (len(ads) + files - 1) / files)
+    parts = [ads[i:i + per_file] for i in range(0, len(ads), per_file)] or [[]]
+    rotated = time.time() - len(parts)
+    for i in range(len(parts)):
+        if i == len(parts) - 1:
+            path = history_file
+        else:
+            path = '%s.%s' % (history_file, time.strftime('%Y%m%dT%H%M%S', time.localtime(rotated + i)))
+        fp = open(path, 'wb')
+        try:
+            fp.write(''.join(parts[i]))
+        finally:
+            fp.close()
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) >= 3 and args[0] == '--home' and args[2] in COMMANDS:
+        toolchain = Toolchain(args[1])
+        command = args[2]
+        toolchain.simulate(command)
+        try:
+            globals()[command](toolchain, args[3:])
+        except CondorAgent.classad_expr.UnsupportedExpression, e:
+            fail('Error: %s' % e)
+        return
+
+    parser = optparse.OptionParser(usage='%prog install directory [options]')
+    corpus.addOptions(parser)
+    parser.add_option('--schedds', default='schedd1', help='names of the schedds (default schedd1)')
+    parser.add_option('--history-files', type='int', default=1,
+                      help='number of files to split each history into (default 1)')
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='seconds each command takes (default 0)')
+    parser.add_option('--jitter', type='float', default=0.0,
+                      help='most seconds the latency varies by either way (default 0)')
+    parser.add_option('--failure-rate', type='float', default=0.0,
+                      help='fraction of commands that fail (default 0)')
+    parser.add_option('--port', type='int', default=8008, help='the agent\'s port (default 8008)')
+    parser.add_option('--config', action='append', default=[],
+                      help='another configuration setting, as NAME=VALUE (repeatable)')
+    (options, args) = parser.parse_args()
+    if len(args) != 2 or args[0] != 'install':
+        parser.error('give install and a directory')
+    schedds = [name for name in re.split('[,\s]+', options.schedds) if name]
+    toolchain = install(args[1], corpus.fromOptions(options), schedds, options)
+    bin_dir = os.path.join(toolchain.home, 'bin')
+    print 'Installed fake HTCondor commands for %s in %s. Run the agent with' % (', '.join(schedds), bin_dir)
+    print '  PATH=%s:$PATH CONDOR_BIN_PATH=%s CONDOR_CONFIG=%s python condor_agent.py' % \
+        (bin_dir, bin_dir, os.path.join(toolchain.home, 'condor_config'))
+
+
+if __name__ == '__main__':
+    main()
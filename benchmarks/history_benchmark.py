@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+# 
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+# python benchmarks/history_benchmark.py [jobs] [completedSince]
+#
+# Measures history read throughput of CondorAgent.util.readCondorHistory
+# against the character-at-a-time reader it replaced, on a synthetic history
+# file.
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import CondorAgent.util
+
+
+################################################################################
+# GLOBALS
+################################################################################
+ATTRIBUTES_PER_AD = 80
+
+
+################################################################################
+# METHODS
+################################################################################
+def legacyReversedBlocks(file, blocksize=4096):
+    '''Generates blocks of the file's contents in reverse order, for the
+    legacy reader.'''
+    file.seek(0, 2)
+    here = file.tell()
+    while 0 < here:
+        delta = min(blocksize, here)
+        file.seek(here - delta, 0)
+        yield file.read(delta)
+        here -= delta
+
+
+def legacyReadCondorHistory(file, date):
+    '''The reader used up to 1.27, kept here for comparison.'''
+    ad = CondorAgent.util.IncrementalAd()
+    part = ''
+    for block in legacyReversedBlocks(file):
+        for c in reversed(block):
+            if c == '\n' and part:
+                line = part[::-1].strip()
+                part = ''
+                if line.startswith("*** "):
+                    if ad.ad:
+                        if ad.should_output(date):
+                            yield ad
+                        else:
+                            return
+                    ad = CondorAgent.util.IncrementalAd()
+                else:
+                    ad.include(line)
+            part = part + c
+    if part:
+        line = part[::-1].strip()
+        ad.include(line)
+        if ad.should_output(date):
+            yield ad
+
+
+def mappedReader(file, date):
+    return CondorAgent.util.readCondorHistoryForward(file, date, use_mmap=True)
+
+
+def writeHistory(fp, jobs):
+    '''Writes a history file with the given number of jobs, one completing
+    every second.'''
+    for i in range(jobs):
+        completion = 1000000000 + i
+        for a in range(ATTRIBUTES_PER_AD):
+            fp.write('Attribute%d = "value of attribute %d for job %d"\n' % (a, a, i))
+        fp.write('EnteredCurrentStatus = %d\n' % (completion - 1))
+        fp.write('EnteredCurrentStatus = %d\n' % completion)
+        fp.write('CompletionDate = %d\n' % completion)
+        fp.write('*** Offset = %d ClusterId = %d ProcId = 0 Owner = "user" CompletionDate = %d\n' % (fp.tell(), i, completion))
+
+
+def timeReader(name, reader, path, date, size):
+    fp = open(path, 'rb')
+    try:
+        start = time.time()
+        count = 0
+        for ad in reader(fp, date):
+            ad.get_text()
+            count += 1
+        elapsed = max(time.time() - start, 1e-9)
+    finally:
+        fp.close()
+    print '%-32s %8d ads %8.3f s %10.1f MB/s' % (name, count, elapsed, size / elapsed / (1024 * 1024))
+    return elapsed
+
+
+def main():
+    jobs = 5000
+    if len(sys.argv) > 1:
+        jobs = int(sys.argv[1])
+    date = 0
+    if len(sys.argv) > 2:
+        date = int(sys.argv[2])
+    
+    (fd, path) = tempfile.mkstemp(prefix='history')
+    fp = os.fdopen(fd, 'wb')
+    try:
+        writeHistory(fp, jobs)
+    finally:
+        fp.close()
+    try:
+        size = os.path.getsize(path)
+        print 'History file: %d jobs, %.1f MB, completedSince = %d' % (jobs, size / (1024.0 * 1024), date)
+        legacy = timeReader('legacy readCondorHistory', legacyReadCondorHistory, path, date, size)
+        current = timeReader('readCondorHistory', CondorAgent.util.readCondorHistory, path, date, size)
+        timeReader('readCondorHistoryForward', CondorAgent.util.readCondorHistoryForward, path, date, size)
+        timeReader('readCondorHistoryForward mmap', mappedReader, path, date, size)
+        print 'Speedup: %.1fx' % (legacy / current)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
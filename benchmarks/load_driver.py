@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+# python benchmarks/load_driver.py [--fake directory | --url url --pid pid] [options]
+#
+# Sends a mix of jobs, history, multi-schedd (named, and all those on the
+# agent's host) and submit requests to an agent
+# from --concurrency connections at once for --duration seconds, and reports
+# the throughput, the 50th and 99th percentile latency of each kind of
+# request, and the agent's peak resident memory.
+#
+# With --fake the agent is started for the run with the fake HTCondor
+# installed in that directory by fake_condor.py, and stopped at the end:
+#
+#   python benchmarks/fake_condor.py install /tmp/fake --schedds s1,s2,s3 --latency 0.05 --failure-rate 0.01
+#   python benchmarks/load_driver.py --fake /tmp/fake --concurrency 16 --duration 60
+#
+# Otherwise the requests go to the agent at --url, and --pid gives its process
+# for the memory figure (Linux only). --json writes the results as JSON.
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import os
+import sys
+import time
+import random
+import signal
+import socket
+import httplib
+import urlparse
+import zipfile
+import optparse
+import threading
+import subprocess
+import StringIO
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import corpus
+import fake_condor
+
+
+################################################################################
+# GLOBALS
+################################################################################
+AGENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'condor_agent.py')
+
+# the kinds of request, and the default share of each
+KINDS = ('jobs', 'history', 'fanout', 'local', 'submit')
+DEFAULT_MIX = 'jobs=50,history=30,fanout=5,local=5,submit=10'
+
+# seconds to wait for an agent started with --fake to listen, and to exit
+START_TIMEOUT = 30
+STOP_TIMEOUT = 10
+
+SUBMIT_FILE = '''universe = vanilla
+executable = /bin/true
+output = out.$(Process)
+queue 2
+'''
+
+
+################################################################################
+# CLASSES
+################################################################################
+class Load:
+    '''The requests to send, and what happened to them.'''
+
+    def __init__(self, url, mix, schedds, completed_since, gzip):
+        parts = urlparse.urlparse(url)
+        self.host = parts[1]
+        self.mix = mix
+        self.schedds = schedds
+        # (first, last) CompletionDate to poll history from
+        self.completedSince = completed_since
+        self.headers = {}
+        if gzip:
+            self.headers['Accept-Encoding'] = 'gzip'
+        self.submission = makeSubmission()
+        # (kind, seconds, status or None if the request failed, bytes) for
+        # each request
+        self.results = []
+        self._lock = threading.Lock()
+
+    def choose(self):
+        '''Returns the kind, method, path and body of a random request.'''
+        pick = random.uniform(0, sum([weight for kind, weight in self.mix]))
+        for kind, weight in self.mix:
+            pick -= weight
+            if pick <= 0:
+                break
+        schedd = random.choice(self.schedds)
+        if kind == 'jobs':
+            return (kind, 'GET', '/condor/schedd/%s/jobs?history=false' % schedd, None)
+        if kind == 'history':
+            since = random.randint(self.completedSince[0], self.completedSince[1])
+            return (kind, 'GET', '/condor/schedd/%s/jobs?completedSince=%d' % (schedd, since), None)
+        if kind == 'fanout':
+            return (kind, 'GET', '/condor/schedds/jobs?schedds=%s&history=false' % ','.join(self.schedds), None)
+        if kind == 'local':
+            # the schedds on the agent's host, found with FULL_HOSTNAME
+            return (kind, 'GET', '/condor/schedds/jobs?history=false', None)
+        return (kind, 'POST', '/condor/submit?queue=%s' % schedd, self.submission)
+
+    def work(self, deadline):
+        '''Sends requests on one connection until the deadline.'''
+        connection = None
+        while time.time() < deadline:
+            kind, method, path, body = self.choose()
+            headers = dict(self.headers)
+            if body is not None:
+                headers['Content-type'] = 'application/zip'
+            started = time.time()
+            try:
+                if connection is None:
+                    connection = httplib.HTTPConnection(self.host)
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                size = len(response.read())
+                status = response.status
+                if response.getheader('connection', '').lower() == 'close':
+                    connection.close()
+                    connection = None
+            except Exception, e:
+                # counted as an error, like any status but 200
+                status = None
+                size = 0
+                if connection is not None:
+                    connection.close()
+                    connection = None
+            self.record(kind, time.time() - started, status, size)
+        if connection is not None:
+            connection.close()
+
+    def record(self, kind, seconds, status, size):
+        self._lock.acquire()
+        try:
+            self.results.append((kind, seconds, status, size))
+        finally:
+            self._lock.release()
+
+    def run(self, concurrency, duration):
+        '''Sends requests from concurrency threads for duration seconds, and
+        returns the seconds it took.'''
+        started = time.time()
+        deadline = started + duration
+        threads = []
+        for i in range(concurrency):
+            thread = threading.Thread(target=self.work, args=(deadline,), name='Load-%d' % i)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return time.time() - started
+
+    def summary(self, elapsed):
+        '''Returns the results of each kind of request, and of all of them.'''
+        summary = {}
+        for kind in KINDS + ('all',):
+            results = [result for result in self.results if kind == 'all' or result[0] == kind]
+            if not results:
+                continue
+            latencies = [result[1] for result in results]
+            latencies.sort()
+            summary[kind] = {'requests': len(results),
+                             'errors': len([result for result in results if result[2] != 200]),
+                             'throughput': len(results) / elapsed,
+                             'p50': percentile(latencies, 0.5),
+                             'p99': percentile(latencies, 0.99),
+                             'max': latencies[-1],
+                             'bytes': sum([result[3] for result in results])}
+        return summary
+
+
+################################################################################
+# METHODS
+################################################################################
+def makeSubmission():
+    '''Returns a zip file of a submit file, as the submission proxy takes.'''
+    buf = StringIO.StringIO()
+    archive = zipfile.ZipFile(buf, 'w')
+    archive.writestr('job.sub', SUBMIT_FILE)
+    archive.close()
+    return buf.getvalue()
+
+
+def percentile(values, fraction):
+    '''Returns the value below which the fraction of the sorted values
+    fall.'''
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def parseMix(text):
+    mix = []
+    for part in text.split(','):
+        kind, weight = part.split('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError('Unknown kind of request %s, use %s' % (kind, ', '.join(KINDS)))
+        if float(weight) > 0:
+            mix.append((kind, float(weight)))
+    if not mix:
+        raise ValueError('No requests in the mix')
+    return mix
+
+
+def peakRSS(pid):
+    '''Returns the peak resident memory of the process in bytes, or None if
+    it can't be read (it comes from /proc, so only on Linux).'''
+    try:
+        fp = open('/proc/%d/status' % pid)
+    except IOError:
+        return None
+    try:
+        for line in fp:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    finally:
+        fp.close()
+    return None
+
+
+def startAgent(toolchain):
+    '''Starts the agent with the fake HTCondor, and returns its process once
+    it is listening.'''
+    bin_dir = os.path.join(toolchain.home, 'bin')
+    env = dict(os.environ)
+    env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+    env['CONDOR_BIN_PATH'] = bin_dir
+    env['CONDOR_CONFIG'] = os.path.join(toolchain.home, 'condor_config')
+    output = open(os.path.join(toolchain.home, 'log', 'agent.out'), 'w')
+    agent = subprocess.Popen([sys.executable, os.path.abspath(AGENT)], cwd=toolchain.home, env=env,
+                             stdout=output, stderr=subprocess.STDOUT)
+    output.close()
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        if agent.poll() is not None:
+            raise Exception('The agent exited with %d, see %s' % (agent.returncode, output.name))
+        try:
+            socket.create_connection(('localhost', toolchain.settings['port']), 1).close()
+            return agent
+        except socket.error:
+            time.sleep(0.2)
+    stopAgent(agent)
+    raise Exception('The agent did not start listening on port %d' % toolchain.settings['port'])
+
+
+def stopAgent(agent):
+    if agent.poll() is not None:
+        return
+    os.kill(agent.pid, signal.SIGTERM)
+    deadline = time.time() + STOP_TIMEOUT
+    while agent.poll() is None and time.time() < deadline:
+        time.sleep(0.1)
+    if agent.poll() is None:
+        os.kill(agent.pid, signal.SIGKILL)
+        agent.wait()
+
+
+def printSummary(summary, elapsed, rss):
+    print '%-8s %9s %7s %10s %9s %9s %9s %10s' % ('request', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms', 'max ms', 'MB')
+    for kind in KINDS + ('all',):
+        if not summary.has_key(kind):
+            continue
+        result = summary[kind]
+        print '%-8s %9d %7d %10.1f %9.1f %9.1f %9.1f %10.1f' % (kind, result['requests'], result['errors'],
+            result['throughput'], result['p50'] * 1000, result['p99'] * 1000, result['max'] * 1000,
+            result['bytes'] / (1024.0 * 1024))
+    print 'Ran for %.1f seconds.' % elapsed,
+    if rss is None:
+        print 'The agent\'s peak memory is unknown.'
+    else:
+        print 'The agent\'s peak resident memory was %.1f MB.' % (rss / (1024.0 * 1024))
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [--fake directory | --url url --pid pid] [options]')
+    parser.add_option('--fake', help='start the agent with the fake HTCondor installed in this directory')
+    parser.add_option('--url', default='http://localhost:8008', help='the agent to load (default %default)')
+    parser.add_option('--pid', type='int', help='the process ID of the agent at --url, for its memory use')
+    parser.add_option('--schedds', help='the schedds to ask for (default: those of --fake, or schedd1)')
+    parser.add_option('--concurrency', type='int', default=8, help='connections at once (default %default)')
+    parser.add_option('--duration', type='float', default=30, help='seconds to run for (default %default)')
+    parser.add_option('--mix', default=DEFAULT_MIX, help='share of each kind of request (default %default)')
+    parser.add_option('--completed-since', help='first:last completedSince of history requests '
+                      '(default: the last tenth of the history of --fake, or 0:0)')
+    parser.add_option('--gzip', action='store_true', default=False, help='ask for gzipped responses')
+    parser.add_option('--json', help='write the results as JSON to this file')
+    (options, args) = parser.parse_args()
+    try:
+        mix = parseMix(options.mix)
+    except ValueError, e:
+        parser.error(str(e))
+
+    toolchain = None
+    agent = None
+    url = options.url
+    pid = options.pid
+    schedds = ['schedd1']
+    completed_since = (0, 0)
+    if options.fake:
+        toolchain = fake_condor.Toolchain(options.fake)
+        url = 'http://localhost:%d' % toolchain.settings['port']
+        schedds = toolchain.schedds
+        jobs = toolchain.settings['corpus']['jobs']
+        completed_since = (corpus.FIRST_COMPLETION + jobs * 9 / 10, corpus.FIRST_COMPLETION + jobs)
+    if options.schedds:
+        schedds = options.schedds.split(',')
+    if options.completed_since:
+        first, last = options.completed_since.split(':')
+        completed_since = (int(first), int(last))
+
+    if toolchain:
+        agent = startAgent(toolchain)
+        pid = agent.pid
+    try:
+        load = Load(url, mix, schedds, completed_since, options.gzip)
+        print 'Sending %s to %s for %d seconds from %d connections...' % \
+            (', '.join(['%s %g%%' % (kind, weight * 100 / sum([w for k, w in mix])) for kind, weight in mix]),
+             url, options.duration, options.concurrency)
+        elapsed = load.run(options.concurrency, options.duration)
+        rss = None
+        if pid:
+            rss = peakRSS(pid)
+    finally:
+        if agent:
+            stopAgent(agent)
+    summary = load.summary(elapsed)
+    printSummary(summary, elapsed, rss)
+
+    if options.json:
+        results = {'url': url,
+                   'concurrency': options.concurrency,
+                   'duration': elapsed,
+                   'mix': dict(mix),
+                   'schedds': schedds,
+                   'peak_rss': rss,
+                   'requests': summary}
+        if toolchain:
+            results['fake_condor'] = toolchain.settings
+        fp = open(options.json, 'w')
+        try:
+            fp.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+        finally:
+            fp.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+###### COPYRIGHT NOTICE ########################################################
+#
+# Copyright (C) 2007-2014, Cycle Computing, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You may
+# obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+################################################################################
+# USAGE
+################################################################################
+# python benchmarks/microbenchmarks.py [--json results.json] [--baseline old.json] [options]
+#
+# Times the agent's hot paths (reading history files, building and printing
+# ads, compression, request argument parsing and URL dispatch) on a synthetic
+# corpus (see corpus.py). Prints a table, and with --json writes the results
+# as JSON ('-' for standard output). With --baseline the results are compared
+# to an earlier --json file and the exit status is 1 if any benchmark is more
+# than --threshold slower, e.g.
+#
+#   git stash; python benchmarks/microbenchmarks.py --json /tmp/before.json; git stash pop
+#   python benchmarks/microbenchmarks.py --baseline /tmp/before.json
+#
+# Run with --help for the corpus options.
+
+
+################################################################################
+# IMPORTS
+################################################################################
+import os
+import sys
+import time
+import logging
+import optparse
+import platform
+import tempfile
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import corpus
+import condor_agent
+import CondorAgent.util
+import CondorAgent.schedd
+
+
+################################################################################
+# GLOBALS
+################################################################################
+# the version of the JSON written, changed if a change to the benchmarks makes
+# earlier results incomparable
+RESULTS_FORMAT = 1
+
+# the default number of times each benchmark is timed, and the least time
+# each timing takes (the benchmark is called as many times as that needs)
+DEFAULT_REPEAT = 5
+DEFAULT_MIN_TIME = 0.2
+
+# how much slower than the baseline a benchmark can be before it counts as a
+# regression
+DEFAULT_THRESHOLD = 0.2
+
+# the number of ads the IncrementalAd benchmarks use
+AD_SAMPLE = 1000
+
+# typical request arguments and paths
+REQUEST_ARGS = ['',
+                '/',
+                '?completedSince=1361298177',
+                '?completedSince=1361298177&history=false&stream=true',
+                '/?jobs=%221.0%202.1%203%22&attrs=ClusterId,ProcId,JobStatus,Owner',
+                '?constraint=JobStatus%20%3D%3D%202%20%26%26%20Owner%20%3D%3D%20%22alice%22&format=json',
+                '?syncToken=3f1c2a&completedSince=1361298177&schedds=s1,s2,s3']
+REQUEST_PATHS = ['/condor/schedd/schedd1/jobs?completedSince=1361298177',
+                 '/condor/schedd/schedd1/jobs/?syncToken=3f1c2a',
+                 '/condor/schedd/schedd1/',
+                 '/condor/schedd/schedd1?attrs=TotalRunningJobs',
+                 '/condor/schedds/jobs?schedds=s1,s2',
+                 '/condor/submit?queue=schedd1',
+                 '/metrics',
+                 '/favicon.ico']
+
+
+################################################################################
+# CLASSES
+################################################################################
+class Benchmarks:
+    '''The benchmarks, on one corpus. Each bench_ method sets up and returns
+    a function to time, and the number of units (ads, bytes and so on) of
+    work the function does, and their name.'''
+
+    def __init__(self, shape, directory):
+        self.corpus = shape
+        self.historyFile = os.path.join(directory, 'history')
+        fp = open(self.historyFile, 'wb')
+        try:
+            shape.writeHistory(fp)
+        finally:
+            fp.close()
+        self.queueText = ''.join(shape.queueAds())
+        # about half of the history
+        self.completedSince = corpus.FIRST_COMPLETION + self.corpus.jobs / 2
+
+    def names(self):
+        names = [name[len('bench_'):] for name in dir(self) if name.startswith('bench_')]
+        names.sort()
+        return names
+
+    def setUp(self, name):
+        return getattr(self, 'bench_' + name)()
+
+    def bench_readCondorHistory(self):
+        return (lambda: self._read(CondorAgent.util.readCondorHistory, 0), self.corpus.jobs, 'ads')
+
+    def bench_readCondorHistory_completedSince(self):
+        count = self._read(CondorAgent.util.readCondorHistory, self.completedSince)
+        return (lambda: self._read(CondorAgent.util.readCondorHistory, self.completedSince), count, 'ads')
+
+    def bench_readCondorHistoryForward(self):
+        return (lambda: self._read(CondorAgent.util.readCondorHistoryForward, 0), self.corpus.jobs, 'ads')
+
+    def bench_IncrementalAd_include(self):
+        # the lines of each ad, latest first, as the history readers give them
+        ads = []
+        for text in self._sampleAds():
+            lines = [line for line in text.split('\n') if line and not line.startswith('*** ')]
+            lines.reverse()
+            ads.append(lines)
+        def include():
+            for lines in ads:
+                ad = CondorAgent.util.IncrementalAd()
+                for line in lines:
+                    ad.include(line)
+        return (include, len(ads), 'ads')
+
+    def bench_IncrementalAd_get_text(self):
+        ads = self._parsedAds()
+        def getText():
+            for ad in ads:
+                ad.get_text()
+        return (getText, len(ads), 'ads')
+
+    def bench_IncrementalAd_get_text_attrs(self):
+        ads = self._parsedAds()
+        attrs = CondorAgent.util.attributeSet(['ClusterId', 'ProcId', 'JobStatus', 'Owner'])
+        def getText():
+            for ad in ads:
+                ad.get_text(attrs)
+        return (getText, len(ads), 'ads')
+
+    def bench_getHistoryFromFile(self):
+        query = CondorAgent.schedd.ScheddQuery('schedd1')
+        return (lambda: query.getHistoryFromFile(0, self.historyFile), self.corpus.jobs, 'ads')
+
+    def bench_getHistoryFromFile_completedSince(self):
+        query = CondorAgent.schedd.ScheddQuery('schedd1')
+        count = self._read(CondorAgent.util.readCondorHistoryForward, self.completedSince)
+        return (lambda: query.getHistoryFromFile(self.completedSince, self.historyFile), count, 'ads')
+
+    def bench_gzipBuffer(self):
+        return (lambda: CondorAgent.util.gzipBuffer(self.queueText), len(self.queueText), 'bytes')
+
+    def bench_encodeBuffer_gzip(self):
+        return (lambda: CondorAgent.util.encodeBuffer(self.queueText, 'gzip'), len(self.queueText), 'bytes')
+
+    def bench_processRequestArgs(self):
+        def process():
+            for args in REQUEST_ARGS:
+                CondorAgent.util.processRequestArgs(args)
+        return (process, len(REQUEST_ARGS), 'requests')
+
+    def bench_matchURL(self):
+        def dispatch():
+            for path in REQUEST_PATHS:
+                condor_agent.matchURL(path)
+        return (dispatch, len(REQUEST_PATHS), 'requests')
+
+    def _read(self, reader, date):
+        fp = open(self.historyFile, 'rb')
+        try:
+            count = 0
+            for ad in reader(fp, date):
+                count += 1
+            return count
+        finally:
+            fp.close()
+
+    def _sampleAds(self):
+        ads = []
+        for text in self.corpus.historyAds():
+            ads.append(text)
+            if len(ads) == AD_SAMPLE:
+                break
+        return ads
+
+    def _parsedAds(self):
+        ads = []
+        for text in self._sampleAds():
+            ad = CondorAgent.util.IncrementalAd()
+            ad.include_text(text.split('\n*** ')[0])
+            ads.append(ad)
+        return ads
+
+
+################################################################################
+# METHODS
+################################################################################
+def timeBenchmark(function, repeat, min_time):
+    '''Returns the number of calls in each timing and the seconds per call of
+    each timing.'''
+    # one call to warm up and see how many are needed to take min_time
+    start = time.time()
+    function()
+    once = max(time.time() - start, 1e-6)
+    calls = max(1, int(min_time / once))
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        for j in xrange(calls):
+            function()
+        timings.append((time.time() - start) / calls)
+    return (calls, timings)
+
+
+def runBenchmarks(benchmarks, names, repeat, min_time):
+    results = {}
+    for name in names:
+        function, units, unit = benchmarks.setUp(name)
+        calls, timings = timeBenchmark(function, repeat, min_time)
+        timings.sort()
+        results[name] = {'best': timings[0],
+                         'median': timings[len(timings) / 2],
+                         'calls': calls,
+                         'repeat': repeat,
+                         'units': units,
+                         'unit': unit}
+        printResult(name, results[name])
+    return results
+
+
+def printResult(name, result):
+    rate = result['units'] / result['best']
+    if result['unit'] == 'bytes':
+        rate = '%10.1f MB/s' % (rate / (1024 * 1024))
+    else:
+        rate = '%10.0f %s/s' % (rate, result['unit'])
+    print '%-40s %12.6f s %12.6f s %s' % (name, result['best'], result['median'], rate)
+
+
+def compare(baseline, results, threshold):
+    '''Prints each benchmark's change from the baseline, and returns the
+    names of those more than threshold slower.'''
+    if baseline.get('format') != RESULTS_FORMAT:
+        print 'The baseline is in a different format, so it can\'t be compared'
+        return []
+    if baseline.get('corpus') != results['corpus']:
+        print 'Warning: the baseline was run on a different corpus: %s' % baseline.get('corpus')
+    regressions = []
+    print
+    print '%-40s %12s %12s %8s' % ('compared to baseline', 'baseline', 'now', 'change')
+    names = results['benchmarks'].keys()
+    names.sort()
+    for name in names:
+        old = baseline['benchmarks'].get(name)
+        if old is None:
+            print '%-40s %12s %12.6f %8s' % (name, '-', results['benchmarks'][name]['best'], 'new')
+            continue
+        # the best timings are the least affected by anything else running
+        change = results['benchmarks'][name]['best'] / old['best'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print '%-40s %12.6f %12.6f %+7.1f%%%s' % (name, old['best'], results['benchmarks'][name]['best'], change * 100, flag)
+    return regressions
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [--json results.json] [--baseline old.json] [options]')
+    corpus.addOptions(parser)
+    parser.add_option('--json', help='write the results as JSON to this file (- for standard output)')
+    parser.add_option('--baseline', help='compare the results with this earlier --json file')
+    parser.add_option('--threshold', type='float', default=DEFAULT_THRESHOLD,
+                      help='how much slower counts as a regression (default %s)' % DEFAULT_THRESHOLD)
+    parser.add_option('--repeat', type='int', default=DEFAULT_REPEAT,
+                      help='timings of each benchmark (default %d)' % DEFAULT_REPEAT)
+    parser.add_option('--min-time', type='float', default=DEFAULT_MIN_TIME,
+                      help='least seconds each timing takes (default %s)' % DEFAULT_MIN_TIME)
+    parser.add_option('--filter', default='', help='only run benchmarks with this in their name')
+    (options, args) = parser.parse_args()
+    # the table goes to standard error if the JSON goes to standard output
+    if options.json == '-':
+        sys.stdout = sys.stderr
+    logging.basicConfig(level=logging.WARNING)
+
+    directory = tempfile.mkdtemp(prefix='microbenchmarks')
+    try:
+        shape = corpus.fromOptions(options)
+        benchmarks = Benchmarks(shape, directory)
+        names = [name for name in benchmarks.names() if options.filter in name]
+        print 'Corpus: %s' % ', '.join(['%s=%s' % item for item in sorted(shape.parameters().items())])
+        print '%-40s %14s %14s %s' % ('benchmark', 'best', 'median', 'throughput')
+        results = {'format': RESULTS_FORMAT,
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'time': int(time.time()),
+                   'corpus': shape.parameters(),
+                   'benchmarks': runBenchmarks(benchmarks, names, options.repeat, options.min_time)}
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    if options.json == '-':
+        sys.__stdout__.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+    elif options.json:
+        fp = open(options.json, 'w')
+        try:
+            fp.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+        finally:
+            fp.close()
+
+    if options.baseline:
+        fp = open(options.baseline)
+        try:
+            baseline = json.load(fp)
+        finally:
+            fp.close()
+        regressions = compare(baseline, results, options.threshold)
+        if regressions:
+            print '%d benchmarks are more than %d%% slower than the baseline: %s' % \
+                (len(regressions), options.threshold * 100, ', '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -34,12 +34,20 @@ import re
 import logging
 import logging.handlers
 import signal
+import select
+import errno
 import time
 import SocketServer
+import socket
+import threading
+import Queue
 import zlib
 import urllib
 import CondorAgent.util
 import CondorAgent.schedd
+import CondorAgent.ad_json
+import CondorAgent.metrics
+import CondorAgent.profiling
 import CondorAgent.post_submit
 import CondorAgent.post_submit_cleanup
 
@@ -71,10 +79,10 @@ URL_schedd_SUBMIT = re.compile('^/condor/submit/?(?P<args>/?\?.*|/?)$')
 
 # condor_status URLs
 
-#/condor/schedd/             GET => Return schedd ads from condor_status -schedd -l
-#/condor/schedd/#Name/       Get => Return schedd ad from condor_status -schedd -name #Name -l
-#'^/condor/schedd/(?P<schedd_name>[^/]*)(?P<args>/?\?.*?|/?)$$'
-URL_schedd_STATUS = re.compile('^/condor/schedd/(?P<schedd_name>[^/]*)(?P<args>/?\?.*?|/?)$$')
+#/condor/schedd/#Name/?attrs=a,b  GET => Return the schedd ad from condor_status -schedd -l #Name,
+#                                        cached for CONDOR_AGENT_SCHEDD_AD_REFRESH seconds
+#'^/condor/schedd/(?P<schedd_name>[^/?]*)(?P<args>/?\?.*?|/?)$$'
+URL_schedd_STATUS = re.compile('^/condor/schedd/(?P<schedd_name>[^/?]*)(?P<args>/?\?.*?|/?)$$')
 
 # job handler condor_q/condor_history urls
 #/condor/schedd/#name/jobs/?attr=val&attr2=val2  GET => return ads from condor_q and condor history
@@ -83,30 +91,200 @@ URL_schedd_STATUS = re.compile('^/condor/schedd/(?P<schedd_name>[^/]*)(?P<args>/
 #'^/condor/schedd/(?P<schedd_name>[^/]*)/jobs/?(?P<cluster_id>[0-9]*)/?(?P<proc_id>[0-9]*)(?P<args>/?\?.*?|/?)$'
 URL_schedd_JOBS = re.compile('^/condor/schedd/(?P<schedd_name>[^/]*)/jobs(?P<args>/?\?.*|/?)$')
 
+# jobs of several schedds at once
+#/condor/schedds/jobs/?schedds=name1,name2&attr=val  GET => return the jobs of each schedd (all those
+#                                                            on this host if none are given)
+URL_schedds_JOBS = re.compile('^/condor/schedds/jobs(?P<args>/?\?.*|/?)$')
+
+# agent metrics
+#/metrics  GET => counters, gauges and histograms in the Prometheus text format
+URL_METRICS = re.compile('^/metrics/?(?P<args>\?.*|)$')
+
+# requests in flight
+#/debug/requests  GET => each request being handled, its phase and its thread's stack, if
+#                        CONDOR_AGENT_DEBUG_REQUESTS is True
+URL_DEBUG_REQUESTS = re.compile('^/debug/requests/?(?P<args>\?.*|)$')
+
 # Anything you want, that's the way you want it, anything you want...
 URL_ANY = re.compile('^.*$')
 
+# The URL patterns in the order they are tried, and the names of the
+# CondorAgentHandler methods that handle them. The methods take the match
+# object as input.
+URL_HANDLERS = [(URL_schedd_STATUS, 'getScheddStatus'),
+                (URL_schedd_JOBS, 'getScheddJobs'),
+                (URL_schedds_JOBS, 'getAllScheddJobs'),
+                (URL_schedd_SUBMIT, 'submit'),
+                (URL_METRICS, 'getMetrics'),
+                (URL_DEBUG_REQUESTS, 'getInflightRequests'),
+                (URL_ANY, 'getUnrecognizedURL')]
+
+# The size of the writes used when streaming a response
+STREAM_WRITE_SIZE = 64 * 1024
+
+# The number of threads handling requests unless CONDOR_AGENT_WORKER_THREADS
+# says otherwise (0 handles each connection in a thread of its own)
+DEFAULT_WORKER_THREADS = 16
+
+# The number of accepted connections that can wait for a worker
+DEFAULT_REQUEST_QUEUE = 32
+
+# Seconds between checks for a shutdown while waiting for connections
+SHUTDOWN_POLL_INTERVAL = 0.5
+
+# Seconds to wait on a client that has stopped sending or reading
+DEFAULT_SOCKET_TIMEOUT = 60
+
+# Seconds to keep an idle connection open waiting for the next request, and
+# the most requests to handle on one connection
+DEFAULT_KEEPALIVE_TIMEOUT = 15
+DEFAULT_KEEPALIVE_REQUESTS = 100
+
+# The most idle connections kept open with a thread per connection
+DEFAULT_KEEPALIVE_CONNECTIONS = 64
+
+# The largest body of a GET request that is read and dropped to keep the
+# connection open; the connection is closed instead for anything bigger
+MAX_DISCARDED_BODY = 64 * 1024
+
 
 ################################################################################
 # CLASSES
 ################################################################################
 
 class ThreadedHTTPServer(SocketServer.ThreadingMixIn, HTTPServer):
-    '''Empty class, semantics.'''
-    pass
+    '''A thread per connection. At most max_idle of them wait for another
+    request on an idle connection; past that connections are closed after
+    each response.'''
+    
+    # don't wait for connections to finish on exit
+    daemon_threads = True
+    max_idle = DEFAULT_KEEPALIVE_CONNECTIONS
+    
+    def __init__(self, server_address, RequestHandlerClass):
+        HTTPServer.__init__(self, server_address, RequestHandlerClass)
+        self.idle = 0
+        self.idleLock = threading.Lock()
+    
+    def is_busy(self):
+        '''Returns True if there are as many idle connections as allowed.'''
+        return self.idle >= self.max_idle
+    
+    def start_idle(self):
+        '''Returns True if a connection may wait for another request, counting
+        it as idle until end_idle is called.'''
+        self.idleLock.acquire()
+        try:
+            if self.is_busy():
+                return False
+            self.idle += 1
+            return True
+        finally:
+            self.idleLock.release()
+    
+    def end_idle(self):
+        self.idleLock.acquire()
+        try:
+            self.idle -= 1
+        finally:
+            self.idleLock.release()
+
+
+class PooledHTTPServer(HTTPServer):
+    '''Handles requests with a fixed number of worker threads instead of a
+    thread per request. Accepted connections wait for a free worker in a
+    queue of at most queue_size; when that is full they are answered at once
+    with a 503 asking the client to try again later.'''
+    
+    # seconds a client turned away is asked to wait before trying again
+    retry_after = 5
+    
+    def __init__(self, server_address, RequestHandlerClass, workers, queue_size):
+        self.workers = workers
+        self.requests = Queue.Queue(queue_size)
+        self.rejected = 0
+        # let the kernel hold on to as many connections as we will queue
+        self.request_queue_size = max(queue_size, HTTPServer.request_queue_size)
+        HTTPServer.__init__(self, server_address, RequestHandlerClass)
+        for i in range(workers):
+            worker = threading.Thread(target=self.work, name="Worker-%d" % i)
+            worker.setDaemon(True)
+            worker.start()
+    
+    def process_request(self, request, client_address):
+        '''Queues the connection for a worker.'''
+        try:
+            self.requests.put_nowait((request, client_address))
+        except Queue.Full:
+            self.reject_request(request, client_address)
+    
+    def is_busy(self):
+        '''Returns True if connections are waiting for a worker, in which
+        case workers should not wait on idle connections.'''
+        return not self.requests.empty()
+    
+    def start_idle(self):
+        '''Returns True if a worker may wait for another request on its
+        connection.'''
+        return not self.is_busy()
+    
+    def end_idle(self):
+        pass
+    
+    def work(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except:
+                self.handle_error(request, client_address)
+            self.close_request(request)
+    
+    def reject_request(self, request, client_address):
+        '''Sends a 503 without waiting for a worker.'''
+        self.rejected += 1
+        logging.warning('All %d workers are busy and %d requests are waiting, turning away %s' %
+                        (self.workers, self.requests.qsize(), client_address[0]))
+        try:
+            # read whatever the client has sent already, so closing the socket
+            # doesn't reset the connection before it sees the response
+            request.setblocking(0)
+            try:
+                request.recv(64 * 1024)
+            except socket.error:
+                pass
+            request.settimeout(1)
+            request.sendall('HTTP/1.0 503 Service Unavailable\r\n'
+                            'Content-Type: text/plain\r\n'
+                            'Retry-After: %d\r\n'
+                            'Connection: close\r\n'
+                            '\r\n'
+                            'The agent is busy, try again later\n' % self.retry_after)
+        except socket.error, e:
+            logging.debug('Unable to send 503 to %s: %s' % (client_address[0], str(e)))
+        self.close_request(request)
 
                                 
 class CondorAgentHandler(BaseHTTPRequestHandler):
     '''Used to handle RESTful calls to this agent made over HTTP.'''
     
+    # keep connections open between requests unless the client asks otherwise
+    protocol_version = 'HTTP/1.1'
+    # seconds to wait for the next request on an open connection
+    keepalive_timeout = DEFAULT_KEEPALIVE_TIMEOUT
+    # the most requests to handle on one connection before closing it
+    keepalive_requests = DEFAULT_KEEPALIVE_REQUESTS
+    # the status code and content encoding of the response being sent
+    responseCode = None
+    responseEncoding = None
+    # the phases of the request being handled (see CondorAgent.profiling)
+    requestState = None
+    
     def __init__(self, request, client_address, server):
         self.submitDir = None
-        # List of URL handlers
-        # URL handlers take the match_object as input
-        self.listURLHandlers=[(URL_schedd_STATUS, self.getScheddStatus),
-                              (URL_schedd_JOBS, self.getScheddJobs),
-                              (URL_schedd_SUBMIT, self.submit),
-                              (URL_ANY, self.getUnrecognizedURL)]
+        self.requestCount = 0
+        # True while waiting for another request on the connection
+        self.idle = False
         BaseHTTPRequestHandler.__init__(self, request, client_address, server)
     
     def initializeForSubmissions(self):
@@ -121,21 +299,254 @@ class CondorAgentHandler(BaseHTTPRequestHandler):
             logging.warning('Unabled to find submit directory %s -- attempting to create it now...' % self.submitDir)
             os.makedirs(self.submitDir)   
     
-    def requestAcceptsGZip(self):
-        '''Returns True if the requestor can handle a compressed stream.
-        Otherwise False.'''
-        accepts_gzip = False
-        if self.headers.has_key('Accept-Encoding'):
-            accepts_gzip = self.headers['Accept-Encoding'].find('gzip') != -1
-        return accepts_gzip
+    def requestEncoding(self):
+        '''Returns the content encoding ('gzip' or 'deflate') the requestor
+        would like the response compressed with, or None if it can't handle
+        a compressed stream.'''
+        return CondorAgent.util.negotiateEncoding(self.headers.get('Accept-Encoding'))
+    
+    def compressionLevel(self):
+        '''Returns the zlib level to compress responses at, from
+        CONDOR_AGENT_COMPRESSION_LEVEL.'''
+        try:
+            level = int(CondorAgent.util.getCondorConfigVal("CONDOR_AGENT_COMPRESSION_LEVEL", default=CondorAgent.util.COMPRESSION_LEVEL))
+        except ValueError:
+            level = CondorAgent.util.COMPRESSION_LEVEL
+        return min(max(level, 1), 9)
+    
+    def acceptsTrailers(self):
+        '''Returns True if the client said it accepts trailers (headers
+        after a chunked body) with TE: trailers.'''
+        for value in (self.headers.get('TE') or '').split(','):
+            if value.split(';')[0].strip().lower() == 'trailers':
+                return True
+        return False
+    
+    def requestWantsStream(self, args):
+        '''Returns True if the response should be streamed to the client
+        as it is produced. CONDOR_AGENT_STREAM_JOBS sets the default and a
+        stream=true|false argument overrides it.'''
+        stream = CondorAgent.util.getCondorConfigVal("CONDOR_AGENT_STREAM_JOBS", default="False")
+        if args.has_key('stream'):
+            stream = args['stream']
+        return stream.lower() == 'true'
+    
+    def handle(self):
+        '''Handles requests on the connection until the client closes it or
+        asks us to, it has been idle for keepalive_timeout seconds, or it
+        has had keepalive_requests requests.'''
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection:
+            if self.keepalive_timeout <= 0 or not self.server.start_idle():
+                # let a waiting connection have this worker, or there are
+                # enough idle connections already
+                break
+            self.idle = True
+            self.connection.settimeout(self.keepalive_timeout)
+            try:
+                try:
+                    self.handle_one_request()
+                except socket.timeout:
+                    # Python 2.6 and earlier don't catch this themselves
+                    break
+            finally:
+                self.endIdle()
+    
+    def endIdle(self):
+        '''Stops counting the connection as idle once a request arrives.'''
+        if self.idle:
+            self.idle = False
+            self.server.end_idle()
+    
+    def discardBody(self):
+        '''Reads and drops the body of a request that has no use for one, so
+        the next request on the connection can be read. The connection is
+        closed instead if the body is chunked or too big.'''
+        if self.headers.has_key('Transfer-Encoding'):
+            self.close_connection = 1
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_DISCARDED_BODY:
+            self.close_connection = 1
+            return
+        while length > 0:
+            data = self.rfile.read(min(length, STREAM_WRITE_SIZE))
+            if not data:
+                self.close_connection = 1
+                break
+            length -= len(data)
+    
+    def sendKeepAliveHeaders(self):
+        '''Tells the client if the connection will be closed after this
+        response. Call before end_headers.'''
+        if self.requestCount >= self.keepalive_requests or self.server.is_busy():
+            self.close_connection = 1
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+    
+    def requestMatchesETag(self, etag):
+        '''Returns True if the request's If-None-Match names etag, meaning
+        the client already has the response. ETags are compared weakly.'''
+        if_none_match = self.headers.get('If-None-Match')
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag == '*' or tag.replace('W/', '', 1) == etag.replace('W/', '', 1):
+                return True
+        return False
+    
+    def sendNotModified(self, etag):
+        '''Sends a 304, which has no body.'''
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.sendKeepAliveHeaders()
+        self.end_headers()
+    
+    def send_response(self, code, message=None):
+        # remembered for the request metrics
+        self.responseCode = code
+        BaseHTTPRequestHandler.send_response(self, code, message)
+    
+    def sendResponse(self, code, data, content_type='text/plain', encoding=None, headers=()):
+        '''Sends a response with all of its body, framed with Content-Length
+        so the connection can be used again. headers is a list of any other
+        (header, value) pairs to send.'''
+        self.send_response(code)
+        logging.debug("Sending headers.")
+        for header, value in headers:
+            self.send_header(header, value)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-cache')
+        if self.requestState:
+            # the time spent writing the body isn't known yet
+            self.send_header('Server-Timing', self.requestState.serverTiming())
+        self.sendKeepAliveHeaders()
+        self.end_headers()
+        CondorAgent.profiling.measure('send', self.wfile.write, data)
+        self.countBody(len(data), encoding)
+    
+    def sendStream(self, pieces, content_type, encoding=None, headers=()):
+        '''Sends a 200 response whose body is generated by pieces, writing
+        it out as it is generated instead of building it all first. HTTP/1.1
+        clients get it with chunked transfer encoding and can use the
+        connection again; HTTP/1.0 clients get it unframed and the connection
+        is closed at the end. If encoding is given the body is compressed
+        with it as it goes. An
+        error raised before the first piece is generated is reported with a
+        500 as usual; once the headers are out the only way to report one is
+        to drop the connection before the response is complete. headers is a
+        list of any other (header, value) pairs to send. The Server-Timing
+        header only has the time taken to generate the first piece, unless
+        the client accepts trailers, when it is sent after the body
+        instead.'''
+        if encoding:
+            pieces = CondorAgent.profiling.timed('compress',
+                CondorAgent.util.encodeStream(pieces, encoding, self.compressionLevel()))
+        self.responseEncoding = encoding
+        pieces = iter(pieces)
+        try:
+            first = pieces.next()
+        except StopIteration:
+            first = ''
+        chunked = self.request_version == 'HTTP/1.1'
+        if not chunked:
+            # the end of the body is the end of the connection
+            self.close_connection = 1
+        trailer = chunked and self.requestState and self.acceptsTrailers()
+        logging.debug("Sending response to client.")
+        self.send_response(200)
+        logging.debug("Sending headers.")
+        for header, value in headers:
+            self.send_header(header, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-cache')
+        if trailer:
+            self.send_header('Trailer', 'Server-Timing')
+        elif self.requestState:
+            self.send_header('Server-Timing', self.requestState.serverTiming())
+        self.sendKeepAliveHeaders()
+        self.end_headers()
+        logging.debug("Sending response body.")
+        try:
+            # collect the pieces into writes of a reasonable size
+            buf = [first]
+            buffered = len(first)
+            for piece in pieces:
+                buf.append(piece)
+                buffered += len(piece)
+                if buffered >= STREAM_WRITE_SIZE:
+                    self.writeBody(''.join(buf), chunked)
+                    buf = []
+                    buffered = 0
+            self.writeBody(''.join(buf), chunked)
+            if trailer:
+                self.wfile.write('0\r\nServer-Timing: %s\r\n\r\n' % self.requestState.serverTiming())
+            elif chunked:
+                self.wfile.write('0\r\n\r\n')
+        except Exception, e:
+            logging.error('Error streaming response, closing the connection: %s' % str(e))
+            self.close_connection = 1
+            return
+        logging.debug("Response complete.")
+    
+    def writeBody(self, data, chunked):
+        if not data:
+            # an empty chunk would end the response
+            return
+        size = len(data)
+        if chunked:
+            data = '%x\r\n%s\r\n' % (size, data)
+        CondorAgent.profiling.measure('send', self.wfile.write, data)
+        self.countBody(size, self.responseEncoding)
+    
+    def countBody(self, size, encoding):
+        '''Adds size bytes of response body sent with the content encoding
+        to the metrics.'''
+        encoding = encoding or 'identity'
+        CondorAgent.metrics.responseBytes.inc((encoding,), size)
+        if encoding == 'identity':
+            CondorAgent.metrics.responseUncompressedBytes.inc((encoding,), size)
     
     def getScheddStatus(self, match_obj):
-        # needs to return schedd classad
-        raise exceptions.NotImplementedError
+        matches      = match_obj.groupdict()
+        encoding     = self.requestEncoding()
+        
+        schedd_name = urllib.unquote(matches['schedd_name'])
+        logging.info("Requested ScheddName: " + schedd_name)
+        if not schedd_name:
+            raise Exception("No schedd name given")
+        
+        args = CondorAgent.util.processRequestArgs(matches['args'])
+        logging.info("Requested Args: " + str(args))
+        
+        data = CondorAgent.schedd.scheddAds.get(schedd_name)
+        # Argument: attrs=TotalRunningJobs,TotalIdleJobs
+        if args.has_key('attrs'):
+            attrs = CondorAgent.util.parseAttributeList(args['attrs'])
+            logging.info("Attributes: %s" % ','.join(attrs))
+            data = CondorAgent.util.projectAdText(data, CondorAgent.util.attributeSet(attrs))
+        
+        if encoding:
+            logging.debug("Agent returning %s data." % encoding)
+            data = CondorAgent.util.encodeBuffer(data, encoding, self.compressionLevel())
+        self.sendResponse(200, data, 'text/plain', encoding)
     
     def getScheddJobs(self, match_obj):
         matches      = match_obj.groupdict()
-        accepts_gzip = self.requestAcceptsGZip()
+        encoding     = self.requestEncoding()
         daemon       = 'schedd'
         logging.info("Requested Daemon: " + daemon)
         
@@ -145,6 +556,50 @@ class CondorAgentHandler(BaseHTTPRequestHandler):
         args = CondorAgent.util.processRequestArgs(matches['args'])
         logging.info("Requested Args: " + str(args))
         
+        completedSince, history, jobs, syncToken, attrs, constraint, outputFormat = self.jobsArguments(args)
+        content_type = 'text/plain'
+        if outputFormat != 'text':
+            content_type = CondorAgent.ad_json.FORMATS[outputFormat]
+        
+        query = CondorAgent.schedd.ScheddQuery(schedd_name, attrs, constraint)
+        headers = []
+        etag = query.getETag(completedSince, jobs, history, syncToken)
+        if etag and outputFormat != 'text':
+            # the same jobs in a different format
+            etag = etag[:-1] + '-' + outputFormat + '"'
+        if etag:
+            if self.requestMatchesETag(etag):
+                logging.info("Jobs unchanged since the client's copy, sending 304")
+                self.sendNotModified(etag)
+                return
+            headers.append(('ETag', etag))
+        if self.requestWantsStream(args):
+            logging.debug("Agent streaming response data.")
+            pieces = query.stream(completedSince, jobs, history, syncToken)
+            if outputFormat != 'text':
+                pieces = CondorAgent.profiling.timed('json', CondorAgent.ad_json.streamJSON(pieces, outputFormat))
+            self.sendStream(pieces, content_type, encoding, headers)
+            return
+        if outputFormat != 'text':
+            data = "".join(CondorAgent.profiling.timed('json',
+                CondorAgent.ad_json.streamJSON(query.stream(completedSince, jobs, history, syncToken), outputFormat)))
+        else:
+            data  = query.execute(completedSince, jobs, history, syncToken)
+        logging.debug("Retrieved jobs data.")
+        
+        if encoding:
+            logging.debug("Agent returning %s data." % encoding)
+            data = CondorAgent.profiling.measure('compress', CondorAgent.util.encodeBuffer, data, encoding, self.compressionLevel())
+        else:
+            logging.debug("Agent returning uncompressed response data.")
+        
+        logging.debug("Sending response to client.")
+        self.sendResponse(200, data, content_type, encoding, headers)
+        logging.debug("Response complete.")
+    
+    def jobsArguments(self, args):
+        '''Returns completedSince, history, jobs, syncToken, attrs,
+        constraint and format from the arguments of a jobs request.'''
         #Look at arguments to determine when to get jobs from
         completedSince = 0
         if args.has_key('completedSince'):
@@ -166,28 +621,84 @@ class CondorAgentHandler(BaseHTTPRequestHandler):
         else:
             logging.debug("No specific jobs or clusters specified in Request. All jobs' data will be returned.")
         
-        query = CondorAgent.schedd.ScheddQuery(schedd_name)
-        data  = query.execute(completedSince, jobs, history)
-        logging.debug("Retrieved jobs data.")
+        # Argument: syncToken=<token from the last response>, or empty to start
+        syncToken = None
+        if args.has_key('syncToken'):
+            syncToken = args['syncToken'].strip()
+            logging.info("SyncToken: %s" % syncToken)
+        
+        # Argument: attrs=ClusterId,ProcId,JobStatus (ClusterId and ProcId are always returned)
+        attrs = None
+        if args.has_key('attrs'):
+            attrs = CondorAgent.util.parseAttributeList(args['attrs'])
+            logging.info("Attributes: %s" % ','.join(attrs))
+        
+        # Argument: constraint=<ClassAd expression>, e.g. JobStatus == 2 && Owner == "alice"
+        constraint = None
+        if args.has_key('constraint') and args['constraint'].strip():
+            constraint = args['constraint'].strip()
+            logging.info("Constraint: %s" % constraint)
+        
+        # Argument: format=text (the default), json or ndjson; see CondorAgent.ad_json
+        outputFormat = args.get('format', 'text').strip().lower()
+        if outputFormat != 'text':
+            if not CondorAgent.ad_json.FORMATS.has_key(outputFormat):
+                raise Exception("Unknown format: %s" % outputFormat)
+            logging.info("Format: %s" % outputFormat)
+        
+        return (completedSince, history, jobs, syncToken, attrs, constraint, outputFormat)
+    
+    def getAllScheddJobs(self, match_obj):
+        '''Returns the jobs of several schedds (those named by the schedds
+        argument, or else all of those on this host) in one response,
+        querying up to CONDOR_AGENT_SCHEDD_THREADS of them at once. Each
+        schedd's part starts with a "-- Schedd: <name>" line and is sent as
+        soon as it is ready, and a schedd that fails has an "-- Error:" line
+        in place of the rest of its part.'''
+        matches      = match_obj.groupdict()
+        encoding     = self.requestEncoding()
         
-        if accepts_gzip:
-            logging.debug("Agent returning gzipped data.")
-            data = CondorAgent.util.gzipBuffer(data)
+        args = CondorAgent.util.processRequestArgs(matches['args'])
+        logging.info("Requested Args: " + str(args))
+        
+        completedSince, history, jobs, syncToken, attrs, constraint, outputFormat = self.jobsArguments(args)
+        if outputFormat == 'json':
+            raise Exception("The json format isn't available for several schedds, use ndjson")
+        content_type = 'text/plain'
+        if outputFormat != 'text':
+            content_type = CondorAgent.ad_json.FORMATS[outputFormat]
+        
+        # Argument: schedds=name1,name2
+        if args.has_key('schedds') and args['schedds'].strip():
+            schedd_names = [name for name in re.split('[,\s]+', args['schedds'].strip()) if name]
         else:
-            logging.debug("Agent returning uncompressed response data.")
+            schedd_names = CondorAgent.schedd.getLocalScheddNames()
+        logging.info("Requested Schedds: %s" % ', '.join(schedd_names))
         
-        logging.debug("Sending response to client.")
-        self.send_response(200)
-        logging.debug("Sending headers.")
-        if accepts_gzip:
-            self.send_header('Content-Encoding', 'gzip')
-            self.send_header('Content-Length', len(data))
-        self.send_header('Content-Type', 'text/plain')
-        self.send_header('Cache-Control', 'no-cache')
-        self.end_headers()
-        logging.debug("Sending response body.")
-        self.wfile.write(data)    
-        logging.debug("Response complete.")
+        sections = []
+        for schedd_name in schedd_names:
+            # Arguments: completedSince.<name>=<time>, syncToken.<name>=<token> for one schedd
+            since = completedSince
+            if args.has_key('completedSince.' + schedd_name):
+                since = int(args['completedSince.' + schedd_name])
+            token = args.get('syncToken.' + schedd_name, syncToken)
+            if token is not None:
+                token = token.strip()
+            query = CondorAgent.schedd.ScheddQuery(schedd_name, attrs, constraint)
+            sections.append(CondorAgent.schedd.streamScheddSection(schedd_name,
+                query.stream(since, jobs, history, token), outputFormat))
+        workers = int(CondorAgent.util.getCondorConfigVal("CONDOR_AGENT_SCHEDD_THREADS",
+                                                          default=CondorAgent.schedd.DEFAULT_SCHEDD_THREADS))
+        pieces = (piece for i, piece in CondorAgent.util.parallelSections(sections, workers))
+        if self.requestWantsStream(args):
+            logging.debug("Agent streaming response data.")
+            self.sendStream(pieces, content_type, encoding)
+            return
+        data = "".join(pieces)
+        if encoding:
+            logging.debug("Agent returning %s data." % encoding)
+            data = CondorAgent.profiling.measure('compress', CondorAgent.util.encodeBuffer, data, encoding, self.compressionLevel())
+        self.sendResponse(200, data, content_type, encoding)
     
     def submit(self, match_obj):
         if not self.submitDir:
@@ -195,32 +706,78 @@ class CondorAgentHandler(BaseHTTPRequestHandler):
         data = CondorAgent.post_submit.do_submit(self, self.submitDir)
         if not data:
             raise Exception('Encountered an unknown error submitting job, no cluster ID was returned')
-        logging.debug("Sending response to client.")
-        self.send_response(200)
-        self.send_header('Content-Type', 'text/plain')
-        self.send_header('Cache-Control', 'no-cache')
-        self.end_headers()
-        logging.debug("Sending response body: %s" % str(data))
-        self.wfile.write("%s" % str(data))
+        logging.debug("Sending response to client: %s" % str(data))
+        self.sendResponse(200, str(data))
+    
+    def getMetrics(self, match_obj):
+        '''Returns the agent's metrics (see CondorAgent.metrics). This runs no
+        commands and takes no locks the other requests need.'''
+        encoding = self.requestEncoding()
+        data = CondorAgent.metrics.registry.render()
+        if encoding:
+            data = CondorAgent.util.encodeBuffer(data, encoding, self.compressionLevel())
+        self.sendResponse(200, data, CondorAgent.metrics.CONTENT_TYPE, encoding)
+    
+    def getInflightRequests(self, match_obj):
+        '''Returns each request being handled, with the phase it is in, the
+        time of the phases so far and its thread's stack (see
+        CondorAgent.profiling). Only available if CONDOR_AGENT_DEBUG_REQUESTS
+        is True, as the stacks show the agent's workings.'''
+        enabled = CondorAgent.util.getCondorConfigVal("CONDOR_AGENT_DEBUG_REQUESTS", default="False")
+        if enabled.lower() != 'true':
+            self.getUnrecognizedURL(match_obj)
+            return
+        encoding = self.requestEncoding()
+        data = CondorAgent.profiling.renderInflight()
+        if encoding:
+            data = CondorAgent.util.encodeBuffer(data, encoding, self.compressionLevel())
+        self.sendResponse(200, data, 'text/plain', encoding)
+    
+    def profileDirectory(self):
+        '''Returns the directory to write a profile of this request to, or
+        None if it isn't to be profiled (see CondorAgent.profiling.Profiler).'''
+        requested = False
+        given = self.headers.get(CondorAgent.profiling.PROFILE_HEADER)
+        if given:
+            secret = CondorAgent.util.getCondorConfigVal("CONDOR_AGENT_PROFILE_SECRET")
+            requested = CondorAgent.profiling.sameSecret(given.strip(), (secret or '').replace('"', ''))
+            if not requested:
+                logging.warning("Ignoring %s header with the wrong secret" % CondorAgent.profiling.PROFILE_HEADER)
+        return CondorAgent.profiling.profiles.choose(requested)
     
     def getUnrecognizedURL(self, match_obj):
-        self.send_response(404)
-        self.send_header('Content-type', 'text/plain')
-        self.end_headers()
-        self.wfile.write("Path '%s' not found" % self.path)
+        if self.command != 'GET' and (self.headers.has_key('Content-Length') or self.headers.has_key('Transfer-Encoding')):
+            # we haven't read the body so we can't read another request
+            self.close_connection = 1
+        self.sendResponse(404, "Path '%s' not found" % self.path)
     
     def handle_response(self):
+        started = time.time()
+        handler = 'none'
+        self.responseCode = None
+        self.requestState = CondorAgent.profiling.begin(self.command, self.path)
+        CondorAgent.metrics.requestsInProgress.inc()
         try:
             try:
+                # the connection may have been waiting with the idle timeout
+                self.endIdle()
+                self.connection.settimeout(getattr(self, 'timeout', None))
+                if self.command == 'GET':
+                    self.discardBody()
+                self.requestCount += 1
                 logging.info("Received URL request: " + self.path)
                 # Strip off any URL-encoded parameters from the path
                 logging.info("Headers: \n%s" %str(self.headers).strip())
-                for i in range(len(self.listURLHandlers)):
-                    match_obj = self.listURLHandlers[i][0].match(self.path)
-                    if match_obj:
-                        logging.info( "Matched URL index #%d" %i)
-                        self.listURLHandlers[i][1](match_obj)
-                        break
+                i, handler, match_obj = matchURL(self.path)
+                logging.info( "Matched URL index #%d" %i)
+                self.requestState.handler = handler
+                self.requestState.phase = handler
+                directory = self.profileDirectory()
+                if directory:
+                    CondorAgent.profiling.profiles.run(directory, self.requestState,
+                                                       getattr(self, handler), match_obj)
+                else:
+                    getattr(self, handler)(match_obj)
                     
             except Exception, e:
                 # we construct the response because send_error puts the whole message in the headers
@@ -229,15 +786,18 @@ class CondorAgentHandler(BaseHTTPRequestHandler):
                     logging.error('Current working directory: %s' % os.getcwd())
                 except Exception, e:
                     logging.error('Unable to determine current working directory!')
-                self.send_response(500)
-                self.send_header('Content-Type', 'text/plain')
-                self.send_header('Cache-Control', 'no-cache')
-                self.end_headers()
-                self.wfile.write('Error fulfilling request:\n%s\n' % (str(e)))
+                # we don't know what was read or written before the error
+                self.close_connection = 1
+                self.sendResponse(500, 'Error fulfilling request:\n%s\n' % (str(e)))
         except:
             # the HTTPServer base class can hang on uncaught exceptions
             # (case 5090, BaseException does not exist until Python 2.5)
             logging.error("Uncaught exception")
+        CondorAgent.metrics.requestsInProgress.dec()
+        CondorAgent.metrics.requestSeconds.observe((handler, str(self.responseCode)), time.time() - started)
+        logging.info("Timings: %s" % self.requestState.summary())
+        CondorAgent.profiling.end(self.requestState)
+        self.requestState = None
     
     def do_GET(self):
         self.handle_response()
@@ -255,23 +815,31 @@ class CondorAgentHandler(BaseHTTPRequestHandler):
 
 
 class Shutdown:
-    '''Used to send a shutdown request to its own web service when a signal
-    is caught. Python 2.5 does not support a way to shut down the server
-    directly.'''
+    '''Used to stop the server when a signal is caught. The main loop waits for
+    connections with a timeout (Python 2.5 does not support a way to shut down
+    the server directly) and stops once stop is set.'''
     
-    def __init__(self, url):
+    def __init__(self):
         self.stop = False
-        self.url = url
     
     def shutdown(self):
         self.stop = True
-        urllib.urlopen(self.url)
     
 
 
 ################################################################################
 # METHODS
 ################################################################################
+def matchURL(path):
+    '''Returns the index in URL_HANDLERS of the first pattern that matches
+    the path, the name of the method that handles it and the match object.'''
+    for i in range(len(URL_HANDLERS)):
+        match_obj = URL_HANDLERS[i][0].match(path)
+        if match_obj:
+            return (i, URL_HANDLERS[i][1], match_obj)
+    # URL_ANY matches everything
+    raise Exception("No handler for path '%s'" % path)
+
 
 def main():
     '''The main method that drives the daemon. Starts an infinite loop that handles
@@ -284,8 +852,13 @@ def main():
  
         logging.info('Received signal %i, shutting down server' % signal)
         print 'Received signal %i, shutting down server' % signal
-        server.socket.close()
-        sys.exit(0)
+        shutdown.shutdown()
+
+    def reconfig(signal, frame):
+        '''condor_reconfig sends SIGHUP. Forget any cached configuration so
+        the new settings are picked up.'''
+        logging.info('Received signal %i, clearing cached configuration' % signal)
+        CondorAgent.util.configCache.invalidate('SIGHUP')
 
     # We need access to the Condor binaries on this machine in order to complete
     # requests and return data. Set up the PATH so we have access to the things
@@ -336,6 +909,9 @@ def main():
     logger.addHandler(hdlr)
     logger.setLevel(log_level)
     
+    # How long to cache configuration values for (0 turns the cache off)
+    CondorAgent.util.configCache.ttl = int(CondorAgent.util.getCondorConfigVal("CONDOR_AGENT_CONFIG_CACHE_TTL", default=CondorAgent.util.CONFIG_CACHE_TTL))
+    
     try:
         logging.info("\n\nStarting CondorAgent v%s..." % __version__)
         logging.info("Arguments: %s" % str(sys.argv))
@@ -351,8 +927,7 @@ def main():
             port = 8008
             logging.warning('Unable to find valid port in condor configuration, using default %d' % port)
         
-        url = "http://localhost:" + str(port) + "/_shutdown"
-        shutdown = Shutdown(url)
+        shutdown = Shutdown()
         
         # Standard ways of killing this in Unix (SIGTERM) work automatically, 
         # but the standard way in Windows (WM_CLOSE) requires careful handling.
@@ -362,14 +937,36 @@ def main():
         
         print "Waiting for incoming requests on port %d (press ^C to stop)..." % port
         
+        # Drop clients that stop sending or receiving for this long
+        socket_timeout = int(CondorAgent.util.getCondorConfigVal("CONDOR_AGENT_SOCKET_TIMEOUT", default=DEFAULT_SOCKET_TIMEOUT))
+        if socket_timeout > 0:
+            CondorAgentHandler.timeout = socket_timeout
+        # How long and for how many requests to keep connections open
+        CondorAgentHandler.keepalive_timeout = int(CondorAgent.util.getCondorConfigVal("CONDOR_AGENT_KEEPALIVE_TIMEOUT", default=DEFAULT_KEEPALIVE_TIMEOUT))
+        CondorAgentHandler.keepalive_requests = int(CondorAgent.util.getCondorConfigVal("CONDOR_AGENT_KEEPALIVE_REQUESTS", default=DEFAULT_KEEPALIVE_REQUESTS))
+        ThreadedHTTPServer.max_idle = int(CondorAgent.util.getCondorConfigVal("CONDOR_AGENT_KEEPALIVE_CONNECTIONS", default=DEFAULT_KEEPALIVE_CONNECTIONS))
+        
         # Start web service interface
-        server = ThreadedHTTPServer(('', port), CondorAgentHandler)
-        logging.info("Created web server at port %d" % port)
+        workers = CondorAgent.util.getCondorConfigVal("CONDOR_AGENT_WORKER_THREADS")
+        if workers:
+            workers = int(workers)
+        else:
+            workers = DEFAULT_WORKER_THREADS
+        if workers > 0:
+            queue_size = int(CondorAgent.util.getCondorConfigVal("CONDOR_AGENT_REQUEST_QUEUE", default=DEFAULT_REQUEST_QUEUE))
+            server = PooledHTTPServer(('', port), CondorAgentHandler, workers, queue_size)
+            logging.info("Created web server at port %d with %d workers and room for %d waiting requests" % (port, workers, queue_size))
+        else:
+            server = ThreadedHTTPServer(('', port), CondorAgentHandler)
+            logging.info("Created web server at port %d" % port)
+        CondorAgent.metrics.registry.collect('condor_agent_rejected_requests_total', 'counter',
+            'Connections turned away with a 503 because every worker was busy', lambda: getattr(server, 'rejected', 0))
         
-        # Capture SIGINT and SIGQUIT
+        # Capture SIGINT and SIGQUIT, and SIGHUP for reconfig
         signal.signal(signal.SIGINT,cleanShutdown)
         if os.name != 'nt':
             signal.signal(signal.SIGQUIT,cleanShutdown)
+            signal.signal(signal.SIGHUP,reconfig)
             
         # 1.12: Switch user context to the CONDOR_IDS user before we start polling
         # for things on the port we just opened up. Don't do this on Windows!
@@ -416,13 +1013,19 @@ def main():
                 logging.error('Unable to create local submission cleanup thread: LocalSubmitCleaner() returned None')
                 raise Exception('Unable to create local submission cleanup thread')
         
-        while True:
-            server.handle_request()
-            if shutdown.stop:
-                break
-        
-        # wait for the shutdown request to finish cleanly
-        time.sleep(0.5)
+        # Wait for connections with a timeout rather than in handle_request()
+        # so a shutdown is noticed without another request coming in
+        while not shutdown.stop:
+            try:
+                ready = select.select([server.socket], [], [], SHUTDOWN_POLL_INTERVAL)[0]
+            except select.error, e:
+                # interrupted by a signal
+                if e[0] != errno.EINTR:
+                    raise
+                continue
+            if ready:
+                server.handle_request()
+        server.server_close()
     
     except Exception, e:
         logging.error(e)